@@ -1,6 +1,4 @@
 import streamlit as st
-import openai
-import os
 import yaml
 
 from capabilities import (
@@ -11,11 +9,7 @@ from capabilities import (
     add_to_knowledge,
     get_relevant_knowledge,
 )
-
-
-# Point OpenAI to the API key
-openai.api_key = os.environ["OPENAI_API_KEY"]
-
+from capabilities.helpers.streaming import render_stream
 
 st.title("PolicyEngine AI")
 st.write(
@@ -46,11 +40,18 @@ with create_parameters_tab:
     information = st.text_area(
         "Information", "The UK personal tax allowance. was 12.5k in 2020."
     )
+    validate = st.checkbox(
+        "Validate files",
+        help="Check each file parses as it arrives, and regenerate any which don't.",
+        key="create_parameters_validate",
+    )
     submit = st.button("Create parameters")
     if submit:
         placeholder = st.empty()
-        for result in create_parameters(information):
-            placeholder.write(result)
+        render_stream(
+            create_parameters(information, deltas=True, validate=validate),
+            placeholder.write,
+        )
 
 with create_variables_tab:
     st.write(
@@ -61,11 +62,18 @@ with create_variables_tab:
         "Information",
         "The UK personal tax allowance. was 12.5k in 2020. The UK personal tax allowance. was 12.5k in 2020.",
     )
+    validate = st.checkbox(
+        "Validate files",
+        help="Check each file parses as it arrives, and regenerate any which don't.",
+        key="create_variables_validate",
+    )
     submit = st.button("Create variables")
     if submit:
         placeholder = st.empty()
-        for result in create_variables(information):
-            placeholder.write(result)
+        render_stream(
+            create_variables(information, deltas=True, validate=validate),
+            placeholder.write,
+        )
 
 with model_policy_tab:
     st.write(
@@ -76,11 +84,24 @@ with model_policy_tab:
         "Information",
         "A personal tax credit that phases in with income at 30%, up to a maximum of 1k, and then out at 10%, down to a minimum of 0.",
     )
+    pipeline = st.checkbox(
+        "Generate each file in parallel",
+        help="Plan the files needed first, then write them all at once.",
+    )
+    validate = st.checkbox(
+        "Validate files",
+        help="Check each file parses as it arrives, and regenerate any which don't.",
+        key="model_policy_validate",
+    )
     submit = st.button("Model policy")
     if submit:
         placeholder = st.empty()
-        for result in model_policy(information):
-            placeholder.write(result)
+        render_stream(
+            model_policy(
+                information, deltas=True, pipeline=pipeline, validate=validate
+            ),
+            placeholder.write,
+        )
 
 with parse_legislation_tab:
     st.write(
@@ -94,8 +115,9 @@ with parse_legislation_tab:
     submit = st.button("Parse legislation")
     if submit:
         placeholder = st.empty()
-        for result in parse_legislation(information):
-            placeholder.write(result)
+        render_stream(
+            parse_legislation(information, deltas=True), placeholder.write
+        )
 
 # The knowledge base tab allows people to add knowledge from a text area, and then ask a question about it.
 
@@ -108,10 +130,18 @@ with knowledge_base_tab:
         "Information",
         "Context here",
     )
+    jurisdiction = (
+        st.text_input("Jurisdiction (optional)", key="add_jurisdiction")
+        .strip()
+        .lower()
+    )
     submit = st.button("Add to knowledge base")
     if submit:
         placeholder = st.empty()
-        add_to_knowledge(information)
+        add_to_knowledge(
+            information,
+            metadata=dict(jurisdiction=jurisdiction) if jurisdiction else None,
+        )
 
     st.write(
         "This tab allows you to ask a question about the knowledge base. The AI will generate a markdown version of the knowledge based on the information you provide."
@@ -121,8 +151,25 @@ with knowledge_base_tab:
         "Information",
         "A question here",
     )
+    jurisdiction = (
+        st.text_input(
+            "Only use knowledge from jurisdiction (optional)",
+            key="question_jurisdiction",
+        )
+        .strip()
+        .lower()
+    )
     submit = st.button("Get relevant knowledge")
     if submit:
         placeholder = st.empty()
-        for result in get_relevant_knowledge(information):
-            placeholder.write(result.replace("$", "\\$"))
+        render_stream(
+            get_relevant_knowledge(
+                information,
+                deltas=True,
+                filters=(
+                    dict(jurisdiction=jurisdiction) if jurisdiction else None
+                ),
+            ),
+            placeholder.write,
+            transform=lambda text: text.replace("$", "\\$"),
+        )
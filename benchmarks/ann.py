@@ -0,0 +1,91 @@
+"""Report recall@k and p50/p99 query latency of the IVF index against brute-force search in
+NumPyKnowledgeBase, for a range of n_probe settings.
+
+Usage:
+    python -m benchmarks.ann --chunks 200000 --queries 200 --n-probe 1 4 16 64
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks.common import HashingEmbedder
+from capabilities.helpers.ann import IVFIndex
+from capabilities.helpers.knowledge_bases import NumPyKnowledgeBase, top_k
+
+
+def clustered_embeddings(
+    n: int, dim: int = 768, n_topics: int = 500, seed: int = 0
+) -> np.ndarray:
+    """Normalised vectors scattered around random topic centres, like real text embeddings."""
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((n_topics, dim), dtype=np.float32)
+    embeddings = centres[rng.integers(0, n_topics, n)]
+    embeddings += 0.8 * rng.standard_normal((n, dim), dtype=np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings
+
+
+def latencies(search, query_embeddings) -> tuple:
+    times, results = [], []
+    for query_embedding in query_embeddings:
+        start = time.perf_counter()
+        results.append(search(query_embedding))
+        times.append(time.perf_counter() - start)
+    return np.array(times), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=200_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument(
+        "--n-probe", type=int, nargs="+", default=[1, 4, 16, 64]
+    )
+    args = parser.parse_args()
+
+    embeddings = clustered_embeddings(args.chunks + args.queries)
+    corpus, query_embeddings = (
+        embeddings[: args.chunks],
+        embeddings[args.chunks :],
+    )
+    index = IVFIndex()
+    knowledge = NumPyKnowledgeBase(model=HashingEmbedder(), index=index)
+    start = time.perf_counter()
+    knowledge.add_embedded([str(i) for i in range(args.chunks)], corpus)
+    print(
+        f"Built an index of {len(index.centroids)} lists in "
+        f"{time.perf_counter() - start:.1f} s"
+    )
+
+    exact_times, exact = latencies(
+        lambda q: top_k(knowledge._scores(q), args.k)[0], query_embeddings
+    )
+    print(
+        f"{'brute force':>12}: recall@{args.k} 1.000, "
+        f"p50 {np.percentile(exact_times, 50) * 1000:7.2f} ms, "
+        f"p99 {np.percentile(exact_times, 99) * 1000:7.2f} ms"
+    )
+    for n_probe in args.n_probe:
+        index.n_probe = n_probe
+        times, approximate = latencies(
+            lambda q: knowledge._search_index(q[None], args.k)[0][0],
+            query_embeddings,
+        )
+        recall = np.mean(
+            [
+                len(set(a.tolist()) & set(e.tolist())) / args.k
+                for a, e in zip(approximate, exact)
+            ]
+        )
+        print(
+            f"{f'n_probe={n_probe}':>12}: recall@{args.k} {recall:.3f}, "
+            f"p50 {np.percentile(times, 50) * 1000:7.2f} ms, "
+            f"p99 {np.percentile(times, 99) * 1000:7.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
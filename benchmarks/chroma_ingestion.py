@@ -0,0 +1,66 @@
+"""Compare ChromaKnowledgeBase ingestion against the previous per-chunk lookup path.
+
+Usage:
+    python -m benchmarks.chroma_ingestion --sections 300
+"""
+
+import argparse
+import time
+
+from benchmarks.common import HashingEmbedder, synthetic_legislation
+from capabilities.helpers.cache import EmbeddingCache
+from capabilities.helpers.knowledge_bases import ChromaKnowledgeBase
+from capabilities.helpers.text_splitters import section_header_split
+
+
+def add_per_chunk(knowledge: ChromaKnowledgeBase, text: str):
+    """The previous ingestion path: embed everything, then one `get` per chunk."""
+    values = list(set(section_header_split(text)))
+    embeddings = knowledge.model.encode(values)
+    values_to_add, embeddings_to_add, ids = [], [], []
+    for v, e in zip(values, embeddings):
+        id = str(hash(v))
+        if knowledge.collection.get(ids=[id])["ids"]:
+            continue
+        values_to_add.append(v)
+        embeddings_to_add.append(e.tolist())
+        ids.append(id)
+    if ids:
+        knowledge.collection.add(
+            embeddings=embeddings_to_add, documents=values_to_add, ids=ids
+        )
+
+
+def add_batched(knowledge: ChromaKnowledgeBase, text: str):
+    knowledge.add(text, split_fn=section_header_split)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sections", type=int, default=300)
+    parser.add_argument("--batch-size", type=int, default=1_000)
+    args = parser.parse_args()
+
+    text = synthetic_legislation(args.sections)
+    for name, add in (("per-chunk", add_per_chunk), ("batched", add_batched)):
+        embedder = HashingEmbedder()
+        knowledge = ChromaKnowledgeBase(
+            model=embedder,
+            name=f"benchmark-{name}",
+            batch_size=args.batch_size,
+            embedding_cache=EmbeddingCache(),
+        )
+        for run in ("first ingest", "re-ingest"):
+            encoded = embedder.encoded
+            start = time.perf_counter()
+            add(knowledge, text)
+            elapsed = time.perf_counter() - start
+            print(
+                f"{name:>10} {run:>12}: {elapsed * 1000:9.1f} ms, "
+                f"{embedder.encoded - encoded:6d} chunks encoded, "
+                f"{knowledge.collection.count():6d} stored"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Offline stand-ins shared by the benchmarks: a seeded synthetic legislation generator and a
+small hashing embedder which mimics `SentenceTransformer.encode`."""
+
+from typing import List, Union
+
+import hashlib
+import random
+import re
+
+import numpy as np
+
+VOCABULARY = (
+    "tax credit income allowance individual household taxpayer dependent "
+    "qualified amount taxable year rate threshold phase reduction earned "
+    "adjusted gross deduction exemption filing joint return resident state "
+    "benefit payment eligible child care expense section subsection paragraph "
+    "applicable percentage maximum minimum excess determined purposes"
+).split()
+
+
+def synthetic_words(rng: random.Random, n: int) -> str:
+    return " ".join(rng.choice(VOCABULARY) for _ in range(n))
+
+
+def synthetic_legislation(n_sections: int = 100, seed: int = 0) -> str:
+    """Return a statute-like document with § / (a) / (1) / (A) structure.
+
+    Args:
+        n_sections (int, optional): The number of § sections. Defaults to 100.
+        seed (int, optional): The random seed. Defaults to 0.
+
+    Returns:
+        str: The document.
+    """
+    rng = random.Random(seed)
+    sections = []
+    for section in range(1, n_sections + 1):
+        parts = [f"§ {section}. {synthetic_words(rng, 6).capitalize()}"]
+        for subsection in "abcd"[: rng.randint(1, 4)]:
+            parts.append(f"({subsection}) {synthetic_words(rng, 60)}")
+            for paragraph in range(1, rng.randint(1, 4)):
+                parts.append(f"({paragraph}) {synthetic_words(rng, 80)}")
+                for subparagraph in "ABC"[: rng.randint(0, 3)]:
+                    parts.append(
+                        f"({subparagraph}) {synthetic_words(rng, 70)}"
+                    )
+        sections.append("\n\n".join(parts))
+    return "\n\n" + "\n\n".join(sections)
+
+
+class HashingEmbedder:
+    """A fast, deterministic stand-in for `SentenceTransformer` which hashes words into a
+    fixed number of dimensions. Counts how many texts it has encoded.
+
+    Args:
+        dim (int, optional): The embedding size. Defaults to 768, like all-mpnet-base-v2.
+    """
+
+    def __init__(self, dim: int = 768):
+        self.dim = dim
+        self.encoded = 0
+
+    def _embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            digest = hashlib.blake2b(word.encode(), digest_size=8).digest()
+            index = int.from_bytes(digest[:4], "little") % self.dim
+            vector[index] += 1 if digest[4] & 1 else -1
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def encode(
+        self, sentences: Union[str, List[str]], batch_size: int = 32, **kwargs
+    ) -> np.ndarray:
+        if isinstance(sentences, str):
+            self.encoded += 1
+            return self._embed(sentences)
+        self.encoded += len(sentences)
+        if not sentences:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.stack([self._embed(sentence) for sentence in sentences])
@@ -0,0 +1,70 @@
+"""Measure the cold-start import time of a module with `python -X importtime`, listing the slowest
+imports and flagging heavy dependencies which should only load on first use.
+
+Usage:
+    python -m benchmarks.import_time --module capabilities
+    python -m benchmarks.import_time --module app --repeat 3
+"""
+
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+HEAVY_MODULES = (
+    "sentence_transformers",
+    "torch",
+    "chromadb",
+    "pandas",
+    "openai",
+)
+LINE_PATTERN = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def import_times(module: str) -> list:
+    """Return (cumulative microseconds, depth, module name) for every import."""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        env=dict(os.environ, PYTHONPATH=os.getcwd()),
+    ).stderr
+    times = []
+    for line in stderr.splitlines():
+        match = LINE_PATTERN.match(line)
+        if match:
+            _, cumulative, indent, name = match.groups()
+            times.append((int(cumulative), len(indent) // 2, name))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default="capabilities")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    runs = [import_times(args.module) for _ in range(args.repeat)]
+    totals = [
+        next(us for us, _, name in reversed(run) if name == args.module)
+        for run in runs
+    ]
+    print(
+        f"import {args.module}: median {statistics.median(totals) / 1000:.1f} ms "
+        f"over {args.repeat} runs"
+    )
+    top_level = sorted(
+        (entry for entry in runs[-1] if entry[1] == 1), reverse=True
+    )
+    for us, _, name in top_level[: args.top]:
+        print(f"{us / 1000:9.1f} ms  {name}")
+    loaded = {name.split(".")[0] for _, _, name in runs[-1]}
+    heavy = [name for name in HEAVY_MODULES if name in loaded]
+    print("Heavy modules imported eagerly:", ", ".join(heavy) or "none")
+
+
+if __name__ == "__main__":
+    main()
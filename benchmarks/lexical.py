@@ -0,0 +1,80 @@
+"""Measure BM25 lookup latency and section-reference hit rate for each NumPyKnowledgeBase search
+mode on a synthetic statute.
+
+Usage:
+    python -m benchmarks.lexical --sections 5000 --queries 200
+"""
+
+import argparse
+import random
+import time
+
+import numpy as np
+
+from benchmarks.common import HashingEmbedder, synthetic_legislation
+from capabilities.helpers.knowledge_bases import (
+    SEARCH_MODES,
+    EmbeddingCache,
+    NumPyKnowledgeBase,
+)
+from capabilities.helpers.text_splitters import section_header_split
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sections", type=int, default=5_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-n", type=int, default=5)
+    args = parser.parse_args()
+
+    knowledge = NumPyKnowledgeBase(
+        model=HashingEmbedder(), embedding_cache=EmbeddingCache()
+    )
+    knowledge.add(synthetic_legislation(args.sections), section_header_split)
+    start = time.perf_counter()
+    knowledge.lexical_index
+    print(
+        f"Indexed {knowledge.size} chunks in "
+        f"{time.perf_counter() - start:.2f} s"
+    )
+
+    rng = random.Random(0)
+    sections = [rng.randint(1, args.sections) for _ in range(args.queries)]
+    queries = [
+        f"What is the income threshold in § {section}(a)?"
+        for section in sections
+    ]
+
+    times = []
+    for query in queries:
+        start = time.perf_counter()
+        knowledge.lexical_index.search(query, knowledge.LEXICAL_CANDIDATES)
+        times.append(time.perf_counter() - start)
+    print(
+        f"{'BM25 lookup':>12}: p50 {np.percentile(times, 50) * 1000:6.3f} ms, "
+        f"p99 {np.percentile(times, 99) * 1000:6.3f} ms"
+    )
+
+    query_embeddings = knowledge.model.encode(queries)
+    for mode in SEARCH_MODES:
+        times, hits = [], 0
+        for query, query_embedding, section in zip(
+            queries, query_embeddings, sections
+        ):
+            start = time.perf_counter()
+            results = knowledge.search_embeddings(
+                query_embedding[None], args.top_n, queries=[query], mode=mode
+            )[0]
+            times.append(time.perf_counter() - start)
+            hits += any(
+                text.startswith(f" {section}.") for _, text, _ in results
+            )
+        print(
+            f"{mode:>12}: hit@{args.top_n} {hits / args.queries:.3f}, "
+            f"p50 {np.percentile(times, 50) * 1000:6.2f} ms, "
+            f"p99 {np.percentile(times, 99) * 1000:6.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Measure time-to-first-token and throughput of the generation capabilities against the offline fake LLM backend.
+
+Usage:
+    python -m benchmarks.llm_backends --token-latency 0.002 --concurrency 8
+"""
+
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import HashingEmbedder
+from capabilities.helpers.cache import ResponseCache
+from capabilities.helpers.llm import FakeBackend, set_backend, set_cache
+from capabilities.helpers.prompts import ExampleLibrary, set_example_library
+
+INFORMATION = "A personal tax credit that phases in with income at 30%, up to a maximum of 1k, and then out at 10%, down to a minimum of 0."
+
+
+def capabilities():
+    from capabilities import (
+        create_parameters,
+        create_variables,
+        model_policy,
+        parse_legislation,
+    )
+
+    return dict(
+        create_parameters=create_parameters,
+        create_variables=create_variables,
+        model_policy=model_policy,
+        parse_legislation=parse_legislation,
+    )
+
+
+def timed_run(fn) -> dict:
+    start = time.perf_counter()
+    first_token = None
+    n_tokens = 0
+    for _ in fn(INFORMATION, deltas=True):
+        if first_token is None:
+            first_token = time.perf_counter() - start
+        n_tokens += 1
+    return dict(
+        time_to_first_token=first_token,
+        total=time.perf_counter() - start,
+        tokens=n_tokens,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--token-latency", type=float, default=0.002)
+    parser.add_argument("--time-to-first-token", type=float, default=0.2)
+    parser.add_argument("--tokens", type=int, default=300)
+    parser.add_argument("--requests", type=int, default=16)
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    # Select examples offline, with the stand-in embedder.
+    set_example_library(ExampleLibrary(model=HashingEmbedder()))
+    set_backend(
+        FakeBackend(
+            token_latency=args.token_latency,
+            time_to_first_token=args.time_to_first_token,
+            n_tokens=args.tokens,
+        )
+    )
+    # Every request should reach the backend.
+    set_cache(ResponseCache(max_entries=0))
+    for name, fn in capabilities().items():
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            runs = list(
+                pool.map(lambda _: timed_run(fn), range(args.requests))
+            )
+        elapsed = time.perf_counter() - start
+        ttft = [run["time_to_first_token"] for run in runs]
+        tokens = sum(run["tokens"] for run in runs)
+        print(
+            f"{name:>18}: TTFT p50 {statistics.median(ttft) * 1000:7.1f} ms, "
+            f"max {max(ttft) * 1000:7.1f} ms, "
+            f"{tokens / elapsed:8.0f} tokens/s, "
+            f"{args.requests / elapsed:6.2f} requests/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Compare one whole-document request against concurrent overlapping windows when splitting or
+standardising long legislation, using a fake backend which echoes its input back at a fixed
+token rate.
+
+Usage:
+    python -m benchmarks.llm_split --sections 200 --token-latency 0.0005
+"""
+
+import argparse
+import time
+
+from benchmarks.common import synthetic_legislation
+from capabilities.helpers.cache import ResponseCache
+from capabilities.helpers.llm import FakeBackend, set_backend, set_cache
+from capabilities.helpers.text_splitters import (
+    LLM_SPLIT_PROMPT,
+    split_blocks,
+    stream_blocks,
+)
+
+
+class EchoBackend(FakeBackend):
+    """Respond with the content after the prompt, so output length follows input length."""
+
+    def response_to(self, prompt: str, model: str) -> str:
+        return prompt[len(LLM_SPLIT_PROMPT) :].strip()
+
+
+def timed(fn) -> tuple:
+    start = time.perf_counter()
+    first_block = None
+    n_blocks = 0
+    for _ in fn():
+        if first_block is None:
+            first_block = time.perf_counter() - start
+        n_blocks += 1
+    return n_blocks, first_block, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sections", type=int, default=200)
+    parser.add_argument("--token-latency", type=float, default=0.0005)
+    parser.add_argument("--max-concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    set_cache(ResponseCache(max_entries=0))
+    backend = EchoBackend(
+        token_latency=args.token_latency, time_to_first_token=0.3
+    )
+    set_backend(backend)
+    text = synthetic_legislation(args.sections)
+    print(f"Splitting {text.count(' ') + 1} words")
+
+    def whole():
+        deltas = backend.stream(LLM_SPLIT_PROMPT + "\n\n" + text, "fake")
+        return split_blocks("".join(deltas))
+
+    runs = (
+        ("one request", whole),
+        (
+            "windows",
+            lambda: stream_blocks(
+                LLM_SPLIT_PROMPT,
+                text,
+                max_concurrency=args.max_concurrency,
+            ),
+        ),
+    )
+    for name, fn in runs:
+        n_blocks, first_block, elapsed = timed(fn)
+        print(
+            f"{name:>12}: {n_blocks} blocks, first after {first_block:6.2f} s, "
+            f"all after {elapsed:6.2f} s"
+        )
+
+
+if __name__ == "__main__":
+    main()
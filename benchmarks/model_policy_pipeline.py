@@ -0,0 +1,84 @@
+"""Compare wall-clock time of single-request and pipelined model_policy generation against the fake LLM backend.
+
+Usage:
+    python -m benchmarks.model_policy_pipeline --files 6 --tokens-per-file 150
+"""
+
+import argparse
+import time
+
+from benchmarks.common import HashingEmbedder
+from capabilities.helpers.cache import ResponseCache
+from capabilities.helpers.llm import FakeBackend, set_backend, set_cache
+from capabilities.helpers.prompts import ExampleLibrary, set_example_library
+from capabilities.model_policy import (
+    MODEL,
+    PLAN_PROMPT,
+    PROMPT_BUILDER,
+    model_policy,
+)
+
+INFORMATION = "A personal tax credit that phases in with income at 30%, up to a maximum of 1k, and then out at 10%, down to a minimum of 0."
+
+
+def timed(fn) -> tuple:
+    start = time.perf_counter()
+    first_token = None
+    for _ in fn():
+        if first_token is None:
+            first_token = time.perf_counter() - start
+    return first_token, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=6)
+    parser.add_argument("--tokens-per-file", type=int, default=150)
+    parser.add_argument("--token-latency", type=float, default=0.005)
+    parser.add_argument("--time-to-first-token", type=float, default=0.3)
+    parser.add_argument("--max-concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    files = [
+        f"parameters/gov/credit/parameter_{i}.yaml"
+        for i in range(args.files // 2)
+    ] + [
+        f"variables/credit/variable_{i}.py"
+        for i in range(args.files - args.files // 2)
+    ]
+    file_text = " ".join(["token"] * args.tokens_per_file)
+    # Select examples offline, with the stand-in embedder.
+    set_example_library(ExampleLibrary(model=HashingEmbedder()))
+    responses = {
+        FakeBackend.key(PLAN_PROMPT + INFORMATION, MODEL): "\n".join(files),
+        FakeBackend.key(PROMPT_BUILDER.build(INFORMATION), MODEL): "\n\n".join(
+            [file_text] * args.files
+        ),
+    }
+    set_backend(
+        FakeBackend(
+            responses=responses,
+            default=file_text,
+            token_latency=args.token_latency,
+            time_to_first_token=args.time_to_first_token,
+        )
+    )
+    set_cache(ResponseCache(max_entries=0))
+
+    for name, pipeline in (("single request", False), ("pipeline", True)):
+        first_token, total = timed(
+            lambda: model_policy(
+                INFORMATION,
+                deltas=True,
+                pipeline=pipeline,
+                max_concurrency=args.max_concurrency,
+            )
+        )
+        print(
+            f"{name:>15}: first token {first_token * 1000:7.1f} ms, "
+            f"total {total * 1000:8.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Compare cold-load time and resident memory of NumPyKnowledgeBase's memory-mapped format
+against the previous .npy + gzip CSV format.
+
+Each load runs in a fresh subprocess so resident memory is measured from a clean start.
+
+Usage:
+    python -m benchmarks.numpy_load --chunks 200000
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.common import HashingEmbedder, VOCABULARY
+from capabilities.helpers.knowledge_bases import NumPyKnowledgeBase
+
+LOAD_SCRIPT = """
+import json, resource, sys, time
+from benchmarks.common import HashingEmbedder
+from capabilities.helpers.knowledge_bases import NumPyKnowledgeBase
+
+def rss():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize()
+
+knowledge = NumPyKnowledgeBase(model=HashingEmbedder())
+before = rss()
+start = time.perf_counter()
+knowledge.load(sys.argv[1])
+load = time.perf_counter() - start
+after_load = rss()
+start = time.perf_counter()
+list(knowledge.search("tax credit income", top_n=5))
+search = time.perf_counter() - start
+print(json.dumps(dict(load=load, search=search, load_rss=after_load - before, search_rss=rss() - before)))
+"""
+
+
+def build(n_chunks: int, seed: int = 0) -> NumPyKnowledgeBase:
+    rng = np.random.default_rng(seed)
+    knowledge = NumPyKnowledgeBase(model=HashingEmbedder())
+    batch_size = 10_000
+    for start in range(0, n_chunks, batch_size):
+        n = min(batch_size, n_chunks - start)
+        words = rng.choice(VOCABULARY, size=(n, 40))
+        values = [
+            f"§ {start + i}. " + " ".join(row) for i, row in enumerate(words)
+        ]
+        embeddings = rng.standard_normal((n, 768), dtype=np.float32)
+        knowledge.add_embedded(values, embeddings)
+    return knowledge
+
+
+def measure(path: str) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", LOAD_SCRIPT, path],
+        check=True,
+        capture_output=True,
+        text=True,
+        env=dict(os.environ, PYTHONPATH=os.getcwd()),
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=200_000)
+    args = parser.parse_args()
+
+    knowledge = build(args.chunks)
+    with tempfile.TemporaryDirectory() as directory:
+        legacy_path = os.path.join(directory, "legacy.npy")
+        np.save(legacy_path, knowledge.embeddings_array)
+        pd.DataFrame({"data": list(knowledge.data)}).to_csv(
+            legacy_path + ".csv.gz", index=False, compression="gzip"
+        )
+        mapped_path = os.path.join(directory, "mapped")
+        knowledge.save(mapped_path)
+
+        for name, path in (
+            ("npy + csv.gz", legacy_path),
+            ("memmap", mapped_path),
+        ):
+            result = measure(path)
+            print(
+                f"{name:>12}: load {result['load'] * 1000:9.1f} ms "
+                f"(+{result['load_rss'] / 2**20:7.1f} MiB RSS), "
+                f"first search {result['search'] * 1000:8.1f} ms "
+                f"(+{result['search_rss'] / 2**20:7.1f} MiB RSS)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Compare time and peak memory of adding embeddings to NumPyKnowledgeBase in small batches
+against the previous list + np.vstack path.
+
+Usage:
+    python -m benchmarks.numpy_memory --chunks 100000 --batch-size 100
+"""
+
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmarks.common import HashingEmbedder
+from capabilities.helpers.knowledge_bases import NumPyKnowledgeBase
+
+DIM = 768
+
+
+def batches(n_chunks: int, batch_size: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    for start in range(0, n_chunks, batch_size):
+        n = min(batch_size, n_chunks - start)
+        values = [f"chunk {start + i}" for i in range(n)]
+        yield values, rng.standard_normal((n, DIM), dtype=np.float32)
+
+
+def ingest_vstack(n_chunks: int, batch_size: int):
+    """The previous path: a list of rows plus a full np.vstack on every add."""
+    data, embeddings, embeddings_array = [], [], None
+    for values, batch in batches(n_chunks, batch_size):
+        data.extend(values)
+        embeddings.extend(batch)
+        if embeddings_array is None:
+            embeddings_array = np.array(embeddings)
+        else:
+            embeddings_array = np.vstack((embeddings_array, batch))
+    return embeddings_array
+
+
+def ingest_buffer(n_chunks: int, batch_size: int, dtype):
+    knowledge = NumPyKnowledgeBase(model=HashingEmbedder(), dtype=dtype)
+    for values, batch in batches(n_chunks, batch_size):
+        knowledge.add_embedded(values, batch)
+    return knowledge.embeddings_array
+
+
+def measure(fn) -> tuple:
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, result.nbytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=100_000)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument(
+        "--skip-vstack",
+        action="store_true",
+        help="Skip the previous path, which is quadratic in the number of batches.",
+    )
+    args = parser.parse_args()
+
+    runs = [
+        (
+            "buffer float32",
+            lambda: ingest_buffer(args.chunks, args.batch_size, np.float32),
+        ),
+        (
+            "buffer float16",
+            lambda: ingest_buffer(args.chunks, args.batch_size, np.float16),
+        ),
+    ]
+    if not args.skip_vstack:
+        runs.insert(
+            0,
+            (
+                "list + vstack",
+                lambda: ingest_vstack(args.chunks, args.batch_size),
+            ),
+        )
+    for name, fn in runs:
+        elapsed, peak, size = measure(fn)
+        print(
+            f"{name:>15}: {elapsed:7.2f} s, peak {peak / 2**20:8.1f} MiB, "
+            f"embeddings {size / 2**20:8.1f} MiB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Compare the input tokens and time to build each generation prompt with the full annotated
+templates, and with the rules and the example files most similar to the policy.
+
+The time to first token is modelled as the time to build the prompt, plus the prompt's tokens
+at a given prefill rate.
+
+Usage:
+    python -m benchmarks.prompts --prefill-rate 2500
+"""
+
+import argparse
+import importlib
+import statistics
+import time
+
+from benchmarks.common import HashingEmbedder
+from capabilities.helpers.context import count_tokens
+from capabilities.helpers.prompts import ExampleLibrary, set_example_library
+
+CAPABILITIES = ("create_parameters", "create_variables", "model_policy")
+
+POLICIES = [
+    "A personal tax credit that phases in with income at 30%, up to a maximum of 1k, and then out at 10%, down to a minimum of 0.",
+    "New York gives a $100 Empire State child credit for each child under 17.",
+    "Raise the UK personal allowance to £15,000 from April 2025.",
+    "Cut the Universal Credit taper rate from 55% to 50%, and raise the work allowance by £500 a year.",
+    "A 5% surtax on household income above $1m, applying from 2026.",
+    "Lower the age at which someone counts as a child for benefits to 15.",
+    "Replace the income tax basic rate of 20% with 19% and the higher rate threshold with £40,000.",
+    "California's renters credit of $60 for single filers with AGI up to $50,746.",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--prefill-rate", type=float, default=2_500)
+    args = parser.parse_args()
+
+    library = ExampleLibrary(model=HashingEmbedder())
+    set_example_library(library)
+    start = time.perf_counter()
+    library.select(POLICIES[0])
+    print(
+        f"Indexed {len(library.examples)} examples in "
+        f"{(time.perf_counter() - start) * 1000:.1f} ms"
+    )
+    for name in CAPABILITIES:
+        module = importlib.import_module(f"capabilities.{name}")
+        static_tokens, built_tokens, build_times = [], [], []
+        for policy in POLICIES:
+            static_tokens.append(count_tokens(module.PROMPT + policy))
+            # After the first capability, the policy's embedding is cached.
+            start = time.perf_counter()
+            prompt = module.PROMPT_BUILDER.build(policy)
+            build_times.append(time.perf_counter() - start)
+            built_tokens.append(count_tokens(prompt))
+        static = statistics.mean(static_tokens)
+        built = statistics.mean(built_tokens)
+        build = statistics.mean(build_times)
+        print(
+            f"{name:>17}: {static:5.0f} -> {built:5.0f} input tokens "
+            f"({built / static - 1:+.0%}), build {build * 1000:5.2f} ms, "
+            f"modelled TTFT {static / args.prefill_rate * 1000:6.1f} -> "
+            f"{(build + built / args.prefill_rate) * 1000:6.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
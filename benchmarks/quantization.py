@@ -0,0 +1,102 @@
+"""Compare the memory, recall and latency of NumPyKnowledgeBase with float32, float16, int8 and
+product-quantized embeddings, with and without full-precision reranking.
+
+Recall is the fraction of the float32 top-k also returned. Full-precision embeddings kept for
+reranking are listed separately, as once saved and loaded they are memory-mapped.
+
+Usage:
+    python -m benchmarks.quantization --chunks 100000 --queries 200
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks.common import HashingEmbedder
+from capabilities.helpers.knowledge_bases import NumPyKnowledgeBase
+from capabilities.helpers.quantization import ProductQuantizer, ScalarQuantizer
+
+DIM = 768
+
+
+def clustered_embeddings(
+    n: int, n_clusters: int = 1_000, spread: float = 0.6, seed: int = 0
+) -> np.ndarray:
+    """Unit vectors around random topics, which are more like sentence embeddings than
+    uniformly random vectors."""
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((n_clusters, DIM), dtype=np.float32)
+    embeddings = centres[rng.integers(n_clusters, size=n)]
+    embeddings += spread * rng.standard_normal((n, DIM), dtype=np.float32)
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-n", type=int, default=10)
+    parser.add_argument("--rerank", type=int, default=4)
+    parser.add_argument("--subvectors", type=int, default=96)
+    args = parser.parse_args()
+
+    embeddings = clustered_embeddings(args.chunks + args.queries)
+    embeddings, queries = embeddings[: args.chunks], embeddings[args.chunks :]
+    values = [f"chunk {i}" for i in range(args.chunks)]
+    variants = (
+        ("float32", dict()),
+        ("float16", dict(dtype=np.float16)),
+        ("int8", dict(quantizer=ScalarQuantizer())),
+        (
+            "int8 + rerank",
+            dict(quantizer=ScalarQuantizer(), rerank=args.rerank),
+        ),
+        ("pq", dict(quantizer=ProductQuantizer(args.subvectors))),
+        (
+            "pq + rerank",
+            dict(
+                quantizer=ProductQuantizer(args.subvectors),
+                rerank=args.rerank,
+            ),
+        ),
+    )
+    exact = None
+    print(f"{args.chunks} chunks, {args.queries} queries, top {args.top_n}")
+    for name, options in variants:
+        knowledge = NumPyKnowledgeBase(model=HashingEmbedder(), **options)
+        start = time.perf_counter()
+        knowledge.add_embedded(values, embeddings)
+        build = time.perf_counter() - start
+        start = time.perf_counter()
+        results = [
+            {
+                id
+                for id, _, _ in knowledge.search_embeddings(
+                    query[None], args.top_n
+                )[0]
+            }
+            for query in queries
+        ]
+        latency = (time.perf_counter() - start) / args.queries
+        exact = exact or results
+        recall = np.mean([len(a & b) for a, b in zip(results, exact)])
+        codes = knowledge.codes_array
+        in_memory = codes.nbytes if codes is not None else 0
+        mapped = 0
+        if knowledge.embeddings_array is not None:
+            if codes is None:
+                in_memory += knowledge.embeddings_array.nbytes
+            else:
+                mapped = knowledge.embeddings_array.nbytes
+        print(
+            f"{name:>14}: {in_memory / 2**20:7.1f} MiB "
+            f"({embeddings.nbytes / in_memory:4.1f}x smaller)"
+            + (f" + {mapped / 2**20:5.1f} MiB mapped" if mapped else "")
+            + f", recall {recall / args.top_n:.3f}, "
+            f"{latency * 1000:6.2f} ms per query, built in {build:5.1f} s"
+        )
+
+
+if __name__ == "__main__":
+    main()
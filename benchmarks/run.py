@@ -0,0 +1,412 @@
+"""Run the end-to-end benchmark suite offline, from splitting synthetic legislation to streaming
+generation, and optionally compare the results against a stored baseline.
+
+Every stage runs against seeded synthetic corpora, the hashing stand-in for the embedding model
+and the fake LLM backend, so results only change when the code (or the machine) does. Metrics
+ending in "_seconds" or "_mib" should fall, those ending in "_per_second" should rise, and the
+rest are counts which should stay the same.
+
+The results are compared against benchmarks/baseline.json unless another baseline is given, and
+the comparison is printed to stderr, so stdout is just the results' JSON. Timings vary between
+machines and runs, so by default only large regressions and changed counts fail; compare against
+a baseline from the same machine with a lower --tolerance for finer checks.
+
+Usage:
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --baseline "" --output benchmarks/baseline.json
+    python -m benchmarks.run --baseline results.json --tolerance 0.2
+"""
+
+from typing import Callable, Dict, List
+
+import argparse
+import datetime
+import itertools
+import json
+import os
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmarks.common import HashingEmbedder, synthetic_legislation
+from benchmarks.search import queries
+from capabilities.helpers.cache import EmbeddingCache, ResponseCache
+from capabilities.helpers.knowledge_bases import (
+    DENSE,
+    HYBRID,
+    ChromaKnowledgeBase,
+    NumPyKnowledgeBase,
+    get_chroma_client,
+)
+from capabilities.helpers.llm import (
+    FakeBackend,
+    ask_gpt_stream,
+    set_backend,
+    set_cache,
+)
+from capabilities.helpers.prompts import ExampleLibrary, set_example_library
+from capabilities.helpers.text_splitters import section_header_split
+
+# The results of a run with the default settings, which runs are compared against.
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+Metrics = Dict[str, float]
+
+_collection_names = itertools.count()
+
+
+def best_time(fn: Callable[[], object], repeats: int) -> float:
+    """Return the fastest of several runs, which is the least affected by other processes."""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def peak_memory_mib(fn: Callable[[], object]) -> float:
+    """Return the peak memory allocated by Python while running a function.
+
+    Tracing allocations slows code down, so this is a separate run from the timed ones.
+    """
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 2**20
+
+
+def latency_percentiles(latencies: List[float], prefix: str) -> Metrics:
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        f"{prefix}_p50_seconds": float(p50),
+        f"{prefix}_p95_seconds": float(p95),
+        f"{prefix}_p99_seconds": float(p99),
+    }
+
+
+def numpy_knowledge_base() -> NumPyKnowledgeBase:
+    return NumPyKnowledgeBase(
+        model=HashingEmbedder(), embedding_cache=EmbeddingCache()
+    )
+
+
+def chroma_knowledge_base() -> ChromaKnowledgeBase:
+    return ChromaKnowledgeBase(
+        model=HashingEmbedder(),
+        name=f"benchmark-suite-{next(_collection_names)}",
+        embedding_cache=EmbeddingCache(),
+    )
+
+
+def drop(knowledge):
+    if isinstance(knowledge, ChromaKnowledgeBase):
+        get_chroma_client().delete_collection(knowledge.name)
+
+
+def bench_split(corpus: str, args) -> Metrics:
+    size = len(corpus.encode()) / 2**20
+    chunks = len(list(section_header_split(corpus)))
+    elapsed = best_time(
+        lambda: list(section_header_split(corpus)), args.repeats
+    )
+    return dict(
+        chunks=chunks,
+        seconds=elapsed,
+        mib_per_second=size / elapsed,
+        chunks_per_second=chunks / elapsed,
+        peak_memory_mib=peak_memory_mib(
+            lambda: list(section_header_split(corpus))
+        ),
+    )
+
+
+def bench_embed(corpus: str, args) -> Metrics:
+    chunks = list(dict.fromkeys(section_header_split(corpus)))
+
+    def embed():
+        numpy_knowledge_base().embed(chunks)
+
+    elapsed = best_time(embed, args.repeats)
+    knowledge = numpy_knowledge_base()
+    knowledge.embed(chunks)
+    return dict(
+        chunks=len(chunks),
+        chunks_per_second=len(chunks) / elapsed,
+        # Every chunk is in the embedding cache the second time.
+        cached_seconds=best_time(
+            lambda: knowledge.embed(chunks), args.repeats
+        ),
+    )
+
+
+def ingest(new_knowledge_base: Callable, corpus: str, args) -> Metrics:
+    times = []
+    for _ in range(args.repeats):
+        knowledge = new_knowledge_base()
+        start = time.perf_counter()
+        ids, _ = knowledge.add(corpus, split_fn=section_header_split)
+        times.append(time.perf_counter() - start)
+        drop(knowledge)
+    knowledge = new_knowledge_base()
+    peak = peak_memory_mib(
+        lambda: knowledge.add(corpus, split_fn=section_header_split)
+    )
+    # Nothing is new the second time, so this only splits and looks up ids.
+    start = time.perf_counter()
+    knowledge.add(corpus, split_fn=section_header_split)
+    reingest = time.perf_counter() - start
+    drop(knowledge)
+    elapsed = min(times)
+    return dict(
+        chunks=len(ids),
+        seconds=elapsed,
+        chunks_per_second=len(ids) / elapsed,
+        reingest_seconds=reingest,
+        peak_memory_mib=peak,
+    )
+
+
+def search(new_knowledge_base: Callable, modes, corpus: str, args) -> Metrics:
+    knowledge = new_knowledge_base()
+    knowledge.add(corpus, split_fn=section_header_split)
+    questions = queries(args.queries, seed=args.seed + 1)
+    metrics = {}
+    for mode in modes:
+        # Warm up lazily built indexes, e.g. the BM25 index for hybrid search.
+        knowledge.search_with_scores(questions[0], args.top_n, mode=mode)
+        latencies = []
+        for question in questions:
+            start = time.perf_counter()
+            knowledge.search_with_scores(question, args.top_n, mode=mode)
+            latencies.append(time.perf_counter() - start)
+        metrics.update(latency_percentiles(latencies, mode))
+        start = time.perf_counter()
+        knowledge.search_many(questions, args.top_n, mode=mode)
+        metrics[f"{mode}_batch_seconds"] = time.perf_counter() - start
+    drop(knowledge)
+    return metrics
+
+
+def bench_generation(corpus: str, args) -> Metrics:
+    from capabilities.model_policy import model_policy
+
+    backend = FakeBackend(n_tokens=args.tokens)
+    set_backend(backend)
+    set_cache(ResponseCache(max_entries=0))
+    set_example_library(ExampleLibrary(model=HashingEmbedder()))
+    prompt = "A personal tax credit which phases in with earnings."
+
+    def consume(deltas):
+        for _ in deltas:
+            pass
+
+    # The same response from the backend alone, then through the response cache (which is
+    # disabled here) and delta handling.
+    raw = best_time(
+        lambda: consume(backend.stream(prompt, "gpt-4")), args.repeats
+    )
+    streamed = best_time(
+        lambda: consume(ask_gpt_stream(prompt, deltas=True)), args.repeats
+    )
+    accumulated = best_time(
+        lambda: consume(ask_gpt_stream(prompt)), args.repeats
+    )
+    set_cache(ResponseCache())
+    consume(ask_gpt_stream(prompt, deltas=True))
+    replayed = best_time(
+        lambda: consume(ask_gpt_stream(prompt, deltas=True)), args.repeats
+    )
+    set_cache(ResponseCache(max_entries=0))
+    # Distinct policies, so each first token includes selecting examples.
+    policies = (f"{prompt} Policy {i}." for i in itertools.count())
+
+    def first_token():
+        deltas = model_policy(next(policies), deltas=True)
+        start = time.perf_counter()
+        next(deltas)
+        elapsed = time.perf_counter() - start
+        consume(deltas)
+        return elapsed
+
+    # The first call indexes the examples, so isn't counted.
+    first_token()
+    model_policy_first_token = min(first_token() for _ in range(args.repeats))
+    return dict(
+        tokens=args.tokens,
+        backend_seconds=raw,
+        stream_overhead_seconds=max(streamed - raw, 0.0) / args.tokens,
+        accumulate_overhead_seconds=max(accumulated - raw, 0.0) / args.tokens,
+        cached_replay_seconds=replayed,
+        model_policy_first_token_seconds=model_policy_first_token,
+    )
+
+
+BENCHMARKS = {
+    "split": bench_split,
+    "embed": bench_embed,
+    "ingest_numpy": lambda corpus, args: ingest(
+        numpy_knowledge_base, corpus, args
+    ),
+    "ingest_chroma": lambda corpus, args: ingest(
+        chroma_knowledge_base, corpus, args
+    ),
+    "search_numpy": lambda corpus, args: search(
+        numpy_knowledge_base, (DENSE, HYBRID), corpus, args
+    ),
+    "search_chroma": lambda corpus, args: search(
+        chroma_knowledge_base, (DENSE,), corpus, args
+    ),
+    "generation": bench_generation,
+}
+
+
+def run(args) -> dict:
+    """Run the selected benchmarks.
+
+    Returns:
+        dict: The settings and environment, and each benchmark's metrics.
+    """
+    corpus = synthetic_legislation(args.sections, seed=args.seed)
+    results = {}
+    for name in args.only or BENCHMARKS:
+        start = time.perf_counter()
+        results[name] = BENCHMARKS[name](corpus, args)
+        print(
+            f"{name:>14}: done in {time.perf_counter() - start:6.2f} s",
+            file=sys.stderr,
+        )
+    # Linux reports the peak resident set size in KiB, macOS in bytes.
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results["process"] = dict(
+        max_rss_mib=max_rss / (2**20 if sys.platform == "darwin" else 2**10)
+    )
+    return dict(
+        settings=dict(
+            sections=args.sections,
+            seed=args.seed,
+            queries=args.queries,
+            top_n=args.top_n,
+            tokens=args.tokens,
+            repeats=args.repeats,
+            only=args.only,
+        ),
+        environment=dict(
+            python=platform.python_version(),
+            numpy=np.__version__,
+            platform=platform.platform(),
+            created=datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        ),
+        results=results,
+    )
+
+
+def direction(metric: str) -> int:
+    """Return 1 if a metric should rise, -1 if it should fall, and 0 for counts."""
+    if metric.endswith("_per_second"):
+        return 1
+    if metric.endswith(("seconds", "_mib")):
+        return -1
+    return 0
+
+
+def compare(
+    results: dict, baseline: dict, tolerance: float, min_seconds: float = 0.0
+) -> List[str]:
+    """Print each metric against its baseline value to stderr, and list the regressions.
+
+    Args:
+        results (dict): The output of `run`.
+        baseline (dict): An earlier output of `run`.
+        tolerance (float): The relative change allowed before a metric regresses, e.g. 0.2.
+        min_seconds (float, optional): Timings which change by less than this don't regress,
+            as sub-millisecond timings vary by more than the tolerance between runs.
+
+    Returns:
+        List[str]: A description of each metric which got worse by more than the tolerance, or
+            each count which changed.
+    """
+    if results["settings"] != baseline["settings"]:
+        print(
+            f"Warning: the baseline was run with {baseline['settings']}, "
+            f"not {results['settings']}",
+            file=sys.stderr,
+        )
+    regressions = []
+    for name, metrics in results["results"].items():
+        baseline_metrics = baseline["results"].get(name, {})
+        for metric, value in metrics.items():
+            if metric not in baseline_metrics:
+                continue
+            before = baseline_metrics[metric]
+            change = value / before - 1 if before else 0.0
+            sign = direction(metric)
+            if sign == 0:
+                regressed = value != before
+            else:
+                regressed = -sign * change > tolerance and not (
+                    metric.endswith("seconds")
+                    and abs(value - before) < min_seconds
+                )
+            label = f"{name}.{metric}"
+            print(
+                f"{label:<48} {before:12.6g} -> {value:12.6g} "
+                f"({change:+7.1%}){'  REGRESSED' if regressed else ''}",
+                file=sys.stderr,
+            )
+            if regressed:
+                regressions.append(
+                    f"{label}: {before:.6g} -> {value:.6g} ({change:+.1%})"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sections", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--top-n", type=int, default=5)
+    parser.add_argument("--tokens", type=int, default=2_000)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument(
+        "--only", nargs="+", choices=list(BENCHMARKS), default=None
+    )
+    parser.add_argument("--output", help="Write the results to this file.")
+    parser.add_argument(
+        "--baseline",
+        default=BASELINE,
+        help="Compare against results from an earlier run, or nothing if empty.",
+    )
+    parser.add_argument("--tolerance", type=float, default=0.5)
+    parser.add_argument("--min-seconds", type=float, default=0.005)
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(
+            results, baseline, args.tolerance, args.min_seconds
+        )
+        if regressions:
+            print(f"\n{len(regressions)} regressions:", file=sys.stderr)
+            for regression in regressions:
+                print(f"  {regression}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
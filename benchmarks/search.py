@@ -0,0 +1,72 @@
+"""Compare NumPyKnowledgeBase top-k selection and batched multi-query search against a full argsort
+per query.
+
+Usage:
+    python -m benchmarks.search --chunks 200000 --queries 200
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks.common import HashingEmbedder, VOCABULARY
+from capabilities.helpers.knowledge_bases import NumPyKnowledgeBase
+
+
+def build(n_chunks: int, seed: int = 0) -> NumPyKnowledgeBase:
+    rng = np.random.default_rng(seed)
+    knowledge = NumPyKnowledgeBase(model=HashingEmbedder())
+    embeddings = rng.standard_normal((n_chunks, 768), dtype=np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    knowledge.add_embedded([f"chunk {i}" for i in range(n_chunks)], embeddings)
+    return knowledge
+
+
+def queries(n_queries: int, seed: int = 1) -> list:
+    rng = np.random.default_rng(seed)
+    return [" ".join(rng.choice(VOCABULARY, size=8)) for _ in range(n_queries)]
+
+
+def search_argsort(knowledge: NumPyKnowledgeBase, query: str, top_n: int):
+    """The previous path: a full argsort, with the best match last."""
+    similarity = knowledge._scores(knowledge.model.encode(query))
+    return [knowledge.data[i] for i in np.argsort(similarity)[-top_n:]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=200_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-n", type=int, default=10)
+    args = parser.parse_args()
+
+    knowledge = build(args.chunks)
+    questions = queries(args.queries)
+    runs = (
+        (
+            "argsort loop",
+            lambda: [
+                search_argsort(knowledge, q, args.top_n) for q in questions
+            ],
+        ),
+        (
+            "top-k loop",
+            lambda: [
+                knowledge.search_with_scores(q, args.top_n) for q in questions
+            ],
+        ),
+        ("search_many", lambda: knowledge.search_many(questions, args.top_n)),
+    )
+    for name, fn in runs:
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        print(
+            f"{name:>12}: {elapsed * 1000:8.1f} ms total, "
+            f"{elapsed / args.queries * 1000:6.2f} ms per query"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""Load-test the async API server in-process against the offline fake LLM backend, with many
+concurrent clients streaming distinct requests, then identical ones (which are coalesced).
+
+Usage:
+    python -m benchmarks.server_load --clients 200 --token-latency 0.01
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import aiohttp
+from aiohttp import web
+
+from benchmarks.common import HashingEmbedder
+from capabilities.helpers.cache import ResponseCache
+from capabilities.helpers.llm import FakeBackend, set_backend, set_cache
+from capabilities.helpers.prompts import ExampleLibrary, set_example_library
+from server import create_app
+
+INFORMATION = "A personal tax credit that phases in with income at 30%, up to a maximum of 1k, and then out at 10%, down to a minimum of 0."
+
+
+class CountingBackend(FakeBackend):
+    """A fake backend which counts upstream requests."""
+
+    calls = 0
+
+    async def astream(self, prompt: str, model: str):
+        self.calls += 1
+        async for delta in super().astream(prompt, model):
+            yield delta
+
+
+async def client(session: aiohttp.ClientSession, url: str, body: dict) -> dict:
+    start = time.perf_counter()
+    first_token = None
+    n_tokens = 0
+    async with session.post(url, json=body) as response:
+        response.raise_for_status()
+        name = None
+        async for line in response.content:
+            if line.startswith(b"event: "):
+                name = line[7:].strip().decode()
+            elif line.startswith(b"data: "):
+                if name == "error":
+                    raise RuntimeError(json.loads(line[6:]))
+                if name is None:
+                    if first_token is None:
+                        first_token = time.perf_counter() - start
+                    n_tokens += 1
+            elif line == b"\n":
+                name = None
+    return dict(
+        time_to_first_token=first_token or 0.0,
+        total=time.perf_counter() - start,
+        tokens=n_tokens,
+    )
+
+
+def percentile(values, q: float) -> float:
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+async def run(args):
+    backend = CountingBackend(
+        token_latency=args.token_latency,
+        time_to_first_token=args.time_to_first_token,
+        n_tokens=args.tokens,
+    )
+    # Select examples offline, with the stand-in embedder.
+    set_example_library(ExampleLibrary(model=HashingEmbedder()))
+    set_backend(backend)
+    # Every request goes upstream, unless it is coalesced.
+    set_cache(ResponseCache(max_entries=0))
+    runner = web.AppRunner(create_app())
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    url = f"http://127.0.0.1:{port}/create_parameters"
+    print(
+        f"{args.clients} clients, {args.tokens} tokens each, "
+        f"{args.time_to_first_token * 1000:.0f} ms to first token, "
+        f"{args.token_latency * 1000:.0f} ms per token"
+    )
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        for scenario in ("distinct", "identical"):
+            backend.calls = 0
+            bodies = [
+                dict(
+                    information=INFORMATION
+                    + (f" Request {i}." if scenario == "distinct" else "")
+                )
+                for i in range(args.clients)
+            ]
+            start = time.perf_counter()
+            results = await asyncio.gather(
+                *(client(session, url, body) for body in bodies)
+            )
+            elapsed = time.perf_counter() - start
+            ttft = [r["time_to_first_token"] for r in results]
+            total = [r["total"] for r in results]
+            tokens = sum(r["tokens"] for r in results)
+            print(
+                f"{scenario:>9}: TTFT p50 {statistics.median(ttft):.3f} s, "
+                f"p95 {percentile(ttft, 95):.3f} s; "
+                f"total p50 {statistics.median(total):.3f} s, "
+                f"p95 {percentile(total, 95):.3f} s; "
+                f"{elapsed:.2f} s wall, {tokens / elapsed:,.0f} tokens/s, "
+                f"{backend.calls} upstream requests"
+            )
+    await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--token-latency", type=float, default=0.01)
+    parser.add_argument("--time-to-first-token", type=float, default=0.3)
+    parser.add_argument("--tokens", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Measure search latency for one jurisdiction's chunks in a corpus of many jurisdictions: an
+unfiltered flat search, a filtered flat search, and a search of a ShardedKnowledgeBase.
+
+Usage:
+    python -m benchmarks.sharding --jurisdictions 50 --chunks-per-jurisdiction 4000
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks.common import HashingEmbedder
+from benchmarks.search import queries
+from capabilities.helpers.knowledge_bases import (
+    NumPyKnowledgeBase,
+    ShardedKnowledgeBase,
+)
+
+
+def build(n_jurisdictions: int, chunks_per_jurisdiction: int, seed: int = 0):
+    """Return a flat and a sharded knowledge base holding the same random chunks."""
+    rng = np.random.default_rng(seed)
+    model = HashingEmbedder()
+    flat = NumPyKnowledgeBase(model=model)
+    sharded = ShardedKnowledgeBase(
+        lambda key: NumPyKnowledgeBase(model=model), model=model
+    )
+    for j in range(n_jurisdictions):
+        embeddings = rng.standard_normal(
+            (chunks_per_jurisdiction, 768), dtype=np.float32
+        )
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        values = [f"chunk {j}-{i}" for i in range(chunks_per_jurisdiction)]
+        metadatas = [dict(jurisdiction=f"j{j}")] * chunks_per_jurisdiction
+        flat.add_embedded(values, embeddings, metadatas=metadatas)
+        sharded.add_embedded(values, embeddings, metadatas=metadatas)
+    return flat, sharded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--jurisdictions", type=int, default=50)
+    parser.add_argument("--chunks-per-jurisdiction", type=int, default=4_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-n", type=int, default=10)
+    args = parser.parse_args()
+
+    flat, sharded = build(args.jurisdictions, args.chunks_per_jurisdiction)
+    filters = dict(jurisdiction="j0")
+    # Build the metadata index before timing.
+    flat.search_many(["warm up"], filters=filters)
+    questions = queries(args.queries)
+    runs = (
+        ("flat", flat, None),
+        ("flat, filtered", flat, filters),
+        ("sharded", sharded, filters),
+    )
+    print(
+        f"{args.jurisdictions * args.chunks_per_jurisdiction} chunks, "
+        f"{args.chunks_per_jurisdiction} in the searched jurisdiction"
+    )
+    for name, knowledge, run_filters in runs:
+        start = time.perf_counter()
+        for question in questions:
+            knowledge.search_with_scores(
+                question, args.top_n, filters=run_filters
+            )
+        elapsed = time.perf_counter() - start
+        print(f"{name:>15}: {elapsed / args.queries * 1000:6.2f} ms per query")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Compare full re-rendering of streamed responses against delta streaming with a throttled renderer.
+
+Usage:
+    python -m benchmarks.streaming --tokens 4000 --token-latency 0.0005
+"""
+
+import argparse
+import random
+import time
+
+from capabilities.helpers.llm import accumulate
+from capabilities.helpers.streaming import render_stream
+
+
+def synthetic_deltas(n_tokens: int, token_latency: float, seed: int = 0):
+    rng = random.Random(seed)
+    words = ["tax", "credit", "income", "phase", "rate", "value", "yaml"]
+    for i in range(n_tokens):
+        if token_latency:
+            time.sleep(token_latency)
+        yield ("\n" if i % 12 == 11 else " ") + rng.choice(words)
+
+
+class CountingRenderer:
+    """Stands in for `st.empty().write`, doing work proportional to the text length."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, text: str):
+        self.count += 1
+        text.encode("utf-8")
+
+
+def run(mode: str, n_tokens: int, token_latency: float, min_interval: float):
+    renderer = CountingRenderer()
+    deltas = synthetic_deltas(n_tokens, token_latency)
+    start_cpu, start_wall = time.process_time(), time.perf_counter()
+    if mode == "full":
+        # The previous behaviour: the whole text after every token.
+        for text in accumulate(deltas, growth=0):
+            renderer(text)
+    else:
+        render_stream(deltas, renderer, min_interval=min_interval)
+    return dict(
+        mode=mode,
+        renders=renderer.count,
+        cpu_seconds=time.process_time() - start_cpu,
+        wall_seconds=time.perf_counter() - start_wall,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tokens", type=int, default=4000)
+    parser.add_argument("--token-latency", type=float, default=0.0005)
+    parser.add_argument("--min-interval", type=float, default=0.05)
+    args = parser.parse_args()
+
+    for mode in ("full", "throttled"):
+        result = run(mode, args.tokens, args.token_latency, args.min_interval)
+        print(
+            f"{result['mode']:>10}: {result['renders']:>6} renders, "
+            f"{result['cpu_seconds'] * 1000:8.1f} ms CPU, "
+            f"{result['wall_seconds'] * 1000:8.1f} ms wall"
+        )
+
+
+if __name__ == "__main__":
+    main()
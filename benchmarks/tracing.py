@@ -0,0 +1,82 @@
+"""Measure the overhead of tracing on hot paths: cached `ask_gpt` calls and knowledge base
+searches, with tracing off, logging spans as JSON, and recording histograms.
+
+Usage:
+    python -m benchmarks.tracing --calls 20000
+"""
+
+import argparse
+import logging
+import time
+
+import numpy as np
+
+from benchmarks.common import HashingEmbedder
+from benchmarks.search import queries
+from capabilities.helpers import tracing
+from capabilities.helpers.cache import ResponseCache
+from capabilities.helpers.knowledge_bases import NumPyKnowledgeBase
+from capabilities.helpers.llm import (
+    FakeBackend,
+    ask_gpt,
+    set_backend,
+    set_cache,
+)
+
+
+def timed(fn, n: int) -> float:
+    start = time.perf_counter()
+    for i in range(n):
+        fn(i)
+    return (time.perf_counter() - start) / n
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=20_000)
+    parser.add_argument("--chunks", type=int, default=10_000)
+    parser.add_argument("--searches", type=int, default=500)
+    args = parser.parse_args()
+
+    set_backend(FakeBackend(n_tokens=50))
+    set_cache(ResponseCache())
+    ask_gpt("A cached prompt.")
+    knowledge = NumPyKnowledgeBase(model=HashingEmbedder())
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((args.chunks, 768), dtype=np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    knowledge.add_embedded(
+        [f"chunk {i}" for i in range(args.chunks)], embeddings
+    )
+    questions = queries(args.searches)
+
+    # Log to a logger with no handlers, so only the cost of tracing is measured.
+    logger = logging.getLogger("benchmarks.tracing.spans")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(logging.NullHandler())
+    configurations = (
+        ("off", []),
+        ("JSON log", [tracing.JSONLogSink(logger)]),
+        ("histograms", [tracing.HistogramRegistry()]),
+    )
+    print(
+        f"{args.calls} cached ask_gpt calls, {args.searches} searches of "
+        f"{args.chunks} chunks"
+    )
+    for name, sinks in configurations:
+        tracing.set_sinks(sinks)
+        ask = timed(lambda i: ask_gpt("A cached prompt."), args.calls)
+        search = timed(
+            lambda i: knowledge.search_with_scores(questions[i], 10),
+            args.searches,
+        )
+        print(
+            f"{name:>10}: ask_gpt {ask * 1e6:7.1f} us, "
+            f"search {search * 1e3:6.3f} ms"
+        )
+    tracing.set_sinks([])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Compare fixing broken generated files by rerunning the whole generation until every file
+parses, with validating each file as it streams in and regenerating only the broken ones.
+
+Usage:
+    python -m benchmarks.validation --files 10 --broken-rate 0.1 --trials 20
+"""
+
+import argparse
+import random
+import time
+
+from capabilities.helpers import llm
+from capabilities.helpers.cache import ResponseCache
+from capabilities.helpers.validation import (
+    FileBlockParser,
+    check_block,
+    generate_files,
+)
+
+VALID = """description: A parameter.
+metadata:
+  unit: currency-GBP
+  period: year
+values:
+  2020-01-01: 12_500
+"""
+BROKEN = VALID.replace("values:", "values: [")
+
+
+class BrokenFilesBackend(llm.FakeBackend):
+    """A fake backend writing YAML files, each broken with a given probability, and counting
+    the tokens it streams."""
+
+    def __init__(self, n_files: int, broken_rate: float, seed: int, **kwargs):
+        super().__init__(**kwargs)
+        self.n_files = n_files
+        self.broken_rate = broken_rate
+        self.rng = random.Random(seed)
+        self.tokens = 0
+
+    def file(self) -> str:
+        content = BROKEN if self.rng.random() < self.broken_rate else VALID
+        return f"```yaml\n{content}```\n"
+
+    def response_to(self, prompt: str, model: str) -> str:
+        if "Write parameters/" in prompt:
+            return self.file() + "I fixed the list, which wasn't closed."
+        return "".join(
+            f"parameters/gov/p{i}.yaml\n{self.file()}\n"
+            for i in range(self.n_files)
+        )
+
+    def stream(self, prompt: str, model: str):
+        for token in super().stream(prompt, model):
+            self.tokens += 1
+            yield token
+
+
+def all_valid(text: str) -> bool:
+    parser = FileBlockParser()
+    blocks = parser.feed(text) + parser.close()
+    return all(check_block(block) is None for block in blocks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=10)
+    parser.add_argument("--broken-rate", type=float, default=0.1)
+    parser.add_argument("--trials", type=int, default=20)
+    parser.add_argument("--token-latency", type=float, default=0.001)
+    args = parser.parse_args()
+
+    llm.set_cache(ResponseCache(max_entries=0))
+    print(
+        f"{args.files} files per generation, each broken with probability "
+        f"{args.broken_rate}, {args.trials} trials"
+    )
+    for name in ("rerun everything", "targeted repair"):
+        tokens = elapsed = failures = 0
+        for trial in range(args.trials):
+            backend = BrokenFilesBackend(
+                args.files,
+                args.broken_rate,
+                seed=trial,
+                token_latency=args.token_latency,
+            )
+            llm.set_backend(backend)
+            start = time.perf_counter()
+            if name == "rerun everything":
+                for attempt in range(10):
+                    if all_valid(llm.ask_gpt(f"Policy {trial} {attempt}")):
+                        break
+                else:
+                    failures += 1
+            else:
+                failures += bool(
+                    generate_files(f"Policy {trial}", "gpt-4").errors
+                )
+            elapsed += time.perf_counter() - start
+            tokens += backend.tokens
+        print(
+            f"{name:>16}: {tokens / args.trials:7.0f} tokens, "
+            f"{elapsed / args.trials:6.3f} s per generation, "
+            f"{failures} of {args.trials} still broken"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,17 @@
-from .create_parameters import create_parameters
-from .create_variables import create_variables
-from .model_policy import model_policy
-from .legislation import parse_legislation
-from .knowledge import add_to_knowledge, get_relevant_knowledge
+from .create_parameters import (
+    create_parameters,
+    create_parameters_async,
+    create_parameters_files,
+)
+from .create_variables import (
+    create_variables,
+    create_variables_async,
+    create_variables_files,
+)
+from .model_policy import model_policy, model_policy_async, model_policy_files
+from .legislation import parse_legislation, parse_legislation_async
+from .knowledge import (
+    add_to_knowledge,
+    get_relevant_knowledge,
+    get_relevant_knowledge_async,
+)
@@ -1,46 +1,83 @@
-from capabilities.helpers.llm import ask_gpt_stream
+from typing import AsyncIterator
+
+import asyncio
+
+from capabilities.helpers.llm import (
+    accumulate,
+    ask_gpt_stream,
+    ask_gpt_stream_async,
+)
+from capabilities.helpers.prompts import (
+    PARAMETERS,
+    PARAMETER_RULES,
+    PARAMETER_TEMPLATE,
+    PromptBuilder,
+)
+from capabilities.helpers.validation import (
+    StreamValidator,
+    ValidatedFiles,
+    generate_files,
+)
 
 MODEL = "gpt-4"
 
-PROMPT = f"""
-
-PolicyEngine uses standardised YAML files to model policy parameters, in the form below:
-personal_allowance.yaml
-```yaml
-description: A full-sentence description of the parameter.
-metadata:
-    unit: either currency-GBP, currency-USD, hour, or something new like 'person' if it's a population size.
-    period: the time period over which the parameter applies, one of 'year', 'month' or 'day'.
-    label: a short phrase that describes the parameter, e.g. 'personal tax allowance'. You should be able to drop this into a sentence as-is.
-    reference: # a list of any references used in writing the parameter if the user gave you any, that apply to *all* values.
-    - title: The title of the web page or legislative reference.
-      href: The URL of the web page or legislative reference.
-values: # any number of values, each with a start date, in order.
-    2018-04-01:
-        value: 11_850.00 # the value of the parameter on this date. Make sure to use underscores to separate thousands.
-        reference: # Any references which inform about *only* this value.
-        - title: ...
-          href: ...
-    2019-04-01: 12_500 # if there's no reference, you can use this shorthand.
-    2020-04-01: ...
-```
-If you don't have enough information to be confident, return what you have but add a YAML comment explaining where you think you messed up. Return valid YAML only. 
-If the user passes you data describing more than one parameter at a time, write parameter files for each one, with the filenames written above.
-Below is the information.
-"""
-
-
-def create_parameters(information: str) -> str:
+TEMPLATES = "\n\n" + PARAMETER_TEMPLATE
+CLOSING = "Below is the information.\n"
+# The prompt without examples.
+PROMPT = TEMPLATES + CLOSING
+PROMPT_BUILDER = PromptBuilder(
+    PARAMETER_RULES, TEMPLATES, CLOSING, [PARAMETERS]
+)
+
+
+def create_parameters(
+    information: str, deltas: bool = False, validate: bool = False
+) -> str:
     """Write a PolicyEngine parameter YAML file based on the information provided.
 
     Args:
         information (str): The information to use to create the parameter.
+        deltas (bool, optional): If True, yield only the new text in each update. Defaults to False.
+        validate (bool, optional): If True, check each file as it arrives, and append
+            regenerated versions of any which don't parse. Defaults to False.
 
     Returns:
         str: The parameter YAML file.
     """
 
-    prompt = PROMPT + information
+    prompt = PROMPT_BUILDER.build(information)
+
+    if validate:
+        delta_stream = StreamValidator(prompt, MODEL).watch(
+            ask_gpt_stream(prompt, model=MODEL, deltas=True)
+        )
+        yield from delta_stream if deltas else accumulate(delta_stream)
+        return
 
     # Use the chat endpoint to generate the parameter.
-    yield from ask_gpt_stream(prompt, model=MODEL)
+    yield from ask_gpt_stream(prompt, model=MODEL, deltas=deltas)
+
+
+def create_parameters_files(information: str) -> ValidatedFiles:
+    """Write PolicyEngine parameter YAML files, returned by filename once each has been checked, with any
+    which don't parse regenerated.
+
+    Args:
+        information (str): The information to use.
+
+    Returns:
+        ValidatedFiles: The files, and the errors of any still invalid.
+    """
+    return generate_files(PROMPT_BUILDER.build(information), MODEL)
+
+
+async def create_parameters_async(
+    information: str, deltas: bool = False
+) -> AsyncIterator[str]:
+    """Async version of `create_parameters`."""
+    # Selecting examples embeds the information, which blocks.
+    prompt = await asyncio.to_thread(PROMPT_BUILDER.build, information)
+    async for update in ask_gpt_stream_async(
+        prompt, model=MODEL, deltas=deltas
+    ):
+        yield update
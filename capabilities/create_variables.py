@@ -1,49 +1,81 @@
-from capabilities.helpers.llm import ask_gpt_stream
+from typing import AsyncIterator
+
+import asyncio
+
+from capabilities.helpers.llm import (
+    accumulate,
+    ask_gpt_stream,
+    ask_gpt_stream_async,
+)
+from capabilities.helpers.prompts import (
+    VARIABLES,
+    VARIABLE_RULES,
+    VARIABLE_TEMPLATE,
+    PromptBuilder,
+)
+from capabilities.helpers.validation import (
+    StreamValidator,
+    ValidatedFiles,
+    generate_files,
+)
 
 MODEL = "gpt-4"
 
-PROMPT = f"""
+TEMPLATES = "\n\n" + VARIABLE_TEMPLATE
+CLOSING = "\n\nAdd comments explaining the logic. The user will provide information below- write up all the variable files needed to accurately model the policy.\n"
+# The prompt without examples.
+PROMPT = TEMPLATES + CLOSING
+PROMPT_BUILDER = PromptBuilder(VARIABLE_RULES, TEMPLATES, CLOSING, [VARIABLES])
 
-PolicyEngine (derived from OpenFisca) uses Python to model the logic of a policy, in the form below (an example):
 
-income_tax.py
-```python
-from policyengine_uk.model_api import * # for uk-specific functions, we also model in policyengine_us.
+def create_variables(
+    information: str, deltas: bool = False, validate: bool = False
+) -> str:
+    """Write a PolicyEngine parameter YAML file based on the information provided.
 
+    Args:
+        information (str): The information to use to create the parameter.
+        deltas (bool, optional): If True, yield only the new text in each update. Defaults to False.
+        validate (bool, optional): If True, check each file as it arrives, and append
+            regenerated versions of any which don't parse. Defaults to False.
+
+    Returns:
+        str: The parameter YAML file.
+    """
 
-class income_tax(Variable):
-    label = "income tax"
-    definition_period = YEAR # or MONTH
-    entity = Household # or Person or TaxUnit (US) or BenUnit (UK)
-    value_type = float # or int or bool or str
-    reference = "https://www.gov.uk/income-tax-rates" # a reference for the parameter, if the user gave you one.
-    defined_for = None # e.g. StateCode.NY if in the US and state-specific, otherwise None.
-    documentation = "Federal income tax liabilities."
+    prompt = PROMPT_BUILDER.build(information)
 
-    def formula(person, period, parameters): # person might be household if entity is Household, etc.
-        employment_income = person("employment_income", period) # You can retrieve other variables like this. You can also use `add(household, period, [list, of, variables])` to add up variables from a higher entity.
-        parameter_subtree = parameters(period).gov.income_tax.income_tax_allowance # You can retrieve parameters like this, they're in a folder tree
-        tax_rate = parameter_subtree.rate # You can retrieve values from the parameter tree like this if they exist.
-        # variable values are all vectors, so use vectorisable operations.
-        # min_(x, y) is a vectorisable function that returns the minimum of x and y for each element of the vector. We also have max_, and you can use other NumPy default functions too.
-        return tax_rate * max_(employment_income - parameter_subtree.allowance, 0)
-```
+    if validate:
+        delta_stream = StreamValidator(prompt, MODEL).watch(
+            ask_gpt_stream(prompt, model=MODEL, deltas=True)
+        )
+        yield from delta_stream if deltas else accumulate(delta_stream)
+        return
 
-Add comments explaining the logic. The user will provide information below- write up all the variable files needed to accurately model the policy.
-"""
+    # Use the chat endpoint to generate the parameter.
+    yield from ask_gpt_stream(prompt, model=MODEL, deltas=deltas)
 
 
-def create_variables(information: str) -> str:
-    """Write a PolicyEngine parameter YAML file based on the information provided.
+def create_variables_files(information: str) -> ValidatedFiles:
+    """Write PolicyEngine variable Python files, returned by filename once each has been checked, with any
+    which don't parse regenerated.
 
     Args:
-        information (str): The information to use to create the parameter.
+        information (str): The information to use.
 
     Returns:
-        str: The parameter YAML file.
+        ValidatedFiles: The files, and the errors of any still invalid.
     """
+    return generate_files(PROMPT_BUILDER.build(information), MODEL)
 
-    prompt = PROMPT + information
 
-    # Use the chat endpoint to generate the parameter.
-    yield from ask_gpt_stream(prompt, model=MODEL)
+async def create_variables_async(
+    information: str, deltas: bool = False
+) -> AsyncIterator[str]:
+    """Async version of `create_variables`."""
+    # Selecting examples embeds the information, which blocks.
+    prompt = await asyncio.to_thread(PROMPT_BUILDER.build, information)
+    async for update in ask_gpt_stream_async(
+        prompt, model=MODEL, deltas=deltas
+    ):
+        yield update
@@ -0,0 +1,19 @@
+# A household total adding up person- and household-level income and tax variables, with `where` for a condition.
+from policyengine_uk.model_api import *
+
+
+class household_net_income(Variable):
+    label = "household net income"
+    definition_period = YEAR
+    entity = Household
+    value_type = float
+    unit = GBP
+    documentation = "Market income plus benefits, less taxes."
+
+    def formula(household, period, parameters):
+        market_income = add(household, period, ["market_income"])
+        benefits = add(household, period, ["benefits"])
+        taxes = add(household, period, ["income_tax", "national_insurance"])
+        net_income = market_income + benefits - taxes
+        # Vectorised conditions use where() rather than if.
+        return where(net_income > 0, net_income, 0)
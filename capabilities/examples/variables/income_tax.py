@@ -0,0 +1,22 @@
+# A UK tax computed from a marginal rate schedule parameter with `calc`, after deducting an allowance.
+from policyengine_uk.model_api import *
+
+
+class income_tax(Variable):
+    label = "income tax"
+    definition_period = YEAR
+    entity = Person
+    value_type = float
+    unit = GBP
+    reference = "https://www.legislation.gov.uk/ukpga/2007/3/section/35"
+    documentation = "Income tax liability on taxable income."
+
+    def formula(person, period, parameters):
+        income_tax = parameters(period).gov.hmrc.income_tax
+        taxable_income = max_(
+            person("adjusted_net_income", period)
+            - income_tax.allowances.personal_allowance.amount,
+            0,
+        )
+        # The rate schedule applies each bracket's rate to the income within it.
+        return income_tax.rates.uk.calc(taxable_income)
@@ -0,0 +1,13 @@
+# A boolean person-level variable from an age threshold, with no parameters beyond the threshold.
+from policyengine_uk.model_api import *
+
+
+class is_child(Variable):
+    label = "is a child"
+    definition_period = YEAR
+    entity = Person
+    value_type = bool
+    documentation = "Whether the person is under 16."
+
+    def formula(person, period, parameters):
+        return person("age", period) < 16
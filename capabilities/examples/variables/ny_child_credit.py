@@ -0,0 +1,19 @@
+# A state-specific credit, only computed for tax units in New York with `defined_for = StateCode.NY`.
+from policyengine_us.model_api import *
+
+
+class ny_empire_state_child_credit(Variable):
+    label = "New York Empire State child credit"
+    definition_period = YEAR
+    entity = TaxUnit
+    value_type = float
+    unit = USD
+    reference = "https://www.nysenate.gov/legislation/laws/TAX/606"
+    defined_for = StateCode.NY
+    documentation = "New York's credit for each qualifying child."
+
+    def formula(tax_unit, period, parameters):
+        p = parameters(period).gov.states.ny.tax.income.credits.ctc
+        # Count the children in the tax unit from a person-level variable.
+        children = add(tax_unit, period, ["is_qualifying_child"])
+        return children * p.amount
@@ -0,0 +1,24 @@
+# A US tax credit which phases in with earnings up to a maximum, then phases out above an income threshold.
+from policyengine_us.model_api import *
+
+
+class phased_credit(Variable):
+    label = "phased credit"
+    definition_period = YEAR
+    entity = TaxUnit
+    value_type = float
+    unit = USD
+    defined_for = None
+    documentation = "A credit phasing in with earnings and out with income."
+
+    def formula(tax_unit, period, parameters):
+        p = parameters(period).gov.irs.credits.phased_credit
+        earnings = add(
+            tax_unit, period, ["employment_income", "self_employment_income"]
+        )
+        # Phase in: a share of earnings, capped at the maximum.
+        phased_in = min_(earnings * p.phase_in_rate, p.maximum)
+        # Phase out: reduced by a share of income above the threshold.
+        income = tax_unit("adjusted_gross_income", period)
+        reduction = max_(income - p.phase_out.threshold, 0) * p.phase_out.rate
+        return max_(phased_in - reduction, 0)
@@ -0,0 +1,20 @@
+# A monthly means-tested benefit for a benefit unit, withdrawn at a taper rate on earnings above an allowance.
+from policyengine_uk.model_api import *
+
+
+class universal_credit(Variable):
+    label = "Universal Credit"
+    definition_period = MONTH
+    entity = BenUnit
+    value_type = float
+    unit = GBP
+    reference = "https://www.legislation.gov.uk/uksi/2013/376/regulation/22"
+    documentation = "Universal Credit entitlement after the earnings taper."
+
+    def formula(benunit, period, parameters):
+        p = parameters(period).gov.dwp.universal_credit.means_test
+        maximum = benunit("universal_credit_maximum_amount", period)
+        earnings = add(benunit, period, ["employment_income"])
+        # Earnings above the work allowance reduce the award at the taper rate.
+        excess_earnings = max_(earnings - p.work_allowance, 0)
+        return max_(maximum - excess_earnings * p.reduction_rate, 0)
@@ -0,0 +1,204 @@
+from typing import List, Optional
+
+import numpy as np
+
+from capabilities.helpers.storage import atomic_write
+
+# Rows are assigned to centroids this many at a time, to bound the size of the distance matrix.
+ASSIGN_BLOCK_SIZE = 16_384
+
+
+def nearest_centroids(
+    embeddings: np.ndarray, centroids: np.ndarray, n: int = 1
+) -> np.ndarray:
+    """Return the index of the nearest centroid (or n nearest, closest first) to each row, by L2
+    distance."""
+    half_norms = (centroids**2).sum(axis=1) / 2
+    n = min(n, len(centroids))
+    results = []
+    for start in range(0, len(embeddings), ASSIGN_BLOCK_SIZE):
+        block = np.asarray(
+            embeddings[start : start + ASSIGN_BLOCK_SIZE], dtype=np.float32
+        )
+        # |x - c|^2 = |x|^2 - 2 (x.c - |c|^2 / 2), so the nearest centroid maximises x.c - |c|^2 / 2.
+        closeness = block @ centroids.T - half_norms
+        if n == 1:
+            results.append(closeness.argmax(axis=1))
+        else:
+            nearest = np.argpartition(-closeness, n - 1, axis=1)[:, :n]
+            order = np.argsort(
+                -np.take_along_axis(closeness, nearest, axis=1), axis=1
+            )
+            results.append(np.take_along_axis(nearest, order, axis=1))
+    return np.concatenate(results)
+
+
+def kmeans(
+    embeddings: np.ndarray, k: int, n_iter: int = 10, seed: int = 0
+) -> np.ndarray:
+    """Cluster rows with Lloyd's algorithm.
+
+    Args:
+        embeddings (np.ndarray): The rows to cluster.
+        k (int): The number of clusters.
+        n_iter (int, optional): The number of iterations. Defaults to 10.
+        seed (int, optional): The random seed. Defaults to 0.
+
+    Returns:
+        np.ndarray: The (k, dim) centroids.
+    """
+    rng = np.random.default_rng(seed)
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    k = min(k, len(embeddings))
+    centroids = embeddings[rng.choice(len(embeddings), k, replace=False)]
+    for _ in range(n_iter):
+        assignments = nearest_centroids(embeddings, centroids)
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=k)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        occupied = counts > 0
+        sums = np.add.reduceat(embeddings[order], starts[occupied], axis=0)
+        centroids = centroids.copy()
+        centroids[occupied] = sums / counts[occupied, None]
+        # Restart empty clusters from random rows.
+        empty = np.flatnonzero(~occupied)
+        if len(empty):
+            centroids[empty] = embeddings[
+                rng.choice(len(embeddings), len(empty), replace=False)
+            ]
+    return centroids
+
+
+class IVFIndex:
+    """An inverted-file index for approximate nearest-neighbour search. Rows are clustered with
+    k-means, and a query is only scored against the rows in its `n_probe` nearest clusters.
+
+    The index trains itself once `min_train_size` rows have been added, and retrains when the
+    number of rows has grown by `retrain_factor` since. Rows added in between are assigned to
+    the nearest existing cluster.
+
+    Args:
+        n_lists (int, optional): The number of clusters. Defaults to 4 * sqrt(rows) at training time.
+        n_probe (int, optional): The number of clusters searched per query. Higher values trade
+            latency for recall. Defaults to 8.
+        min_train_size (int, optional): The number of rows below which search is exact. Defaults to 10,000.
+        max_train_sample (int, optional): The number of rows k-means is run on. Defaults to 50,000.
+        retrain_factor (float, optional): Defaults to 4.
+        seed (int, optional): The random seed. Defaults to 0.
+    """
+
+    def __init__(
+        self,
+        n_lists: Optional[int] = None,
+        n_probe: int = 8,
+        min_train_size: int = 10_000,
+        max_train_sample: int = 50_000,
+        retrain_factor: float = 4,
+        seed: int = 0,
+    ):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.min_train_size = min_train_size
+        self.max_train_sample = max_train_sample
+        self.retrain_factor = retrain_factor
+        self.seed = seed
+        self.centroids = None
+        self.trained_size = 0
+        self.size = 0
+        self.lists: List[List[np.ndarray]] = []
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    def train(self, embeddings: np.ndarray):
+        """Cluster every row of `embeddings` from scratch."""
+        n_lists = self.n_lists or max(1, int(4 * np.sqrt(len(embeddings))))
+        rng = np.random.default_rng(self.seed)
+        sample = embeddings
+        if len(embeddings) > self.max_train_sample:
+            sample = embeddings[
+                np.sort(
+                    rng.choice(
+                        len(embeddings), self.max_train_sample, replace=False
+                    )
+                )
+            ]
+        self.centroids = kmeans(sample, n_lists, seed=self.seed)
+        self.lists = [[] for _ in range(len(self.centroids))]
+        self.size = 0
+        self._assign(embeddings, 0)
+        self.trained_size = self.size
+
+    def add(self, embeddings: np.ndarray, all_embeddings: np.ndarray):
+        """Index rows appended to the end of `all_embeddings`.
+
+        Args:
+            embeddings (np.ndarray): The new rows.
+            all_embeddings (np.ndarray): Every row, including the new ones, in case the index
+                needs to (re)train.
+        """
+        total = len(all_embeddings)
+        if total < self.min_train_size:
+            return
+        if (
+            not self.trained
+            or total >= self.retrain_factor * self.trained_size
+        ):
+            self.train(all_embeddings)
+        else:
+            self._assign(embeddings, total - len(embeddings))
+
+    def candidates(self, query_embedding: np.ndarray, n_probe: int = None):
+        """Return the rows in the clusters nearest to a query."""
+        probes = nearest_centroids(
+            np.asarray(query_embedding, dtype=np.float32)[None],
+            self.centroids,
+            n=n_probe or self.n_probe,
+        )[0]
+        return np.concatenate([self._list(i) for i in np.atleast_1d(probes)])
+
+    def save(self, path: str):
+        rows = np.concatenate(
+            [self._list(i) for i in range(len(self.lists))]
+            or [np.zeros(0, np.int64)]
+        )
+        lengths = np.array(
+            [len(self._list(i)) for i in range(len(self.lists))]
+        )
+        with atomic_write(path) as f:
+            np.savez(
+                f,
+                centroids=self.centroids,
+                rows=rows,
+                lengths=lengths,
+                sizes=np.array([self.size, self.trained_size]),
+            )
+
+    def load(self, path: str):
+        with np.load(path) as saved:
+            self.centroids = saved["centroids"]
+            self.lists = [
+                [rows]
+                for rows in np.split(
+                    saved["rows"], np.cumsum(saved["lengths"])[:-1]
+                )
+            ]
+            self.size, self.trained_size = saved["sizes"].tolist()
+
+    def _assign(self, embeddings: np.ndarray, start: int):
+        assignments = nearest_centroids(embeddings, self.centroids)
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=len(self.centroids))
+        for i, rows in enumerate(np.split(order, np.cumsum(counts)[:-1])):
+            if len(rows):
+                self.lists[i].append(rows.astype(np.int64) + start)
+        self.size = start + len(embeddings)
+
+    def _list(self, i: int) -> np.ndarray:
+        chunks = self.lists[i]
+        if not chunks:
+            return np.zeros(0, dtype=np.int64)
+        if len(chunks) > 1:
+            chunks[:] = [np.concatenate(chunks)]
+        return chunks[0]
@@ -0,0 +1,387 @@
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional, Sequence
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+
+class ResponseCache:
+    """A content-addressed cache of LLM responses, with an in-memory LRU tier and an optional
+    SQLite tier on disk.
+
+    Args:
+        max_entries (int, optional): The number of responses kept in memory. Defaults to 128.
+            If 0 and no path is given, nothing is cached.
+        path (str, optional): The SQLite file for the disk tier. Defaults to None (memory only).
+        max_bytes (int, optional): The size the disk tier is trimmed to, evicting the least
+            recently used responses first. Defaults to 256 MB.
+        ttl (float, optional): Seconds before a response expires. Defaults to 7 days.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 128,
+        path: Optional[str] = None,
+        max_bytes: int = 256 * 1024 * 1024,
+        ttl: float = 7 * 24 * 60 * 60,
+    ):
+        self.max_entries = max_entries
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self._lock = threading.Lock()
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+                """)
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)"
+            )
+            self._db.commit()
+
+    @staticmethod
+    def key(model: str, prompt: str, **parameters) -> str:
+        """Return a stable hash of a request.
+
+        Args:
+            model (str): The model used.
+            prompt (str): The prompt sent.
+            **parameters: Any other request parameters which affect the response.
+
+        Returns:
+            str: The cache key.
+        """
+        request = json.dumps(
+            dict(model=model, prompt=prompt, parameters=parameters),
+            sort_keys=True,
+        )
+        return hashlib.sha256(request.encode()).hexdigest()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 or self._db is not None
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached response for a key, or None if there isn't one (or it has expired)."""
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            if key in self.memory:
+                response, created_at = self.memory[key]
+                if now - created_at < self.ttl:
+                    self.memory.move_to_end(key)
+                    self.hits += 1
+                    return response
+                del self.memory[key]
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT response, created_at FROM responses WHERE key = ?",
+                    (key,),
+                ).fetchone()
+                if row is not None and now - row[1] < self.ttl:
+                    self._db.execute(
+                        "UPDATE responses SET accessed_at = ? WHERE key = ?",
+                        (now, key),
+                    )
+                    self._db.commit()
+                    self._remember(key, row[0], row[1])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return row[0]
+                if row is not None:
+                    self._db.execute(
+                        "DELETE FROM responses WHERE key = ?", (key,)
+                    )
+                    self._db.commit()
+            self.misses += 1
+            return None
+
+    def set(self, key: str, response: str):
+        """Store a response."""
+        if not self.enabled:
+            return
+        now = time.time()
+        with self._lock:
+            self._remember(key, response, now)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                    (key, response, len(response.encode()), now, now),
+                )
+                self._evict(now)
+                self._db.commit()
+
+    def clear(self):
+        """Remove every cached response."""
+        with self._lock:
+            self.memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    def stats(self) -> dict:
+        """Return the hit and miss counts, and the size of each tier."""
+        with self._lock:
+            stats = dict(
+                hits=self.hits,
+                misses=self.misses,
+                memory_hits=self.hits - self.disk_hits,
+                disk_hits=self.disk_hits,
+                memory_entries=len(self.memory),
+            )
+            if self._db is not None:
+                entries, size = self._db.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+                ).fetchone()
+                stats.update(disk_entries=entries, disk_bytes=size)
+            return stats
+
+    def _remember(self, key: str, response: str, created_at: float):
+        if self.max_entries <= 0:
+            return
+        self.memory[key] = (response, created_at)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def _evict(self, now: float):
+        self._db.execute(
+            "DELETE FROM responses WHERE created_at <= ?", (now - self.ttl,)
+        )
+        total = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._db.execute(
+            "SELECT key, size FROM responses ORDER BY accessed_at"
+        ).fetchall()
+        evicted = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        self._db.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+
+class EmbeddingCache:
+    """An in-memory LRU cache of embeddings, keyed on the model name and a chunk's content digest.
+
+    Args:
+        max_entries (int, optional): The number of embeddings kept. Defaults to 20,000
+            (about 60 MB of 768-dim float32 vectors).
+    """
+
+    def __init__(self, max_entries: int = 20_000):
+        self.max_entries = max_entries
+        self.embeddings = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get_many(self, model: str, digests: List[str]) -> list:
+        """Return the cached embedding for each digest, or None where there isn't one."""
+        with self._lock:
+            found = []
+            for digest in digests:
+                embedding = self.embeddings.get((model, digest))
+                if embedding is None:
+                    self.misses += 1
+                else:
+                    self.embeddings.move_to_end((model, digest))
+                    self.hits += 1
+                found.append(embedding)
+            return found
+
+    def set_many(self, model: str, digests: List[str], embeddings):
+        """Store an embedding for each digest."""
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            for digest, embedding in zip(digests, embeddings):
+                self.embeddings[(model, digest)] = embedding
+                self.embeddings.move_to_end((model, digest))
+            while len(self.embeddings) > self.max_entries:
+                self.embeddings.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(
+                hits=self.hits,
+                misses=self.misses,
+                entries=len(self.embeddings),
+            )
+
+
+# Shared by every knowledge base in the process.
+EMBEDDING_CACHE = EmbeddingCache()
+
+
+class SemanticEntry(NamedTuple):
+    embedding: np.ndarray
+    ids: tuple
+    min_score: float
+    answer: str
+
+
+class SemanticCache:
+    """An in-memory LRU cache of answers to questions, matched by meaning rather than by text.
+
+    A question is answered from the cache if its embedding is within `threshold` cosine
+    similarity of a cached question's, and retrieval found the same chunks for both. Adding
+    chunks invalidates the answers whose retrieval they would have changed.
+
+    Args:
+        threshold (float, optional): The cosine similarity above which questions match.
+            Defaults to 0.95.
+        max_entries (int, optional): The number of answers kept. Defaults to 256. If 0, nothing
+            is cached.
+    """
+
+    def __init__(self, threshold: float = 0.95, max_entries: int = 256):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # Incremented whenever chunks are added, so answers generated from older retrieval
+        # results are not stored.
+        self.version = 0
+        self._next_key = 0
+        self._matrix = None
+        self._lock = threading.Lock()
+
+    def get(self, embedding: np.ndarray, ids: Sequence[str]) -> Optional[str]:
+        """Return the cached answer to a question, or None if there isn't one.
+
+        Args:
+            embedding (np.ndarray): The question's embedding.
+            ids (Sequence[str]): The ids of the chunks retrieved for it, best first.
+
+        Returns:
+            Optional[str]: The answer.
+        """
+        embedding = _normalise(embedding)
+        ids = tuple(ids)
+        with self._lock:
+            if self.entries:
+                keys, matrix = self._keys_and_matrix()
+                scores = matrix @ embedding
+                for i in np.argsort(-scores):
+                    if scores[i] < self.threshold:
+                        break
+                    entry = self.entries[keys[i]]
+                    if entry.ids == ids:
+                        self.entries.move_to_end(keys[i])
+                        self.hits += 1
+                        return entry.answer
+            self.misses += 1
+            return None
+
+    def set(
+        self,
+        embedding: np.ndarray,
+        ids: Sequence[str],
+        scores: Sequence[float],
+        answer: str,
+        version: int = None,
+    ):
+        """Store the answer to a question.
+
+        Args:
+            embedding (np.ndarray): The question's embedding.
+            ids (Sequence[str]): The ids of the chunks retrieved for it, best first.
+            scores (Sequence[float]): Their similarity scores.
+            answer (str): The answer.
+            version (int, optional): `version` when the chunks were retrieved. If chunks have
+                been added since, the answer is not stored.
+        """
+        if self.max_entries <= 0:
+            return
+        embedding = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = float(np.linalg.norm(embedding)) or 1.0
+        # The scores are dot products with the embedding as given, while `invalidate` scores new
+        # chunks against the normalised one, so scale them to match.
+        entry = SemanticEntry(
+            embedding / norm,
+            tuple(ids),
+            min(scores, default=-1.0) / norm,
+            answer,
+        )
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+            self.entries[self._next_key] = entry
+            self._next_key += 1
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self._matrix = None
+
+    def invalidate(self, embeddings: np.ndarray):
+        """Drop answers which new chunks would have changed: those where a new chunk is more
+        similar to the question than the least similar chunk retrieved for it.
+
+        Args:
+            embeddings (np.ndarray): The embeddings of the chunks added.
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        with self._lock:
+            self.version += 1
+            if not self.entries or not len(embeddings):
+                return
+            keys, matrix = self._keys_and_matrix()
+            best = (embeddings @ matrix.T).max(axis=0)
+            for key, score in zip(keys, best):
+                if score > self.entries[key].min_score:
+                    del self.entries[key]
+                    self.invalidations += 1
+                    self._matrix = None
+
+    def clear(self):
+        """Remove every cached answer."""
+        with self._lock:
+            self.entries.clear()
+            self._matrix = None
+            self.version += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(
+                hits=self.hits,
+                misses=self.misses,
+                invalidations=self.invalidations,
+                entries=len(self.entries),
+            )
+
+    def _keys_and_matrix(self):
+        if self._matrix is None:
+            self._matrix = (
+                list(self.entries),
+                np.stack([entry.embedding for entry in self.entries.values()]),
+            )
+        return self._matrix
+
+
+def _normalise(embedding: np.ndarray) -> np.ndarray:
+    embedding = np.asarray(embedding, dtype=np.float32).ravel()
+    return embedding / (np.linalg.norm(embedding) or 1.0)
@@ -0,0 +1,247 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    AsyncIterable,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+import asyncio
+import queue
+import threading
+
+T = TypeVar("T")
+
+_DONE = object()
+
+
+class _Failed:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def ordered_fan_out(
+    tasks: List[Callable[[], Iterable[T]]],
+    max_concurrency: int = 4,
+    semaphore: Optional[threading.Semaphore] = None,
+) -> Iterator[Tuple[int, T]]:
+    """Run streaming tasks concurrently, yielding their items in task order.
+
+    Items from the first unfinished task are yielded as soon as they arrive, while later tasks run
+    ahead and buffer their items until it is their turn.
+
+    Args:
+        tasks (List[Callable[[], Iterable[T]]]): Functions each returning a stream of items.
+        max_concurrency (int, optional): The number of tasks run at once. Defaults to 4.
+        semaphore (threading.Semaphore, optional): If given, each task also holds this while it
+            runs, so a limit can be shared between calls (e.g. across user sessions).
+
+    Returns:
+        Iterator[Tuple[int, T]]: (task index, item) pairs.
+    """
+    queues = [queue.Queue() for _ in tasks]
+    cancelled = threading.Event()
+
+    def run(i: int):
+        if cancelled.is_set():
+            return
+        try:
+            if semaphore is not None:
+                semaphore.acquire()
+            try:
+                for item in tasks[i]():
+                    if cancelled.is_set():
+                        return
+                    queues[i].put(item)
+            finally:
+                if semaphore is not None:
+                    semaphore.release()
+        except BaseException as e:
+            queues[i].put(_Failed(e))
+        finally:
+            queues[i].put(_DONE)
+
+    pool = ThreadPoolExecutor(max_workers=max(1, max_concurrency))
+    try:
+        for i in range(len(tasks)):
+            pool.submit(run, i)
+        for i, items in enumerate(queues):
+            while True:
+                item = items.get()
+                if item is _DONE:
+                    break
+                if isinstance(item, _Failed):
+                    raise item.error
+                yield i, item
+    finally:
+        cancelled.set()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def ordered_fan_out_async(
+    tasks: List[Callable[[], AsyncIterable[T]]],
+    max_concurrency: int = 4,
+) -> AsyncIterator[Tuple[int, T]]:
+    """Async version of `ordered_fan_out`, running the tasks on the event loop.
+
+    Args:
+        tasks (List[Callable[[], AsyncIterable[T]]]): Functions each returning an async stream.
+        max_concurrency (int, optional): The number of tasks run at once. Defaults to 4.
+
+    Returns:
+        AsyncIterator[Tuple[int, T]]: (task index, item) pairs.
+    """
+    queues = [asyncio.Queue() for _ in tasks]
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def run(i: int):
+        try:
+            async with semaphore:
+                async for item in tasks[i]():
+                    queues[i].put_nowait(item)
+        except Exception as e:
+            queues[i].put_nowait(_Failed(e))
+        finally:
+            queues[i].put_nowait(_DONE)
+
+    running = [asyncio.ensure_future(run(i)) for i in range(len(tasks))]
+    try:
+        for i, items in enumerate(queues):
+            while True:
+                item = await items.get()
+                if item is _DONE:
+                    break
+                if isinstance(item, _Failed):
+                    raise item.error
+                yield i, item
+    finally:
+        for task in running:
+            task.cancel()
+
+
+async def iterate_in_thread(
+    iterable: Callable[[], Iterable[T]],
+) -> AsyncIterator[T]:
+    """Iterate over a blocking stream from a coroutine, fetching each item in a worker thread.
+
+    Args:
+        iterable (Callable[[], Iterable[T]]): A function returning the stream, also called in a
+            worker thread.
+
+    Returns:
+        AsyncIterator[T]: The items.
+    """
+    iterator = await asyncio.to_thread(lambda: iter(iterable()))
+    while True:
+        item = await asyncio.to_thread(next, iterator, _DONE)
+        if item is _DONE:
+            return
+        yield item
+
+
+class _Flight:
+    """A stream being read once on behalf of any number of followers."""
+
+    def __init__(
+        self,
+        items: AsyncIterable[T],
+        on_complete: Optional[Callable[[List[T]], None]],
+        on_done: Callable[[], None],
+    ):
+        self.items: List[T] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.followers = 0
+        self._changed = asyncio.Event()
+        self._on_done = on_done
+        self._task = asyncio.ensure_future(self._read(items, on_complete))
+
+    async def _read(self, items: AsyncIterable[T], on_complete):
+        try:
+            async for item in items:
+                self.items.append(item)
+                self._notify()
+            if on_complete is not None:
+                on_complete(self.items)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._on_done()
+            self._notify()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def follow(self) -> AsyncIterator[T]:
+        self.followers += 1
+        try:
+            i = 0
+            while True:
+                if i < len(self.items):
+                    yield self.items[i]
+                    i += 1
+                elif self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                else:
+                    await self._changed.wait()
+        finally:
+            self.followers -= 1
+            if not self.followers and not self.done:
+                # Nobody is listening, so stop reading, and let the next request start afresh.
+                self._on_done()
+                self._task.cancel()
+
+
+class StreamCoalescer:
+    """Share one async stream between identical requests made while it is in flight, so they
+    cost one upstream call. Every caller gets every item from the start, and the upstream stream
+    is cancelled if all of them stop listening.
+    """
+
+    def __init__(self):
+        self.in_flight: Dict[Hashable, _Flight] = {}
+        self.started = 0
+        self.joined = 0
+
+    def stream(
+        self,
+        key: Hashable,
+        start: Callable[[], AsyncIterable[T]],
+        on_complete: Optional[Callable[[List[T]], None]] = None,
+    ) -> AsyncIterator[T]:
+        """Follow the stream in flight for a key, or start one.
+
+        Args:
+            key (Hashable): Identifies the request.
+            start (Callable[[], AsyncIterable[T]]): Starts the stream, if none is in flight.
+            on_complete (Callable[[List[T]], None], optional): Called with every item once a
+                stream started by this call has finished successfully.
+
+        Returns:
+            AsyncIterator[T]: The items.
+        """
+        flight = self.in_flight.get(key)
+        if flight is None:
+            self.started += 1
+
+            def on_done():
+                if self.in_flight.get(key) is flight:
+                    del self.in_flight[key]
+
+            flight = self.in_flight[key] = _Flight(
+                start(), on_complete, on_done
+            )
+        else:
+            self.joined += 1
+        return flight.follow()
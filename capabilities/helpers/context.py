@@ -0,0 +1,194 @@
+from typing import Callable, Dict, List, NamedTuple, Tuple
+import re
+
+import numpy as np
+
+from capabilities.helpers.knowledge_bases import (
+    DENSE,
+    Filters,
+    KnowledgeBase,
+)
+from capabilities.helpers.text_splitters import (
+    WORD_PATTERN,
+    overlap,
+    shingles,
+)
+
+# Chunks are trimmed at blank lines, which is where § / (a) / (1) / (A) headers start.
+SECTION_BOUNDARY = re.compile(r"\n\s*\n")
+# Searching deeper stops once less than this much of the budget is left.
+MIN_CHUNK_TOKENS = 32
+
+_encodings = {}
+
+
+def count_tokens(text: str, model: str = "gpt-3.5-turbo") -> int:
+    """Count the tokens in text with the model's tiktoken encoding, or estimate them as one per
+    word or punctuation mark if tiktoken isn't installed.
+
+    Args:
+        text (str): The text.
+        model (str, optional): The model whose tokenizer to use. Defaults to "gpt-3.5-turbo".
+
+    Returns:
+        int: The number of tokens.
+    """
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return len(WORD_PATTERN.findall(text))
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def _get_encoding(model: str):
+    if model not in _encodings:
+        try:
+            import tiktoken
+        except ImportError:
+            _encodings[model] = None
+        else:
+            try:
+                _encodings[model] = tiktoken.encoding_for_model(model)
+            except KeyError:
+                _encodings[model] = tiktoken.get_encoding("cl100k_base")
+    return _encodings[model]
+
+
+def trim_to_budget(
+    text: str, token_budget: int, count: Callable[[str], int] = count_tokens
+) -> Tuple[str, int]:
+    """Cut text at the last section boundary which keeps it within a token budget.
+
+    Args:
+        text (str): The text.
+        token_budget (int): The maximum number of tokens.
+        count (Callable[[str], int], optional): The token counter. Defaults to count_tokens.
+
+    Returns:
+        Tuple[str, int]: The trimmed text (empty if even the first section is too long) and its
+            token count.
+    """
+    end, tokens = 0, 0
+    for boundary in SECTION_BOUNDARY.finditer(text):
+        piece_tokens = count(text[end : boundary.start()])
+        if tokens + piece_tokens > token_budget:
+            return text[:end], tokens
+        end, tokens = boundary.start(), tokens + piece_tokens
+    piece_tokens = count(text[end:])
+    if tokens + piece_tokens > token_budget:
+        return text[:end], tokens
+    return text, tokens + piece_tokens
+
+
+class Context(NamedTuple):
+    """Chunks packed into a prompt.
+
+    Args:
+        chunks (List[Tuple[str, str, float]]): (id, text, score) for each chunk used, best first.
+            Texts may have been trimmed.
+        tokens (int): The tokens used, including separators.
+        exhausted (bool): Whether every chunk in the knowledge base was considered.
+    """
+
+    chunks: List[Tuple[str, str, float]]
+    tokens: int
+    exhausted: bool = False
+
+    @property
+    def text(self) -> str:
+        return "\n".join(text for _, text, _ in self.chunks)
+
+
+def pack_context(
+    results: List[Tuple[str, str, float]],
+    token_budget: int,
+    count: Callable[[str], int] = count_tokens,
+    duplicate_threshold: float = 0.8,
+) -> Context:
+    """Fill a token budget with search results in score order. Results which mostly repeat an
+    earlier one are dropped, and a result which doesn't fit is trimmed at a section boundary.
+
+    Args:
+        results (List[Tuple[str, str, float]]): (id, text, score) triples, best first.
+        token_budget (int): The maximum number of tokens.
+        count (Callable[[str], int], optional): The token counter. Defaults to count_tokens.
+        duplicate_threshold (float, optional): The fraction of a result's word sequences found in
+            an earlier result at which it is dropped. Defaults to 0.8.
+
+    Returns:
+        Context: The chunks used.
+    """
+    chunks, packed_shingles = [], []
+    tokens = 0
+    separator_tokens = count("\n")
+    for id, text, score in results:
+        remaining = token_budget - tokens - (separator_tokens if chunks else 0)
+        if remaining < MIN_CHUNK_TOKENS:
+            break
+        text_shingles = shingles(text)
+        if any(
+            overlap(text_shingles, other) >= duplicate_threshold
+            for other in packed_shingles
+        ):
+            continue
+        text, text_tokens = trim_to_budget(text, remaining, count)
+        if not text:
+            continue
+        tokens += text_tokens + (separator_tokens if chunks else 0)
+        chunks.append((id, text, score))
+        packed_shingles.append(text_shingles)
+    return Context(chunks, tokens)
+
+
+def retrieve_context(
+    knowledge: KnowledgeBase,
+    query_embedding: np.ndarray,
+    token_budget: int,
+    depth: int = 4,
+    max_depth: int = 64,
+    count: Callable[[str], int] = count_tokens,
+    query: str = None,
+    mode: str = DENSE,
+    filters: Filters = None,
+) -> Context:
+    """Search a knowledge base and pack the results into a token budget, searching deeper while
+    the budget isn't full, rather than retrieving a fixed number of chunks.
+
+    Args:
+        knowledge (KnowledgeBase): The knowledge base.
+        query_embedding (np.ndarray): The query's embedding.
+        token_budget (int): The maximum number of tokens.
+        depth (int, optional): The number of results to start with. Defaults to 4.
+        max_depth (int, optional): The most results to consider. Defaults to 64.
+        count (Callable[[str], int], optional): The token counter. Defaults to count_tokens.
+        query (str, optional): The query text, needed by every search mode except DENSE.
+        mode (str, optional): The search mode. Defaults to DENSE.
+        filters (Filters, optional): Only use chunks whose metadata matches.
+
+    Returns:
+        Context: The chunks used.
+    """
+    counts: Dict[str, int] = {}
+
+    def count_once(text: str) -> int:
+        if text not in counts:
+            counts[text] = count(text)
+        return counts[text]
+
+    query_embeddings = np.asarray(query_embedding).reshape(1, -1)
+    while True:
+        results = knowledge.search_embeddings(
+            query_embeddings,
+            top_n=depth,
+            queries=None if query is None else [query],
+            mode=mode,
+            filters=filters,
+        )[0]
+        context = pack_context(results, token_budget, count_once)
+        exhausted = len(results) < depth
+        if (
+            exhausted
+            or depth >= max_depth
+            or token_budget - context.tokens < MIN_CHUNK_TOKENS
+        ):
+            return context._replace(exhausted=exhausted)
+        depth = min(2 * depth, max_depth)
@@ -1,13 +1,196 @@
-from typing import Iterable, Callable
-from sentence_transformers import SentenceTransformer, util
+from typing import TYPE_CHECKING, Iterable, Callable, Dict, List, Tuple, Union
+from collections import defaultdict
+from itertools import chain
 import numpy as np
-import pandas as pd
-import chromadb
-from capabilities.helpers.text_splitters import llm_split
+import hashlib
+import json
+import os
+import re
+import threading
+from capabilities.helpers.ann import IVFIndex
+from capabilities.helpers.cache import EMBEDDING_CACHE, EmbeddingCache
+from capabilities.helpers.lexical import (
+    LexicalIndex,
+    cites_section,
+    reciprocal_rank_fusion,
+)
+from capabilities.helpers.quantization import (
+    SCORE_BLOCK_SIZE as ENCODE_BLOCK_SIZE,
+    DecodedRows,
+    load_quantizer,
+)
+from capabilities.helpers.storage import (
+    TextStore,
+    atomic_write,
+    load_matrix,
+    save_matrix,
+)
+from capabilities.helpers.text_splitters import llm_split, with_metadata
+from capabilities.helpers.tracing import span
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+MODEL_NAME = "all-mpnet-base-v2"
+# If set, Chroma collections are stored in this directory rather than in memory.
+CHROMA_PATH_ENV_VAR = "POLICYENGINE_AI_CHROMA_PATH"
+
+# Search modes: embedding similarity, BM25 keyword search, both combined by reciprocal rank
+# fusion, or embedding similarity over just the best keyword matches.
+DENSE = "dense"
+LEXICAL = "lexical"
+HYBRID = "hybrid"
+PREFILTER = "prefilter"
+SEARCH_MODES = (DENSE, LEXICAL, HYBRID, PREFILTER)
+
+# Characters allowed in Chroma collection and directory names.
+SHARD_NAME_PATTERN = re.compile(r"[^a-zA-Z0-9_-]+")
+# The prefix of the app's Chroma collections, which store a jurisdiction each.
+KNOWLEDGE_COLLECTION = "knowledge"
+# The Chroma collection metadata field recording the key of the shard a collection stores.
+SHARD_KEY_FIELD = "shard_key"
+
+# Search filters map metadata fields to a value, or to a list of values any of which may match.
+Filters = Dict[str, Union[str, Iterable[str]]]
+
+# sentence_transformers (and torch), chromadb and pandas are slow to import, so they are only
+# imported when first needed, and the model and Chroma client are shared by the whole process.
+_models = {}
+_chroma_client = None
+_lock = threading.Lock()
+
+
+def get_embedding_model(name: str = MODEL_NAME) -> "SentenceTransformer":
+    """Return the process-wide instance of an embedding model, loading it on first use.
+
+    Args:
+        name (str, optional): The model name. Defaults to "all-mpnet-base-v2".
+
+    Returns:
+        SentenceTransformer: The model.
+    """
+    if name not in _models:
+        with _lock:
+            if name not in _models:
+                from sentence_transformers import SentenceTransformer
+
+                _models[name] = SentenceTransformer(name)
+    return _models[name]
+
+
+def get_chroma_client():
+    """Return the process-wide Chroma client, creating it on first use. Collections persist to
+    the directory in POLICYENGINE_AI_CHROMA_PATH if it is set, and are in-memory otherwise.
+    """
+    global _chroma_client
+    if _chroma_client is None:
+        with _lock:
+            if _chroma_client is None:
+                import chromadb
+
+                path = os.environ.get(CHROMA_PATH_ENV_VAR)
+                if path:
+                    _chroma_client = chromadb.PersistentClient(path=path)
+                else:
+                    _chroma_client = chromadb.Client()
+    return _chroma_client
+
+
+def chunk_id(value: str) -> str:
+    """Return a stable id for a chunk: a BLAKE2 digest of its whitespace-normalised text.
+
+    Unlike `hash`, this is the same in every process, so duplicates are recognised after a restart.
+
+    Args:
+        value (str): The chunk.
+
+    Returns:
+        str: The id.
+    """
+    normalised = " ".join(value.split())
+    return hashlib.blake2b(normalised.encode(), digest_size=16).hexdigest()
+
+
+def allowed_values(value: Union[str, Iterable[str]]) -> set:
+    """Return the values a filter allows."""
+    return {value} if isinstance(value, str) else set(value)
+
+
+def matches(metadata: Dict[str, str], filters: Filters) -> bool:
+    """Return whether a chunk's metadata passes every filter."""
+    return all(
+        metadata.get(field) in allowed_values(value)
+        for field, value in filters.items()
+    )
+
+
+def shard_name(key: str) -> str:
+    """Return a name for a shard which is safe as a Chroma collection or directory name, and
+    distinct for distinct keys."""
+    readable = SHARD_NAME_PATTERN.sub("-", key).strip("-_")[:48]
+    return (
+        f"{readable or 'shard'}-{hashlib.sha1(key.encode()).hexdigest()[:8]}"
+    )
+
+
+def chroma_where(filters: Filters) -> dict:
+    """Translate filters into a Chroma `where` clause."""
+    clauses = [
+        {field: {"$in": sorted(allowed_values(value))}}
+        for field, value in filters.items()
+    ]
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def top_k(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Select the k highest scores in O(n) with `np.argpartition`, then sort just those.
+
+    Args:
+        scores (np.ndarray): A vector of scores, or a matrix with one row per query.
+        k (int): The number to select.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The indices and scores of the selection, best first, with
+            equal scores in index order.
+    """
+    k = min(k, scores.shape[-1])
+    if k <= 0:
+        empty = scores[..., :0]
+        return empty.astype(np.int64), empty
+    indices = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    selected = np.take_along_axis(scores, indices, axis=-1)
+    order = np.lexsort((indices, -selected), axis=-1)
+    indices = np.take_along_axis(indices, order, axis=-1)
+    return indices, np.take_along_axis(selected, order, axis=-1)
+
 
 class KnowledgeBase:
-    def __init__(self):
-        self.model = SentenceTransformer("all-mpnet-base-v2")
+    # The keyword matches considered by prefilter search, and the results from each ranking
+    # combined by hybrid search.
+    LEXICAL_CANDIDATES = 200
+    FUSION_DEPTH = 50
+    # The weight of the keyword ranking when fusing the results for a query citing a section.
+    # Embeddings barely distinguish section numbers, so this is high enough that every keyword
+    # match outranks the chunks found only by embedding, which only reorder close keyword ranks.
+    SECTION_LEXICAL_WEIGHT = 64
+
+    def __init__(
+        self,
+        model: "SentenceTransformer" = None,
+        model_name: str = MODEL_NAME,
+        embedding_cache: EmbeddingCache = EMBEDDING_CACHE,
+    ):
+        self._model = model
+        self.model_name = model_name
+        self.embedding_cache = embedding_cache
+        self._lexical = None
+
+    @property
+    def model(self) -> "SentenceTransformer":
+        """The embedding model, loaded on first use."""
+        if self._model is None:
+            self._model = get_embedding_model(self.model_name)
+        return self._model
 
     def save(self, path: str):
         raise NotImplementedError
@@ -15,99 +198,1171 @@ class KnowledgeBase:
     def load(self, path: str):
         raise NotImplementedError
 
-    def add(self, value: str, splitter: Callable[[str], Iterable[str]] = llm_split):
+    def add(
+        self,
+        value: str,
+        split_fn: Callable[[str], Iterable[str]] = llm_split,
+        metadata: Dict[str, str] = None,
+    ) -> Tuple[List[str], np.ndarray]:
+        """Split a value into chunks, and embed and store those which are new.
+
+        Args:
+            value (str): The text to add.
+            split_fn (Callable[[str], Iterable[str]], optional): The splitter. Defaults to llm_split.
+            metadata (Dict[str, str], optional): Metadata for every chunk, e.g. the jurisdiction.
+                Fields in a chunk's YAML header take precedence.
+
+        Returns:
+            Tuple[List[str], np.ndarray]: The ids and embeddings of the chunks added.
+        """
+        chunks = self.partition_with_metadata(value, split_fn, metadata)
+        ids_to_add = self.new_ids(list(chunks))
+        if not ids_to_add:
+            return [], np.zeros((0, 0), dtype=np.float32)
+        values_to_add = [chunks[id][0] for id in ids_to_add]
+        embeddings_to_add = self.embed(values_to_add, ids_to_add)
+        self.add_embedded(
+            values_to_add,
+            embeddings_to_add,
+            ids_to_add,
+            [chunks[id][1] for id in ids_to_add],
+        )
+        return ids_to_add, embeddings_to_add
+
+    def add_embedded(
+        self,
+        values: List[str],
+        embeddings: np.ndarray,
+        ids: List[str] = None,
+        metadatas: List[Dict[str, str]] = None,
+    ):
+        """Add chunks which have already been embedded.
+
+        Args:
+            values (List[str]): The chunks.
+            embeddings (np.ndarray): One embedding per chunk.
+            ids (List[str], optional): Their ids, if already computed.
+            metadatas (List[Dict[str, str]], optional): Metadata for each chunk.
+        """
         raise NotImplementedError
 
-    def search(self, query: str, top_n: int = 1) -> Iterable[str]:
+    def new_ids(self, ids: List[str]) -> List[str]:
+        """Return the ids which are not yet in the knowledge base, in order."""
         raise NotImplementedError
 
+    def search(
+        self,
+        query: str,
+        top_n: int = 1,
+        mode: str = DENSE,
+        filters: Filters = None,
+    ) -> Iterable[str]:
+        """Yield the chunks most similar to a query, best first."""
+        for value, _ in self.search_with_scores(
+            query, top_n=top_n, mode=mode, filters=filters
+        ):
+            yield value
+
+    def search_with_scores(
+        self,
+        query: str,
+        top_n: int = 1,
+        mode: str = DENSE,
+        filters: Filters = None,
+    ) -> List[Tuple[str, float]]:
+        """Return the chunks most similar to a query with their scores, best first."""
+        return self.search_many(
+            [query], top_n=top_n, mode=mode, filters=filters
+        )[0]
+
+    def search_many(
+        self,
+        queries: List[str],
+        top_n: int = 1,
+        mode: str = DENSE,
+        filters: Filters = None,
+    ) -> List[List[Tuple[str, float]]]:
+        """Search for several queries at once, encoding them in one batch.
 
-    def partition_and_embed(self, value: str, split_fn: Callable[[str], Iterable[str]]):
-        values_to_add = []
-        splits = split_fn(value)
-        for partitioned_value in set(splits):
-            values_to_add.append(partitioned_value)
-        embeddings_to_add = self.model.encode(values_to_add)
+        Args:
+            queries (List[str]): The queries.
+            top_n (int, optional): The number of results per query. Defaults to 1.
+            mode (str, optional): One of SEARCH_MODES. Defaults to DENSE.
+            filters (Filters, optional): Only return chunks whose metadata matches, e.g.
+                {"jurisdiction": "uk"} or {"jurisdiction": ["us-ca", "us-ny"]}.
+
+        Returns:
+            List[List[Tuple[str, float]]]: For each query, (chunk, score) pairs, best first.
+        """
+        query_embeddings = None
+        if mode != LEXICAL:
+            with span("encode", texts=len(queries)):
+                query_embeddings = self.model.encode(list(queries))
+        return [
+            [(value, score) for _, value, score in results]
+            for results in self.search_embeddings(
+                query_embeddings,
+                top_n,
+                queries=queries,
+                mode=mode,
+                filters=filters,
+            )
+        ]
+
+    def search_embeddings(
+        self,
+        query_embeddings: np.ndarray,
+        top_n: int = 1,
+        queries: List[str] = None,
+        mode: str = DENSE,
+        filters: Filters = None,
+    ) -> List[List[Tuple[str, str, float]]]:
+        """Search with queries which have already been embedded.
+
+        Args:
+            query_embeddings (np.ndarray): One embedding per query. Unused in LEXICAL mode.
+            top_n (int, optional): The number of results per query. Defaults to 1.
+            queries (List[str], optional): The query text, needed by every mode except DENSE.
+            mode (str, optional): One of SEARCH_MODES. Defaults to DENSE.
+            filters (Filters, optional): Only return chunks whose metadata matches.
+
+        Returns:
+            List[List[Tuple[str, str, float]]]: For each query, (id, chunk, score) triples, best
+                first. Scores are embedding similarities, except in LEXICAL mode, where they are
+                BM25 scores.
+        """
+        if mode not in SEARCH_MODES:
+            raise ValueError(
+                f"Unknown search mode {mode!r}, expected one of {SEARCH_MODES}"
+            )
+        with span(
+            "search",
+            knowledge_base=type(self).__name__,
+            mode=mode,
+            filtered=bool(filters),
+        ) as s:
+            if mode == DENSE:
+                results = self._dense_search(query_embeddings, top_n, filters)
+            else:
+                if queries is None:
+                    raise ValueError(f"{mode} search needs the query text")
+                mask = self._lexical_mask(filters) if filters else None
+                results = [
+                    self._lexical_search(
+                        query,
+                        (
+                            None
+                            if query_embeddings is None
+                            else query_embeddings[i]
+                        ),
+                        top_n,
+                        mode,
+                        filters,
+                        mask,
+                    )
+                    for i, query in enumerate(queries)
+                ]
+            s.set(queries=len(results), results=sum(map(len, results)))
+        return results
+
+    @property
+    def lexical_index(self) -> LexicalIndex:
+        """The BM25 index of every chunk, built on first use and then kept up to date as chunks
+        are added."""
+        if self._lexical is None:
+            self._lexical = self._build_lexical_index()
+        return self._lexical
+
+    def _lexical_search(
+        self,
+        query: str,
+        query_embedding: np.ndarray,
+        top_n: int,
+        mode: str,
+        filters: Filters = None,
+        mask: np.ndarray = None,
+    ) -> List[Tuple[str, str, float]]:
+        depth = top_n if mode == LEXICAL else self.LEXICAL_CANDIDATES
+        rows, lexical_scores = self.lexical_index.search(query, depth, mask)
+        ids = self._lexical_ids(rows)
+        if mode == LEXICAL:
+            texts, _ = self._chunks(ids, rows)
+            return list(zip(ids, texts, lexical_scores.tolist()))
+
+        weights = (
+            (self.SECTION_LEXICAL_WEIGHT, 1) if cites_section(query) else None
+        )
+        if mode == PREFILTER and len(ids) >= top_n:
+            # Only score the keyword matches, and rank them by both measures.
+            texts, scores = self._chunks(ids, rows, query_embedding)
+            best = reciprocal_rank_fusion(
+                [range(len(ids)), np.argsort(-scores, kind="stable").tolist()],
+                weights=weights,
+            )[:top_n]
+            return [(ids[i], texts[i], float(scores[i])) for i in best]
+
+        # Combine the best keyword matches with the best embedding matches, falling back to this
+        # in PREFILTER mode if too few chunks match any keyword.
+        dense = self._dense_search(
+            query_embedding[None], max(top_n, self.FUSION_DEPTH), filters
+        )[0]
+        found = {id: (text, score) for id, text, score in dense}
+        lexical_ids = ids[: max(top_n, self.FUSION_DEPTH)]
+        best = reciprocal_rank_fusion(
+            [lexical_ids, [id for id, _, _ in dense]], weights=weights
+        )[:top_n]
+        missing = [
+            (id, row) for id, row in zip(lexical_ids, rows) if id not in found
+        ]
+        if missing:
+            missing_ids, missing_rows = zip(*missing)
+            texts, scores = self._chunks(
+                list(missing_ids), np.array(missing_rows), query_embedding
+            )
+            found.update(zip(missing_ids, zip(texts, scores.tolist())))
+        return [(id, *found[id]) for id in best]
+
+    def _dense_search(
+        self,
+        query_embeddings: np.ndarray,
+        top_n: int,
+        filters: Filters = None,
+    ) -> List[List[Tuple[str, str, float]]]:
+        raise NotImplementedError
+
+    def _build_lexical_index(self) -> LexicalIndex:
+        raise NotImplementedError
+
+    def _lexical_mask(self, filters: Filters) -> np.ndarray:
+        """Return which rows of the lexical index match the filters."""
+        raise NotImplementedError
+
+    def _lexical_ids(self, rows: np.ndarray) -> List[str]:
+        """Return the ids of rows in the lexical index."""
+        raise NotImplementedError
+
+    def _chunks(
+        self,
+        ids: List[str],
+        rows: np.ndarray,
+        query_embedding: np.ndarray = None,
+    ) -> Tuple[List[str], np.ndarray]:
+        """Return the text of chunks, and their similarity to a query if one is given."""
+        raise NotImplementedError
+
+    def partition(
+        self, value: str, split_fn: Callable[[str], Iterable[str]]
+    ) -> List[str]:
+        with span("partition", splitter=split_fn.__name__) as s:
+            chunks = list(dict.fromkeys(split_fn(value)))
+            s.set(chunks=len(chunks))
+        return chunks
+
+    def partition_with_ids(
+        self, value: str, split_fn: Callable[[str], Iterable[str]]
+    ) -> Dict[str, str]:
+        """Split a value into chunks keyed by id, dropping chunks with the same id."""
+        chunks = {}
+        for v in split_fn(value):
+            chunks.setdefault(chunk_id(v), v)
+        return chunks
+
+    def partition_with_metadata(
+        self,
+        value: str,
+        split_fn: Callable[[str], Iterable[str]],
+        metadata: Dict[str, str] = None,
+    ) -> Dict[str, Tuple[str, Dict[str, str]]]:
+        """Split a value into (chunk, metadata) pairs keyed by id. See `with_metadata`."""
+        with span("partition", splitter=split_fn.__name__) as s:
+            chunks = {}
+            for v, chunk_metadata in with_metadata(split_fn(value), metadata):
+                chunks.setdefault(chunk_id(v), (v, chunk_metadata))
+            s.set(chunks=len(chunks))
+        return chunks
+
+    def embed(self, values: List[str], ids: List[str] = None) -> np.ndarray:
+        """Embed chunks, only encoding those missing from the embedding cache.
+
+        Args:
+            values (List[str]): The chunks.
+            ids (List[str], optional): Their ids, if already computed.
+
+        Returns:
+            np.ndarray: One embedding per chunk.
+        """
+        with span("embed", chunks=len(values)) as s:
+            ids = ids or [chunk_id(v) for v in values]
+            embeddings = self.embedding_cache.get_many(self.model_name, ids)
+            missing = [i for i, e in enumerate(embeddings) if e is None]
+            s.set(encoded=len(missing))
+            if missing:
+                encoded = self.model.encode([values[i] for i in missing])
+                self.embedding_cache.set_many(
+                    self.model_name, [ids[i] for i in missing], encoded
+                )
+                for i, embedding in zip(missing, encoded):
+                    embeddings[i] = embedding
+            return np.array(embeddings)
+
+    def partition_and_embed(
+        self, value: str, split_fn: Callable[[str], Iterable[str]]
+    ):
+        values_to_add = self.partition(value, split_fn)
+        embeddings_to_add = self.embed(values_to_add)
         return values_to_add, embeddings_to_add
 
+
 class NumPyKnowledgeBase(KnowledgeBase):
-    def __init__(self):
+    """A knowledge base held in a NumPy matrix.
+
+    Embeddings are stored in a preallocated buffer which doubles in capacity when full, so adding
+    chunks in small batches takes linear time overall.
+
+    With a quantizer, embeddings are stored compressed and searches score the compressed codes.
+    Full-precision embeddings are only kept if `rerank` is set, to rescore the best candidates;
+    once saved and loaded they are memory-mapped, so only the rows rescored are read into memory.
+
+    Args:
+        model (SentenceTransformer, optional): The embedding model.
+        dtype (optional): The embedding storage type, float32 or float16. Defaults to float32.
+            float16 halves the memory used, but NumPy has no fast float16 matrix product, so
+            rows are converted to float32 to be scored and searches are several times slower.
+            Use it when memory rather than latency is the constraint.
+        index (IVFIndex, optional): An approximate nearest-neighbour index to search with, instead
+            of scoring every chunk. Saved and loaded alongside the embeddings.
+        quantizer (ScalarQuantizer | ProductQuantizer, optional): Compresses the stored
+            embeddings. If it isn't trained, chunks are stored at full precision until there are
+            its `min_train_sample`, then it is trained on them all and they are compressed.
+        rerank (int, optional): With a quantizer, rescore `rerank * top_n` candidates at full
+            precision. Defaults to 0, which keeps only the compressed embeddings.
+    """
+
+    INITIAL_CAPACITY = 1_024
+    # float16 rows are converted to float32 this many at a time when scoring, into a buffer small
+    # enough to stay in the CPU cache while it is multiplied.
+    SCORE_BLOCK_SIZE = 512
+
+    def __init__(
+        self,
+        model: "SentenceTransformer" = None,
+        dtype=np.float32,
+        index: IVFIndex = None,
+        quantizer=None,
+        rerank: int = 0,
+        **kwargs,
+    ):
+        self.index = index
+        self.quantizer = quantizer
+        self.rerank = rerank
         self.data = []
-        self.embeddings = []
-        self.embeddings_array = None
-        super().__init__()
+        self.ids = []
+        # Each chunk's metadata, as JSON.
+        self.metadata = []
+        self._id_set = None
+        # For each metadata field, the rows with each value. Built on the first filtered search.
+        self._metadata_index = None
+        self.dtype = np.dtype(dtype)
+        self.size = 0
+        self._embeddings = None
+        self._codes = None
+        super().__init__(model=model, **kwargs)
+
+    @property
+    def embeddings_array(self) -> np.ndarray:
+        """A view of the stored embeddings, one row per chunk."""
+        if self._embeddings is None:
+            return None
+        return self._embeddings[: self.size]
+
+    @property
+    def codes_array(self) -> np.ndarray:
+        """A view of the compressed embeddings, if there is a quantizer."""
+        if self._codes is None:
+            return None
+        return self._codes[: self.size]
+
+    @property
+    def quantized(self) -> bool:
+        """Whether embeddings are stored compressed, which they are once the quantizer is trained."""
+        return self.quantizer is not None and self.quantizer.trained
+
+    @property
+    def keeps_embeddings(self) -> bool:
+        """Whether full-precision embeddings are stored."""
+        return not self.quantized or self.rerank > 0
+
+    @property
+    def id_set(self) -> set:
+        if self._id_set is None:
+            self._id_set = set(self.ids)
+        return self._id_set
+
+    def get_metadata(self, row: int) -> Dict[str, str]:
+        """Return a chunk's metadata."""
+        return json.loads(self.metadata[row])
 
     def save(self, path: str):
-        np.save(path, self.embeddings_array)
-        pd.DataFrame({"data": self.data}).to_csv(
-            path + ".csv.gz", index=False, compression="gzip"
-        )
+        """Save to a directory which `load` memory-maps.
+
+        Args:
+            path (str): The directory.
+        """
+        os.makedirs(path, exist_ok=True)
+        embeddings = self.embeddings_array
+        if embeddings is None:
+            embeddings = np.zeros((0, 0), dtype=self.dtype)
+        save_matrix(os.path.join(path, "embeddings.bin"), embeddings)
+        for name, values in (
+            ("texts", self.data),
+            ("ids", self.ids),
+            ("metadata", self.metadata),
+        ):
+            if not isinstance(values, TextStore):
+                store, values = values, TextStore()
+                values.extend(store)
+            values.save(os.path.join(path, name))
+        codes_path = os.path.join(path, "codes.bin")
+        quantizer_path = os.path.join(path, "quantizer.npz")
+        if self.quantized and self.codes_array is not None:
+            save_matrix(codes_path, self.codes_array)
+            self.quantizer.save(quantizer_path)
+        else:
+            for stale in (codes_path, codes_path + ".json", quantizer_path):
+                if os.path.exists(stale):
+                    os.remove(stale)
+        index_path = os.path.join(path, "index.npz")
+        if self.index is not None and self.index.trained:
+            self.index.save(index_path)
+        elif os.path.exists(index_path):
+            os.remove(index_path)
+        lexical_path = os.path.join(path, "lexical.npz")
+        if self._lexical is not None:
+            self._lexical.save(lexical_path)
+        elif os.path.exists(lexical_path):
+            os.remove(lexical_path)
 
     def load(self, path: str):
-        self.embeddings_array = np.load(path)
-        self.data = pd.read_csv(path + ".csv.gz")["data"].tolist()
+        """Load a knowledge base saved by `save`. Embeddings and texts are memory-mapped, so
+        loading is fast, processes share the page cache, and rows are read from disk as they
+        are used. Files written by earlier versions (`path` + ".csv.gz") are read into memory.
 
-    def add(self, value: str, split_fn: Callable[[str], Iterable[str]]):
-        values_to_add, embeddings_to_add = self.partition_and_embed(value, split_fn)
+        Compressed embeddings are loaded with the quantizer they were saved with. If there are
+        none but this knowledge base has a quantizer, the embeddings are compressed as they load.
 
-        self.data.extend(values_to_add)
-        self.embeddings.extend(embeddings_to_add)
-        if self.embeddings_array is None:
-            self.embeddings_array = np.array(self.embeddings)
+        Args:
+            path (str): The directory.
+        """
+        if not os.path.isdir(path):
+            return self._load_legacy(path)
+        self._embeddings = load_matrix(os.path.join(path, "embeddings.bin"))
+        self.dtype = self._embeddings.dtype
+        self.size = len(self._embeddings)
+        if not self.size:
+            # Saved empty, so the width isn't known until chunks are added.
+            self._embeddings = None
+        self._codes = None
+        codes_path = os.path.join(path, "codes.bin")
+        if os.path.exists(codes_path):
+            self._codes = load_matrix(codes_path)
+            self.quantizer = load_quantizer(
+                os.path.join(path, "quantizer.npz")
+            )
+            self.size = len(self._codes)
+            if not self.rerank or len(self._embeddings) != self.size:
+                # Saved without full-precision embeddings, or they aren't needed.
+                self._embeddings = None
+                self.rerank = 0
+        elif self.quantizer is not None:
+            self._quantize_embeddings()
+        self.data = TextStore.load(os.path.join(path, "texts"))
+        self.ids = TextStore.load(os.path.join(path, "ids"))
+        metadata_path = os.path.join(path, "metadata")
+        if os.path.exists(metadata_path + ".offsets.npy"):
+            self.metadata = TextStore.load(metadata_path)
         else:
-            self.embeddings_array = np.vstack(
-                (self.embeddings_array, np.array(embeddings_to_add))
+            self.metadata = ["{}"] * self.size
+        self._id_set = None
+        self._metadata_index = None
+        self._lexical = None
+        lexical_path = os.path.join(path, "lexical.npz")
+        if os.path.exists(lexical_path):
+            self._lexical = LexicalIndex()
+            self._lexical.load(lexical_path)
+        index_path = os.path.join(path, "index.npz")
+        if os.path.exists(index_path):
+            self.index = self.index or IVFIndex()
+            self.index.load(index_path)
+        elif self.index is not None:
+            self._rebuild_index()
+
+    def _load_legacy(self, path: str):
+        self._embeddings = np.load(path).astype(self.dtype, copy=False)
+        self.size = len(self._embeddings)
+        import pandas as pd
+
+        self.data = pd.read_csv(path + ".csv.gz")["data"].tolist()
+        self.ids = [chunk_id(v) for v in self.data]
+        self._codes = None
+        if self.quantizer is not None:
+            self._quantize_embeddings()
+        self.metadata = ["{}"] * self.size
+        self._id_set = None
+        self._metadata_index = None
+        self._lexical = None
+        if self.index is not None:
+            self._rebuild_index()
+
+    def _quantize_embeddings(self):
+        """Compress the stored embeddings, keeping them only if they are needed to rerank. An
+        untrained quantizer is trained on them first, if there are enough."""
+        embeddings = self.embeddings_array
+        if not self.quantizer.trained:
+            if self.size < self.quantizer.min_train_sample:
+                return
+            self.quantizer.train(embeddings)
+        if self.size:
+            self._codes = np.concatenate(
+                [
+                    self.quantizer.encode(
+                        embeddings[start : start + ENCODE_BLOCK_SIZE]
+                    )
+                    for start in range(0, self.size, ENCODE_BLOCK_SIZE)
+                ]
+            )
+        if not self.rerank:
+            self._embeddings = None
+
+    def _all_embeddings(self):
+        """Every row's embedding, decoded from the codes if full precision isn't kept."""
+        if self._embeddings is not None or self._codes is None:
+            return self.embeddings_array
+        return DecodedRows(self.quantizer, self.codes_array)
+
+    def _rebuild_index(self):
+        self.index.centroids = None
+        if self.size:
+            embeddings = self._all_embeddings()
+            self.index.add(embeddings, embeddings)
+
+    def new_ids(self, ids: List[str]) -> List[str]:
+        return [id for id in ids if id not in self.id_set]
+
+    def add_embedded(
+        self,
+        values: List[str],
+        embeddings: np.ndarray,
+        ids: List[str] = None,
+        metadatas: List[Dict[str, str]] = None,
+    ):
+        if not len(values):
+            return
+        ids = ids or [chunk_id(v) for v in values]
+        metadatas = metadatas or [{}] * len(values)
+        start = self.size
+        self._reserve(self.size + len(values), np.shape(embeddings)[-1])
+        if self.keeps_embeddings:
+            self._embeddings[start : start + len(values)] = embeddings
+        if self.quantized:
+            self._codes[start : start + len(values)] = self.quantizer.encode(
+                embeddings
+            )
+        self.size += len(values)
+        if self.quantizer is not None and not self.quantizer.trained:
+            self._quantize_embeddings()
+        if self.index is not None:
+            self.index.add(
+                np.asarray(embeddings, np.float32), self._all_embeddings()
+            )
+        self.data.extend(values)
+        self.ids.extend(ids)
+        self.id_set.update(ids)
+        self.metadata.extend(
+            json.dumps(metadata, sort_keys=True) for metadata in metadatas
+        )
+        if self._metadata_index is not None:
+            self._index_metadata(metadatas, start)
+        if self._lexical is not None:
+            self._lexical.add(values)
+
+    def _index_metadata(self, metadatas: Iterable[Dict[str, str]], start: int):
+        for row, metadata in enumerate(metadatas, start):
+            for field, value in metadata.items():
+                self._metadata_index.setdefault(field, {}).setdefault(
+                    value, []
+                ).append(row)
+
+    def _filter_rows(self, filters: Filters) -> np.ndarray:
+        """Return the rows whose metadata matches the filters, in order."""
+        if self._metadata_index is None:
+            self._metadata_index = {}
+            self._index_metadata(map(json.loads, self.metadata), 0)
+        rows = None
+        for field, value in filters.items():
+            values = self._metadata_index.get(field, {})
+            field_rows = np.unique(
+                np.array(
+                    [
+                        row
+                        for v in allowed_values(value)
+                        for row in values.get(v, ())
+                    ],
+                    dtype=np.int64,
+                )
+            )
+            rows = (
+                field_rows
+                if rows is None
+                else np.intersect1d(rows, field_rows)
+            )
+        return np.arange(self.size) if rows is None else rows
+
+    def _reserve(self, rows: int, dim: int):
+        if self.keeps_embeddings:
+            self._embeddings = self._grow(
+                self._embeddings, rows, dim, self.dtype
+            )
+        if self.quantized:
+            self._codes = self._grow(
+                self._codes, rows, self.quantizer.code_size(dim), np.uint8
+            )
+
+    def _grow(
+        self, buffer: np.ndarray, rows: int, width: int, dtype
+    ) -> np.ndarray:
+        if buffer is None or not len(buffer):
+            capacity = max(rows, self.INITIAL_CAPACITY)
+            return np.empty((capacity, width), dtype=dtype)
+        if rows > len(buffer):
+            capacity = max(rows, 2 * len(buffer))
+            grown = np.empty((capacity, width), dtype=dtype)
+            grown[: self.size] = buffer[: self.size]
+            return grown
+        return buffer
+
+    def _scores(self, query_embeddings: np.ndarray) -> np.ndarray:
+        """Dot-product scores of one query (or a matrix of queries) against every chunk."""
+        query_embeddings = np.asarray(query_embeddings, dtype=np.float32)
+        if self.quantized:
+            scores = self.quantizer.score(
+                self.codes_array, np.atleast_2d(query_embeddings)
+            )
+            return scores if query_embeddings.ndim > 1 else scores[0]
+        embeddings = self.embeddings_array
+        if embeddings is None:
+            return np.zeros(query_embeddings.shape[:-1] + (0,), np.float32)
+        if embeddings.dtype == np.float32:
+            return query_embeddings @ embeddings.T
+        queries = np.atleast_2d(query_embeddings)
+        scores = np.empty((len(queries), self.size), dtype=np.float32)
+        block = np.empty(
+            (min(self.SCORE_BLOCK_SIZE, self.size), embeddings.shape[1]),
+            dtype=np.float32,
+        )
+        for start in range(0, self.size, self.SCORE_BLOCK_SIZE):
+            rows = embeddings[start : start + self.SCORE_BLOCK_SIZE]
+            np.copyto(block[: len(rows)], rows)
+            np.matmul(
+                queries,
+                block[: len(rows)].T,
+                out=scores[:, start : start + len(rows)],
             )
+        return scores if query_embeddings.ndim > 1 else scores[0]
+
+    def _row_scores(
+        self,
+        query_embedding: np.ndarray,
+        rows: np.ndarray,
+        exact: bool = False,
+    ) -> np.ndarray:
+        """Scores of one query against some rows, from the compressed embeddings if there are
+        any, unless `exact` and full-precision embeddings are kept."""
+        if self.quantized and not (exact and self.rerank):
+            return self.quantizer.score(
+                self.codes_array[rows], query_embedding[None]
+            )[0]
+        return self.embeddings_array[rows].astype(np.float32) @ query_embedding
+
+    def _top(
+        self,
+        query_embedding: np.ndarray,
+        scores: np.ndarray,
+        top_n: int,
+        rows: np.ndarray = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Select the best rows by score, rescoring extra candidates at full precision if
+        `rerank` is set.
+
+        Args:
+            query_embedding (np.ndarray): The query.
+            scores (np.ndarray): The scores of `rows`.
+            top_n (int): The number to select.
+            rows (np.ndarray, optional): The rows scored. Defaults to every row.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The rows and scores selected, best first.
+        """
+        rerank = self.quantized and self.rerank
+        best, best_scores = top_k(
+            scores, top_n * self.rerank if rerank else top_n
+        )
+        best = best if rows is None else rows[best]
+        if not rerank:
+            return best, best_scores
+        # Read the rows in order, as they may be memory-mapped.
+        best = np.sort(best)
+        selected, best_scores = top_k(
+            self._row_scores(query_embedding, best, exact=True), top_n
+        )
+        return best[selected], best_scores
+
+    def _search_index(self, query_embeddings: np.ndarray, top_n: int):
+        indices, scores = [], []
+        for query_embedding in np.asarray(query_embeddings, np.float32):
+            rows = self.index.candidates(query_embedding)
+            best, best_scores = self._top(
+                query_embedding,
+                self._row_scores(query_embedding, rows),
+                top_n,
+                rows,
+            )
+            indices.append(best)
+            scores.append(best_scores)
+        return indices, scores
+
+    def _dense_search(
+        self,
+        query_embeddings: np.ndarray,
+        top_n: int,
+        filters: Filters = None,
+    ) -> List[List[Tuple[str, str, float]]]:
+        query_embeddings = np.asarray(query_embeddings, np.float32)
+        if filters:
+            # Score only the matching rows, which are usually far fewer than all of them.
+            rows = self._filter_rows(filters)
+            results = [
+                self._top(q, self._row_scores(q, rows), top_n, rows)
+                for q in query_embeddings
+            ]
+        elif self.index is not None and self.index.trained:
+            results = zip(*self._search_index(query_embeddings, top_n))
+        elif self.quantized and self.rerank:
+            results = [
+                self._top(q, row_scores, top_n)
+                for q, row_scores in zip(
+                    query_embeddings, self._scores(query_embeddings)
+                )
+            ]
+        else:
+            results = zip(*top_k(self._scores(query_embeddings), top_n))
+        return [
+            [
+                (self.ids[i], self.data[i], float(score))
+                for i, score in zip(row, row_scores)
+            ]
+            for row, row_scores in results
+        ]
+
+    def _build_lexical_index(self) -> LexicalIndex:
+        lexical = LexicalIndex()
+        lexical.add(self.data)
+        return lexical
+
+    def _lexical_mask(self, filters: Filters) -> np.ndarray:
+        mask = np.zeros(self.size, dtype=bool)
+        mask[self._filter_rows(filters)] = True
+        return mask
+
+    def _lexical_ids(self, rows: np.ndarray) -> List[str]:
+        return [self.ids[i] for i in rows]
+
+    def _chunks(
+        self,
+        ids: List[str],
+        rows: np.ndarray,
+        query_embedding: np.ndarray = None,
+    ) -> Tuple[List[str], np.ndarray]:
+        texts = [self.data[i] for i in rows]
+        if query_embedding is None:
+            return texts, None
+        return texts, self._row_scores(
+            np.asarray(query_embedding, np.float32), rows, exact=True
+        )
 
-    def search(self, query: str, top_n: int = 1) -> Iterable[str]:
-        query_embedding = self.model.encode(query)
-        similarity = util.dot_score(query_embedding, self.embeddings_array)[0]
-        top_n_idx = np.argsort(similarity)[-top_n:]
-        for idx in top_n_idx:
-            yield self.data[idx]
 
 class ChromaKnowledgeBase(KnowledgeBase):
-    def __init__(self):
-        self.client = chroma_client = chromadb.Client()
-        self.collection = chroma_client.create_collection(name="tmp")
-        super().__init__()
+    def __init__(
+        self,
+        model: "SentenceTransformer" = None,
+        name: str = "tmp",
+        batch_size: int = 1_000,
+        metadata: Dict[str, str] = None,
+        **kwargs,
+    ):
+        self.name = name
+        # Recorded on the collection when it is created.
+        self.metadata = metadata
+        self._collection = None
+        self._lexical_row_ids = []
+        self._lexical_row_metadata = []
+        self.batch_size = batch_size
+        super().__init__(model=model, **kwargs)
+
+    @property
+    def client(self):
+        return get_chroma_client()
+
+    @property
+    def collection(self):
+        """The Chroma collection, connected to on first use."""
+        if self._collection is None:
+            collection = self.client.get_or_create_collection(
+                name=self.name, metadata=self.metadata
+            )
+            # Collections created without the metadata (or before it was recorded) gain it.
+            existing = collection.metadata or {}
+            if self.metadata and any(
+                existing.get(k) != v for k, v in self.metadata.items()
+            ):
+                collection.modify(metadata={**existing, **self.metadata})
+            self._collection = collection
+        return self._collection
+
+    @collection.setter
+    def collection(self, collection):
+        self._collection = collection
+        self._lexical = None
+
+    def save(self, name: str):
+        """Rename the collection. Chroma writes each change as it is made, to disk with a
+        persistent client (see `get_chroma_client`), so there is nothing else to save.
 
-    def save(self, name:str):
-        self.collection.modify(name=name)
-        self.collection.persist()
+        Args:
+            name (str): The collection name.
+        """
+        if name != self.collection.name:
+            self.collection.modify(name=name)
+        self.name = name
 
-    def load(self, name:str):
+    def load(self, name: str):
         self.collection = self.client.get_collection(name=name)
 
-    def add(self, value: str, split_fn: Callable[[str], Iterable[str]]):
-        values_all, embeddings_all = self.partition_and_embed(value, split_fn=split_fn)
-
-        values_to_add = []
-        embeddings_to_add = [] 
-        ids = []
-        for v, e in zip(values_all, embeddings_all):
-            id = str(hash(v))
-
-            existing_ids = self.collection.get(ids=[id])["ids"]
-            if existing_ids:
-                continue
-            
-            values_to_add.append(v)
-            embeddings_to_add.append(e)
-            ids.append(id)
-
-        self.collection.add(
-            embeddings=embeddings_to_add,
-            documents=values_to_add,
-            ids=ids
+    def new_ids(self, ids: List[str]) -> List[str]:
+        # Look up the chunks in batches rather than one at a time.
+        existing_ids = set()
+        for start in range(0, len(ids), self.batch_size):
+            existing_ids.update(
+                self.collection.get(
+                    ids=ids[start : start + self.batch_size], include=[]
+                )["ids"]
+            )
+        return [id for id in ids if id not in existing_ids]
+
+    def add_embedded(
+        self,
+        values: List[str],
+        embeddings: np.ndarray,
+        ids: List[str] = None,
+        metadatas: List[Dict[str, str]] = None,
+    ):
+        ids = ids or [chunk_id(v) for v in values]
+        # Chroma rejects empty metadata, but accepts None.
+        metadatas = [m or None for m in metadatas or [None] * len(ids)]
+        embeddings = np.asarray(embeddings).tolist()
+        for start in range(0, len(ids), self.batch_size):
+            end = start + self.batch_size
+            self.collection.add(
+                embeddings=embeddings[start:end],
+                documents=values[start:end],
+                ids=ids[start:end],
+                metadatas=metadatas[start:end],
+            )
+        if self._lexical is not None:
+            self._lexical.add(values)
+            self._lexical_row_ids.extend(ids)
+            self._lexical_row_metadata.extend(m or {} for m in metadatas)
+
+    def _dense_search(
+        self,
+        query_embeddings: np.ndarray,
+        top_n: int,
+        filters: Filters = None,
+    ) -> List[List[Tuple[str, str, float]]]:
+        results = self.collection.query(
+            query_embeddings=np.asarray(query_embeddings).tolist(),
+            n_results=top_n,
+            where=chroma_where(filters) if filters else None,
+            include=["documents", "distances"],
         )
+        # Chroma returns squared L2 distances, which for normalised embeddings are 2 - 2 * cosine.
+        return [
+            [
+                (id, document, 1 - distance / 2)
+                for id, document, distance in zip(ids, documents, distances)
+            ]
+            for ids, documents, distances in zip(
+                results["ids"], results["documents"], results["distances"]
+            )
+        ]
+
+    def _build_lexical_index(self) -> LexicalIndex:
+        lexical = LexicalIndex()
+        self._lexical_row_ids = []
+        self._lexical_row_metadata = []
+        offset = 0
+        while True:
+            page = self.collection.get(
+                include=["documents", "metadatas"],
+                limit=self.batch_size,
+                offset=offset,
+            )
+            if not page["ids"]:
+                return lexical
+            lexical.add(page["documents"])
+            self._lexical_row_ids.extend(page["ids"])
+            self._lexical_row_metadata.extend(
+                m or {} for m in page["metadatas"]
+            )
+            offset += len(page["ids"])
+
+    def _lexical_mask(self, filters: Filters) -> np.ndarray:
+        self.lexical_index
+        return np.array(
+            [matches(m, filters) for m in self._lexical_row_metadata],
+            dtype=bool,
+        )
+
+    def _lexical_ids(self, rows: np.ndarray) -> List[str]:
+        return [self._lexical_row_ids[i] for i in rows]
+
+    def _chunks(
+        self,
+        ids: List[str],
+        rows: np.ndarray,
+        query_embedding: np.ndarray = None,
+    ) -> Tuple[List[str], np.ndarray]:
+        if not ids:
+            return [], np.zeros(0, dtype=np.float32)
+        include = ["documents"]
+        if query_embedding is not None:
+            include.append("embeddings")
+        found = self.collection.get(ids=list(ids), include=include)
+        positions = {id: i for i, id in enumerate(found["ids"])}
+        order = [positions[id] for id in ids]
+        texts = [found["documents"][i] for i in order]
+        if query_embedding is None:
+            return texts, None
+        embeddings = np.asarray(found["embeddings"], dtype=np.float32)[order]
+        return texts, embeddings @ np.asarray(query_embedding, np.float32)
+
+
+def chroma_shard_factory(
+    prefix: str, **kwargs
+) -> Callable[[str], ChromaKnowledgeBase]:
+    """Return a `ShardedKnowledgeBase` factory which stores each shard in a Chroma collection
+    named "<prefix>-<shard_name(key)>", recording the key so `chroma_shard_keys` can find it.
+
+    Args:
+        prefix (str): The collection name prefix.
+        **kwargs: Passed to ChromaKnowledgeBase.
+
+    Returns:
+        Callable[[str], ChromaKnowledgeBase]: The factory.
+    """
+    return lambda key: ChromaKnowledgeBase(
+        name=f"{prefix}-{shard_name(key)}",
+        metadata={SHARD_KEY_FIELD: key},
+        **kwargs,
+    )
+
+
+def chroma_shard_keys(prefix: str) -> List[str]:
+    """Return the keys of the shards stored in Chroma by `chroma_shard_factory(prefix)`, such as
+    collections persisted by an earlier process or built by the ingest CLI.
 
-    
-    def search(self, query: str, top_n: int = 1) -> Iterable[str]:
-        query_embedding = self.model.encode(query) 
-        return self.collection.query(
-            query_embeddings=[query_embedding],
-            n_results=top_n
-        )['documents'][0]
+    Args:
+        prefix (str): The collection name prefix.
 
-        
+    Returns:
+        List[str]: The keys.
+    """
+    keys = []
+    for collection in get_chroma_client().list_collections():
+        key = (collection.metadata or {}).get(SHARD_KEY_FIELD)
+        if (
+            key is not None
+            and collection.name == f"{prefix}-{shard_name(key)}"
+        ):
+            keys.append(key)
+    return sorted(keys)
+
+
+class ShardedKnowledgeBase(KnowledgeBase):
+    """A knowledge base split into shards by a metadata field, such as the jurisdiction. Each
+    shard is a separate knowledge base with its own (smaller) index, and a search filtered on the
+    field only scans the shards it names.
+
+    Args:
+        factory (Callable[[str], KnowledgeBase]): Creates the shard for a key, e.g.
+            `chroma_shard_factory("knowledge")`.
+        shard_by (str, optional): The metadata field. Defaults to "jurisdiction".
+        default_shard (str, optional): The shard for chunks without the field. Defaults to
+            "default".
+        discover (Callable[[], Iterable[str]], optional): Returns the keys of shards which
+            already exist, e.g. `lambda: chroma_shard_keys("knowledge")`. Called before the
+            first search or id lookup.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[str], KnowledgeBase],
+        shard_by: str = "jurisdiction",
+        default_shard: str = "default",
+        discover: Callable[[], Iterable[str]] = None,
+        **kwargs,
+    ):
+        self.factory = factory
+        self.shard_by = shard_by
+        self.default_shard = default_shard
+        self.shards: Dict[str, KnowledgeBase] = {}
+        self._discover = discover
+        self._discover_lock = threading.Lock()
+        super().__init__(**kwargs)
+
+    def discover_shards(self):
+        """Open the shards which already exist, once."""
+        if self._discover is None:
+            return
+        with self._discover_lock:
+            if self._discover is None:
+                return
+            for key in self._discover():
+                self.shard(key)
+            self._discover = None
+
+    def shard(self, key: str) -> KnowledgeBase:
+        """Return the shard for a key, creating it if needed."""
+        if key not in self.shards:
+            self.shards[key] = self.factory(key)
+        return self.shards[key]
+
+    def shard_key(self, metadata: Dict[str, str]) -> str:
+        """Return the key of the shard a chunk belongs in."""
+        return (metadata or {}).get(self.shard_by) or self.default_shard
+
+    def save(self, path: str):
+        """Save each shard to a subdirectory, and record their keys in "shards.json". Chroma
+        shards are skipped, since Chroma stores changes as they are made, and they are found
+        again with `discover`.
+
+        Args:
+            path (str): The directory.
+        """
+        os.makedirs(path, exist_ok=True)
+        directories = {
+            key: shard_name(key)
+            for key, shard in self.shards.items()
+            if not isinstance(shard, ChromaKnowledgeBase)
+        }
+        for key, directory in directories.items():
+            self.shards[key].save(os.path.join(path, directory))
+        with atomic_write(os.path.join(path, "shards.json")) as f:
+            f.write(
+                json.dumps(
+                    dict(shard_by=self.shard_by, shards=directories)
+                ).encode()
+            )
+
+    def load(self, path: str):
+        """Load shards saved by `save`, creating each with the factory.
+
+        Args:
+            path (str): The directory.
+        """
+        with open(os.path.join(path, "shards.json")) as f:
+            saved = json.load(f)
+        self.shard_by = saved["shard_by"]
+        self.shards = {}
+        for key, directory in saved["shards"].items():
+            self.shard(key).load(os.path.join(path, directory))
+
+    def new_ids(self, ids: List[str]) -> List[str]:
+        self.discover_shards()
+        for shard in self.shards.values():
+            if not ids:
+                break
+            ids = shard.new_ids(ids)
+        return ids
+
+    def add_embedded(
+        self,
+        values: List[str],
+        embeddings: np.ndarray,
+        ids: List[str] = None,
+        metadatas: List[Dict[str, str]] = None,
+    ):
+        ids = ids or [chunk_id(v) for v in values]
+        metadatas = metadatas or [{}] * len(values)
+        embeddings = np.asarray(embeddings)
+        rows_by_shard = defaultdict(list)
+        for row, metadata in enumerate(metadatas):
+            rows_by_shard[self.shard_key(metadata)].append(row)
+        for key, rows in rows_by_shard.items():
+            self.shard(key).add_embedded(
+                [values[i] for i in rows],
+                embeddings[rows],
+                [ids[i] for i in rows],
+                [metadatas[i] for i in rows],
+            )
+
+    def search_embeddings(
+        self,
+        query_embeddings: np.ndarray,
+        top_n: int = 1,
+        queries: List[str] = None,
+        mode: str = DENSE,
+        filters: Filters = None,
+    ) -> List[List[Tuple[str, str, float]]]:
+        if mode not in SEARCH_MODES:
+            raise ValueError(
+                f"Unknown search mode {mode!r}, expected one of {SEARCH_MODES}"
+            )
+        self.discover_shards()
+        filters = dict(filters or {})
+        if self.shard_by in filters:
+            keys = sorted(allowed_values(filters.pop(self.shard_by)))
+        else:
+            keys = list(self.shards)
+        # Each shard's search is traced too, as a "search" span.
+        with span("sharded_search", mode=mode) as s:
+            shard_results = [
+                self.shards[key].search_embeddings(
+                    query_embeddings, top_n, queries, mode, filters or None
+                )
+                for key in keys
+                if key in self.shards
+            ]
+            n_queries = len(
+                queries if query_embeddings is None else query_embeddings
+            )
+            results = []
+            for i in range(n_queries):
+                rankings = [shard[i] for shard in shard_results]
+                if mode == DENSE:
+                    results.append(
+                        sorted(
+                            chain(*rankings), key=lambda r: r[2], reverse=True
+                        )[:top_n]
+                    )
+                else:
+                    # BM25 and fused scores depend on each shard's statistics, so merge by rank.
+                    found = {
+                        id: (id, text, score)
+                        for id, text, score in chain(*rankings)
+                    }
+                    best = reciprocal_rank_fusion(
+                        [[id for id, _, _ in ranking] for ranking in rankings]
+                    )[:top_n]
+                    results.append([found[id] for id in best])
+            s.set(shards=len(shard_results), queries=len(results))
+        return results
@@ -0,0 +1,252 @@
+from collections import Counter, defaultdict
+from typing import Dict, Hashable, Iterable, List, Sequence, Tuple
+import re
+
+import numpy as np
+
+# Section references ("§ 32(b)(1)") are kept whole, and everything else is split into words.
+TOKEN_PATTERN = re.compile(r"§\s*\d+[\w.-]*(?:\([^()\s]{1,8}\))*|\w+")
+WORD_PATTERN = re.compile(r"\w+")
+SUBSECTION_PATTERN = re.compile(r"(?=\()")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the their this to was "
+    "were which with".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase search terms.
+
+    A section reference like "§ 32(b)(1)" becomes "§32", "§32(b)" and "§32(b)(1)", so a query
+    for a section also matches its subsections, as well as the words "32", "b" and "1", which
+    match headers the splitter has separated from their "§".
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        List[str]: The terms, in order, with common English words removed.
+    """
+    terms = []
+    for match in TOKEN_PATTERN.finditer(text.lower()):
+        term = match.group()
+        if term.startswith("§"):
+            reference = "".join(term.split())
+            prefix = ""
+            for part in SUBSECTION_PATTERN.split(reference):
+                prefix += part
+                terms.append(prefix)
+            terms.extend(WORD_PATTERN.findall(reference))
+        elif term not in STOPWORDS:
+            terms.append(term)
+    return terms
+
+
+def cites_section(text: str) -> bool:
+    """Whether text contains a section reference, like "§ 32(b)(1)"."""
+    return any(
+        match.group().startswith("§") for match in TOKEN_PATTERN.finditer(text)
+    )
+
+
+def reciprocal_rank_fusion(
+    rankings: Iterable[Sequence[Hashable]],
+    k: int = 60,
+    weights: Sequence[float] = None,
+) -> List[Hashable]:
+    """Combine rankings by summing weight / (k + rank) for each item across them.
+
+    Args:
+        rankings (Iterable[Sequence[Hashable]]): The rankings, best first.
+        k (int, optional): Damps the weight of the top ranks. Defaults to 60.
+        weights (Sequence[float], optional): The weight of each ranking. Defaults to 1 each.
+
+    Returns:
+        List[Hashable]: Every item, best first.
+    """
+    scores = defaultdict(float)
+    for i, ranking in enumerate(rankings):
+        weight = 1.0 if weights is None else weights[i]
+        for rank, item in enumerate(ranking):
+            scores[item] += weight / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class LexicalIndex:
+    """An inverted index for BM25 keyword search. Rows are numbered in the order they are added,
+    and can be added at any time.
+
+    Args:
+        k1 (float, optional): The BM25 term frequency saturation. Defaults to 1.2.
+        b (float, optional): The BM25 length normalisation. Defaults to 0.75.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.vocabulary: Dict[str, int] = {}
+        # For each term, arrays of the rows it appears in and how often, appended to by `add`.
+        self.rows: List[List[np.ndarray]] = []
+        self.frequencies: List[List[np.ndarray]] = []
+        self._lengths: List[np.ndarray] = []
+        self.total_length = 0
+        # The BM25 weight of each posting, which changes whenever rows are added.
+        self._weights: Dict[int, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    @property
+    def lengths(self) -> np.ndarray:
+        """The number of terms in each row."""
+        if len(self._lengths) != 1:
+            self._lengths[:] = [
+                np.concatenate(self._lengths or [np.zeros(0, np.int32)])
+            ]
+        return self._lengths[0]
+
+    def add(self, texts: Iterable[str]):
+        """Index texts as the next rows."""
+        start = len(self)
+        rows, frequencies = defaultdict(list), defaultdict(list)
+        lengths = []
+        for row, text in enumerate(texts, start):
+            counts = Counter(tokenize(text))
+            lengths.append(sum(counts.values()))
+            for term, frequency in counts.items():
+                term_id = self.vocabulary.get(term)
+                if term_id is None:
+                    term_id = self.vocabulary[term] = len(self.vocabulary)
+                    self.rows.append([])
+                    self.frequencies.append([])
+                rows[term_id].append(row)
+                frequencies[term_id].append(frequency)
+        for term_id, term_rows in rows.items():
+            self.rows[term_id].append(np.array(term_rows, dtype=np.int32))
+            self.frequencies[term_id].append(
+                np.array(frequencies[term_id], dtype=np.float32)
+            )
+        self._lengths.append(np.array(lengths, dtype=np.int32))
+        self.total_length += sum(lengths)
+        self._weights.clear()
+
+    def search(
+        self, query: str, top_n: int = 10, mask: np.ndarray = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the rows with the highest BM25 scores for a query.
+
+        Args:
+            query (str): The query.
+            top_n (int, optional): The number of rows. Defaults to 10.
+            mask (np.ndarray, optional): Which rows may be returned, as a boolean per row.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The rows and their scores, best first. Only rows
+                containing a query term are returned, so there may be fewer than `top_n`.
+        """
+        term_ids = {
+            self.vocabulary[term]
+            for term in tokenize(query)
+            if term in self.vocabulary
+        }
+        if not term_ids or top_n <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        postings = [
+            (self._posting(term_id)[0], self._weight(term_id))
+            for term_id in term_ids
+        ]
+        n_postings = sum(len(rows) for rows, _ in postings)
+        if len(postings) == 1:
+            rows, scores = postings[0]
+        elif 8 * n_postings < len(self):
+            # Few matches: sum the scores of each matching row.
+            rows, inverse = np.unique(
+                np.concatenate([rows for rows, _ in postings]),
+                return_inverse=True,
+            )
+            scores = np.bincount(
+                inverse, weights=np.concatenate([w for _, w in postings])
+            )
+        else:
+            # Many matches: sum into a score per row, which avoids sorting the postings.
+            scores = np.zeros(len(self))
+            for term_rows, weights in postings:
+                scores[term_rows] += weights
+            rows = np.flatnonzero(scores)
+            scores = scores[rows]
+        if mask is not None:
+            keep = mask[rows]
+            rows, scores = rows[keep], scores[keep]
+        if top_n < len(rows):
+            selected = np.argpartition(-scores, top_n - 1)[:top_n]
+        else:
+            selected = np.arange(len(rows))
+        selected = selected[np.argsort(-scores[selected], kind="stable")]
+        return rows[selected].astype(np.int64), scores[selected]
+
+    def save(self, path: str):
+        terms = list(self.vocabulary)
+        postings = [self._posting(i) for i in range(len(terms))]
+        np.savez(
+            path,
+            terms=np.frombuffer("\n".join(terms).encode(), dtype=np.uint8),
+            counts=np.array([len(rows) for rows, _ in postings], np.int64),
+            rows=np.concatenate(
+                [rows for rows, _ in postings] or [np.zeros(0, np.int32)]
+            ),
+            frequencies=np.concatenate(
+                [f for _, f in postings] or [np.zeros(0, np.float32)]
+            ),
+            lengths=self.lengths,
+            parameters=np.array([self.k1, self.b]),
+        )
+
+    def load(self, path: str):
+        with np.load(path) as saved:
+            text = saved["terms"].tobytes().decode()
+            terms = text.split("\n") if text else []
+            self.vocabulary = {term: i for i, term in enumerate(terms)}
+            splits = np.cumsum(saved["counts"])[:-1]
+            self.rows = [[rows] for rows in np.split(saved["rows"], splits)][
+                : len(terms)
+            ]
+            self.frequencies = [
+                [frequencies]
+                for frequencies in np.split(saved["frequencies"], splits)
+            ][: len(terms)]
+            self._lengths = [saved["lengths"]]
+            self.total_length = int(self._lengths[0].sum())
+            self._weights.clear()
+            self.k1, self.b = saved["parameters"].tolist()
+
+    def _weight(self, term_id: int) -> np.ndarray:
+        """The BM25 score of each row containing a term, for a query of just that term."""
+        weights = self._weights.get(term_id)
+        if weights is None:
+            rows, frequencies = self._posting(term_id)
+            n_rows = len(self)
+            lengths = self.lengths[rows]
+            idf = np.log(1 + (n_rows - len(rows) + 0.5) / (len(rows) + 0.5))
+            weights = (
+                idf
+                * frequencies
+                * (self.k1 + 1)
+                / (
+                    frequencies
+                    + self.k1
+                    * (
+                        1
+                        - self.b
+                        + self.b * lengths * n_rows / self.total_length
+                    )
+                )
+            ).astype(np.float32)
+            self._weights[term_id] = weights
+        return weights
+
+    def _posting(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        rows, frequencies = self.rows[term_id], self.frequencies[term_id]
+        if len(rows) > 1:
+            rows[:] = [np.concatenate(rows)]
+            frequencies[:] = [np.concatenate(frequencies)]
+        return rows[0], frequencies[0]
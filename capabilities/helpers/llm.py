@@ -1,9 +1,360 @@
-from typing import Iterable
+from typing import AsyncIterator, Dict, Iterable, List, Optional
 
+import asyncio
+import hashlib
+import json
 import os
-import openai
+import random
+import re
+import time
+from capabilities.helpers.cache import ResponseCache
+from capabilities.helpers.concurrency import StreamCoalescer, iterate_in_thread
+from capabilities.helpers.tracing import (
+    span,
+    traced_astream,
+    traced_stream,
+    tracing_enabled,
+)
 
-openai.api_key = os.environ["OPENAI_API_KEY"]
+BACKEND_ENV_VAR = "POLICYENGINE_AI_LLM_BACKEND"
+RECORDING_ENV_VAR = "POLICYENGINE_AI_LLM_RECORDING"
+CACHE_PATH_ENV_VAR = "POLICYENGINE_AI_CACHE_PATH"
+CACHE_ENTRIES_ENV_VAR = "POLICYENGINE_AI_CACHE_ENTRIES"
+# `accumulate` yields the combined text once it has grown by this fraction since the last update.
+ACCUMULATE_GROWTH = 0.25
+
+
+class LLMBackend:
+    """A source of chat completions. Subclasses implement `stream`, yielding text deltas, and
+    may implement `astream` natively; by default it runs `stream` in worker threads.
+    """
+
+    def complete(self, prompt: str, model: str) -> str:
+        """Return the full response to a prompt.
+
+        Args:
+            prompt (str): The prompt to send.
+            model (str): The model to use.
+
+        Returns:
+            str: The response.
+        """
+        return "".join(self.stream(prompt, model))
+
+    def stream(self, prompt: str, model: str) -> Iterable[str]:
+        """Yield the response to a prompt as a stream of text deltas.
+
+        Args:
+            prompt (str): The prompt to send.
+            model (str): The model to use.
+
+        Returns:
+            Iterable[str]: The new text in each update.
+        """
+        raise NotImplementedError
+
+    async def acomplete(self, prompt: str, model: str) -> str:
+        """Async version of `complete`."""
+        return "".join([delta async for delta in self.astream(prompt, model)])
+
+    async def astream(self, prompt: str, model: str) -> AsyncIterator[str]:
+        """Async version of `stream`."""
+        async for delta in iterate_in_thread(
+            lambda: self.stream(prompt, model)
+        ):
+            yield delta
+
+    async def aclose(self):
+        """Release any connections held for async requests."""
+
+
+class OpenAIBackend(LLMBackend):
+    """Chat completions from the OpenAI API. The API key is only read when the first request is made.
+
+    Async requests share a pool of keep-alive connections per event loop, so concurrent requests
+    don't each pay for a TLS handshake.
+
+    Args:
+        api_key (str, optional): The API key. Defaults to the OPENAI_API_KEY environment variable.
+        max_connections (int, optional): The size of the async connection pool, which also caps
+            the number of concurrent async requests. Defaults to 100.
+    """
+
+    def __init__(
+        self, api_key: Optional[str] = None, max_connections: int = 100
+    ):
+        self.api_key = api_key
+        self.max_connections = max_connections
+        self._loop_session = None
+
+    def _openai(self):
+        # Imported here as it is slow to import, and unused with other backends.
+        import openai
+
+        openai.api_key = (
+            self.api_key or openai.api_key or os.environ["OPENAI_API_KEY"]
+        )
+        return openai
+
+    def _create(self, prompt: str, model: str, **kwargs):
+        return self._openai().ChatCompletion.create(
+            model=model,
+            messages=[
+                dict(
+                    role="user",
+                    content=prompt,
+                )
+            ],
+            **kwargs,
+        )
+
+    def _session(self):
+        import aiohttp
+
+        loop = asyncio.get_running_loop()
+        if self._loop_session is None or self._loop_session[0] is not loop:
+            session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections)
+            )
+            self._loop_session = (loop, session)
+        return self._loop_session[1]
+
+    async def _acreate(self, prompt: str, model: str, **kwargs):
+        openai = self._openai()
+        openai.aiosession.set(self._session())
+        return await openai.ChatCompletion.acreate(
+            model=model,
+            messages=[
+                dict(
+                    role="user",
+                    content=prompt,
+                )
+            ],
+            **kwargs,
+        )
+
+    def complete(self, prompt: str, model: str) -> str:
+        return self._create(prompt, model)["choices"][0]["message"]["content"]
+
+    def stream(self, prompt: str, model: str) -> Iterable[str]:
+        for result in self._create(prompt, model, stream=True):
+            delta = result["choices"][0].get("delta", {}).get("content")
+            if delta:
+                yield delta
+
+    async def acomplete(self, prompt: str, model: str) -> str:
+        response = await self._acreate(prompt, model)
+        return response["choices"][0]["message"]["content"]
+
+    async def astream(self, prompt: str, model: str) -> AsyncIterator[str]:
+        async for result in await self._acreate(prompt, model, stream=True):
+            delta = result["choices"][0].get("delta", {}).get("content")
+            if delta:
+                yield delta
+
+    async def aclose(self):
+        if self._loop_session is not None:
+            await self._loop_session[1].close()
+            self._loop_session = None
+
+
+class FakeBackend(LLMBackend):
+    """An offline, deterministic stand-in for the OpenAI API, for benchmarks and load tests.
+
+    Responses are looked up by (model, prompt). Prompts without a canned response get the
+    `default` response if given, otherwise a synthetic response seeded by the prompt, so the same
+    prompt always gets the same text.
+
+    Args:
+        responses (Dict[str, str], optional): Canned responses, keyed by `FakeBackend.key(prompt, model)`.
+        default (str, optional): The response to prompts without a canned response.
+        token_latency (float, optional): Seconds to wait between tokens. Defaults to 0.
+        time_to_first_token (float, optional): Seconds to wait before the first token. Defaults to 0.
+        n_tokens (int, optional): The length of synthetic responses. Defaults to 200.
+    """
+
+    def __init__(
+        self,
+        responses: Optional[Dict[str, str]] = None,
+        default: Optional[str] = None,
+        token_latency: float = 0.0,
+        time_to_first_token: float = 0.0,
+        n_tokens: int = 200,
+    ):
+        self.responses = dict(responses or {})
+        self.default = default
+        self.token_latency = token_latency
+        self.time_to_first_token = time_to_first_token
+        self.n_tokens = n_tokens
+
+    @staticmethod
+    def key(prompt: str, model: str) -> str:
+        return hashlib.sha256(f"{model}\0{prompt}".encode()).hexdigest()
+
+    @classmethod
+    def from_recording(cls, path: str, **kwargs) -> "FakeBackend":
+        """Replay responses recorded by `RecordingBackend`.
+
+        Args:
+            path (str): The JSONL file of recorded responses.
+
+        Returns:
+            FakeBackend: A backend replaying the recorded responses.
+        """
+        responses = {}
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    key = cls.key(record["prompt"], record["model"])
+                    responses[key] = record["response"]
+        return cls(responses=responses, **kwargs)
+
+    def response_to(self, prompt: str, model: str) -> str:
+        key = self.key(prompt, model)
+        if key in self.responses:
+            return self.responses[key]
+        if self.default is not None:
+            return self.default
+        rng = random.Random(key)
+        words = prompt.split() or ["policy"]
+        return " ".join(rng.choice(words) for _ in range(self.n_tokens))
+
+    def stream(self, prompt: str, model: str) -> Iterable[str]:
+        if self.time_to_first_token:
+            time.sleep(self.time_to_first_token)
+        for i, token in enumerate(
+            split_tokens(self.response_to(prompt, model))
+        ):
+            if i and self.token_latency:
+                time.sleep(self.token_latency)
+            yield token
+
+    async def astream(self, prompt: str, model: str) -> AsyncIterator[str]:
+        if self.time_to_first_token:
+            await asyncio.sleep(self.time_to_first_token)
+        for i, token in enumerate(
+            split_tokens(self.response_to(prompt, model))
+        ):
+            if i and self.token_latency:
+                await asyncio.sleep(self.token_latency)
+            yield token
+
+
+class RecordingBackend(LLMBackend):
+    """Pass requests through to another backend, appending each response to a JSONL file
+    which `FakeBackend.from_recording` can replay.
+
+    Args:
+        backend (LLMBackend): The backend to record.
+        path (str): The JSONL file to append to.
+    """
+
+    def __init__(self, backend: LLMBackend, path: str):
+        self.backend = backend
+        self.path = path
+
+    def _record(self, prompt: str, model: str, response: str):
+        with open(self.path, "a") as f:
+            f.write(
+                json.dumps(dict(model=model, prompt=prompt, response=response))
+                + "\n"
+            )
+
+    def complete(self, prompt: str, model: str) -> str:
+        response = self.backend.complete(prompt, model)
+        self._record(prompt, model, response)
+        return response
+
+    def stream(self, prompt: str, model: str) -> Iterable[str]:
+        chunks = []
+        for delta in self.backend.stream(prompt, model):
+            chunks.append(delta)
+            yield delta
+        self._record(prompt, model, "".join(chunks))
+
+    async def astream(self, prompt: str, model: str) -> AsyncIterator[str]:
+        chunks = []
+        async for delta in self.backend.astream(prompt, model):
+            chunks.append(delta)
+            yield delta
+        self._record(prompt, model, "".join(chunks))
+
+    async def aclose(self):
+        await self.backend.aclose()
+
+
+_backend = None
+
+
+def get_backend() -> LLMBackend:
+    """Return the backend used by `ask_gpt` and `ask_gpt_stream`.
+
+    Unless `set_backend` has been called, this is chosen by the POLICYENGINE_AI_LLM_BACKEND
+    environment variable: "openai" (the default) or "fake". The fake backend replays
+    POLICYENGINE_AI_LLM_RECORDING if it is set.
+
+    Returns:
+        LLMBackend: The current backend.
+    """
+    global _backend
+    if _backend is None:
+        name = os.environ.get(BACKEND_ENV_VAR, "openai")
+        if name == "openai":
+            _backend = OpenAIBackend()
+        elif name == "fake":
+            recording = os.environ.get(RECORDING_ENV_VAR)
+            if recording:
+                _backend = FakeBackend.from_recording(recording)
+            else:
+                _backend = FakeBackend()
+        else:
+            raise ValueError(
+                f"Unknown LLM backend {name!r}, expected 'openai' or 'fake'."
+            )
+    return _backend
+
+
+def set_backend(backend: Optional[LLMBackend]):
+    """Set the backend used by `ask_gpt` and `ask_gpt_stream`.
+
+    Args:
+        backend (LLMBackend, optional): The backend, or None to choose from the environment again.
+    """
+    global _backend
+    _backend = backend
+
+
+_cache = None
+
+
+def get_cache() -> ResponseCache:
+    """Return the response cache used by `ask_gpt` and `ask_gpt_stream`.
+
+    Unless `set_cache` has been called, this keeps POLICYENGINE_AI_CACHE_ENTRIES responses
+    (default 128, 0 to disable) in memory, and persists them to the SQLite file at
+    POLICYENGINE_AI_CACHE_PATH if it is set.
+
+    Returns:
+        ResponseCache: The current cache.
+    """
+    global _cache
+    if _cache is None:
+        _cache = ResponseCache(
+            max_entries=int(os.environ.get(CACHE_ENTRIES_ENV_VAR, 128)),
+            path=os.environ.get(CACHE_PATH_ENV_VAR),
+        )
+    return _cache
+
+
+def set_cache(cache: Optional[ResponseCache]):
+    """Set the response cache used by `ask_gpt` and `ask_gpt_stream`.
+
+    Args:
+        cache (ResponseCache, optional): The cache, or None to configure from the environment again.
+    """
+    global _cache
+    _cache = cache
 
 
 def ask_gpt(prompt: str, model: str = "gpt-4") -> str:
@@ -16,42 +367,244 @@ def ask_gpt(prompt: str, model: str = "gpt-4") -> str:
     Returns:
         str: The response from the API.
     """
-    return openai.ChatCompletion.create(
-        model=model,
-        messages=[
-            dict(
-                role="user",
-                content=prompt,
+    with span("ask_gpt", model=model) as s:
+        cache = get_cache()
+        key = cache.key(model, prompt)
+        response = cache.get(key)
+        s.set(cached=response is not None)
+        if response is None:
+            response = get_backend().complete(prompt, model)
+            cache.set(key, response)
+        if s.recording:
+            s.set(
+                prompt_tokens=_count_tokens(prompt, model),
+                completion_tokens=_count_tokens(response, model),
             )
-        ],
-    )["choices"][0]["message"]["content"]
+    return response
 
 
-def ask_gpt_stream(prompt: str, model: str = "gpt-4") -> Iterable:
+def ask_gpt_stream(
+    prompt: str, model: str = "gpt-4", deltas: bool = False
+) -> Iterable[str]:
     """Return the response to a prompt from the OpenAI API, yielding the results as they come in.
 
     Args:
         prompt (str): The prompt to send to the API.
         model (str, optional): The model to use. Defaults to "gpt-4".
+        deltas (bool, optional): If True, yield only the new text in each update rather than
+            the whole response so far. Defaults to False.
 
     Returns:
-        Iterable: The response from the API.
+        Iterable[str]: The response from the API.
     """
-    response = openai.ChatCompletion.create(
-        model=model,
-        messages=[
-            dict(
-                role="user",
-                content=prompt,
+    cache = get_cache()
+    key = cache.key(model, prompt)
+    response = cache.get(key)
+    if response is not None:
+        delta_stream = iter(split_tokens(response))
+    else:
+        delta_stream = _cache_on_completion(
+            get_backend().stream(prompt, model), cache, key
+        )
+    if tracing_enabled():
+        delta_stream = traced_stream(
+            "ask_gpt_stream",
+            delta_stream,
+            first="first_token",
+            count="completion_tokens",
+            model=model,
+            cached=response is not None,
+            prompt_tokens=_count_tokens(prompt, model),
+        )
+    if deltas:
+        yield from delta_stream
+    else:
+        yield from accumulate(delta_stream)
+
+
+_coalescer = StreamCoalescer()
+
+
+def get_coalescer() -> StreamCoalescer:
+    """Return the coalescer which shares in-flight responses between identical async requests.
+
+    Returns:
+        StreamCoalescer: The coalescer, whose `started` and `joined` counts are the number of
+            upstream requests made and avoided.
+    """
+    return _coalescer
+
+
+async def ask_gpt_async(prompt: str, model: str = "gpt-4") -> str:
+    """Async version of `ask_gpt`. Identical requests in flight at once share one API call.
+
+    Args:
+        prompt (str): The prompt to send to the API.
+        model (str, optional): The model to use. Defaults to "gpt-4".
+
+    Returns:
+        str: The response from the API.
+    """
+    return "".join(
+        [
+            delta
+            async for delta in ask_gpt_stream_async(
+                prompt, model=model, deltas=True
             )
-        ],
-        stream=True,
+        ]
     )
 
-    combined_response = ""
 
-    for result in response:
-        combined_response += (
-            result["choices"][0].get("delta", {}).get("content", "")
+async def ask_gpt_stream_async(
+    prompt: str, model: str = "gpt-4", deltas: bool = False
+) -> AsyncIterator[str]:
+    """Async version of `ask_gpt_stream`. Identical requests in flight at once share one API
+    call, each receiving the whole response.
+
+    Args:
+        prompt (str): The prompt to send to the API.
+        model (str, optional): The model to use. Defaults to "gpt-4".
+        deltas (bool, optional): If True, yield only the new text in each update rather than
+            the whole response so far. Defaults to False.
+
+    Returns:
+        AsyncIterator[str]: The response from the API.
+    """
+    cache = get_cache()
+    key = cache.key(model, prompt)
+    response = cache.get(key)
+    if response is not None:
+        delta_stream = _replay(response)
+    else:
+        delta_stream = _coalescer.stream(
+            key,
+            lambda: get_backend().astream(prompt, model),
+            on_complete=lambda chunks: cache.set(key, "".join(chunks)),
         )
-        yield combined_response
\ No newline at end of file
+    if tracing_enabled():
+        delta_stream = traced_astream(
+            "ask_gpt_stream",
+            delta_stream,
+            first="first_token",
+            count="completion_tokens",
+            model=model,
+            cached=response is not None,
+            prompt_tokens=_count_tokens(prompt, model),
+        )
+    chunks = []
+    async for delta in delta_stream:
+        chunks.append(delta)
+        yield delta if deltas else "".join(chunks)
+
+
+def _count_tokens(text: str, model: str) -> int:
+    # Imported here, as the context helpers import the knowledge bases, which import this module.
+    from capabilities.helpers.context import count_tokens
+
+    return count_tokens(text, model)
+
+
+async def _replay(response: str) -> AsyncIterator[str]:
+    for token in split_tokens(response):
+        yield token
+
+
+def _cache_on_completion(
+    deltas: Iterable[str], cache: ResponseCache, key: str
+) -> Iterable[str]:
+    # Only complete responses are cached, so an abandoned stream is requested again next time.
+    chunks = []
+    for delta in deltas:
+        chunks.append(delta)
+        yield delta
+    cache.set(key, "".join(chunks))
+
+
+class _Accumulator:
+    """The combined text of some deltas, joined only when an update is due."""
+
+    def __init__(self, growth: float):
+        self.growth = growth
+        self.chunks = []
+        self.length = 0
+        self.yielded = None
+
+    def add(self, delta: str) -> Optional[str]:
+        """Add a delta, returning the combined text if an update is due."""
+        self.chunks.append(delta)
+        self.length += len(delta)
+        if (
+            self.yielded is None
+            or self.length - self.yielded > self.growth * self.yielded
+        ):
+            return self._join()
+        return None
+
+    def close(self) -> Optional[str]:
+        """Return the combined text, if it has changed since the last update."""
+        if self.yielded is None or self.length == self.yielded:
+            return None
+        return self._join()
+
+    def _join(self) -> str:
+        text = "".join(self.chunks)
+        self.chunks = [text]
+        self.yielded = self.length
+        return text
+
+
+def accumulate(
+    deltas: Iterable[str], growth: float = ACCUMULATE_GROWTH
+) -> Iterable[str]:
+    """Turn a stream of deltas into a stream of the combined text so far.
+
+    Each update copies the whole text, so rather than one per delta (quadratic in the length of
+    the text), an update is yielded for the first delta, whenever the text has grown by `growth`
+    times its length at the last update, and at the end. The copying is then linear. To render
+    every token, stream deltas instead (see `streaming.render_stream`).
+
+    Args:
+        deltas (Iterable[str]): The new text in each update.
+        growth (float, optional): The growth between updates. Defaults to ACCUMULATE_GROWTH; 0
+            yields after every delta which adds text.
+
+    Returns:
+        Iterable[str]: The combined text, ending with all of it.
+    """
+    accumulator = _Accumulator(growth)
+    for delta in deltas:
+        text = accumulator.add(delta)
+        if text is not None:
+            yield text
+    text = accumulator.close()
+    if text is not None:
+        yield text
+
+
+async def accumulate_async(
+    deltas: AsyncIterator[str], growth: float = ACCUMULATE_GROWTH
+) -> AsyncIterator[str]:
+    """Async version of `accumulate`."""
+    accumulator = _Accumulator(growth)
+    async for delta in deltas:
+        text = accumulator.add(delta)
+        if text is not None:
+            yield text
+    text = accumulator.close()
+    if text is not None:
+        yield text
+
+
+TOKEN_PATTERN = re.compile(r"\S+\s*|\s+")
+
+
+def split_tokens(text: str) -> List[str]:
+    """Split text into word-sized pieces which join back into the original text.
+
+    Args:
+        text (str): The text to split.
+
+    Returns:
+        List[str]: The pieces, each a word with its trailing whitespace.
+    """
+    return TOKEN_PATTERN.findall(text)
@@ -0,0 +1,333 @@
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import logging
+import os
+import threading
+
+from capabilities.helpers.context import count_tokens
+from capabilities.helpers.knowledge_bases import NumPyKnowledgeBase
+from capabilities.helpers.tracing import span
+
+logger = logging.getLogger(__name__)
+
+EXAMPLE_TOKENS_ENV_VAR = "POLICYENGINE_AI_EXAMPLE_TOKENS"
+# The tokens of example files of each kind put in a prompt, and the most examples shown.
+EXAMPLE_TOKENS = 200
+MAX_EXAMPLES = 3
+
+EXAMPLES_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "examples"
+)
+# Example kinds, which are the subdirectories of the examples directory.
+PARAMETERS = "parameters"
+VARIABLES = "variables"
+LANGUAGES = {".yaml": "yaml", ".py": "python"}
+
+# The annotated templates sent when no examples are selected.
+VARIABLE_TEMPLATE = """PolicyEngine (derived from OpenFisca) uses Python to model the logic of a policy, in the form below (an example):
+
+income_tax.py
+```python
+from policyengine_uk.model_api import * # for uk-specific functions, we also model in policyengine_us.
+
+
+class income_tax(Variable):
+    label = "income tax"
+    definition_period = YEAR # or MONTH
+    entity = Household # or Person or TaxUnit (US) or BenUnit (UK)
+    value_type = float # or int or bool or str
+    reference = "https://www.gov.uk/income-tax-rates" # a reference for the parameter, if the user gave you one.
+    defined_for = None # e.g. StateCode.NY if in the US and state-specific, otherwise None.
+    documentation = "Federal income tax liabilities."
+
+    def formula(person, period, parameters): # person might be household if entity is Household, etc.
+        employment_income = person("employment_income", period) # You can retrieve other variables like this. You can also use `add(household, period, [list, of, variables])` to add up variables from a higher entity.
+        parameter_subtree = parameters(period).gov.income_tax.income_tax_allowance # You can retrieve parameters like this, they're in a folder tree
+        tax_rate = parameter_subtree.rate # You can retrieve values from the parameter tree like this if they exist.
+        # variable values are all vectors, so use vectorisable operations.
+        # min_(x, y) is a vectorisable function that returns the minimum of x and y for each element of the vector. We also have max_, and you can use other NumPy default functions too.
+        return tax_rate * max_(employment_income - parameter_subtree.allowance, 0)
+```"""
+
+PARAMETER_TEMPLATE = """PolicyEngine uses standardised YAML files to model policy parameters, in the form below:
+personal_allowance.yaml
+```yaml
+description: A full-sentence description of the parameter.
+metadata:
+    unit: either currency-GBP, currency-USD, hour, or something new like 'person' if it's a population size.
+    period: the time period over which the parameter applies, one of 'year', 'month' or 'day'.
+    label: a short phrase that describes the parameter, e.g. 'personal tax allowance'. You should be able to drop this into a sentence as-is.
+    reference: # a list of any references used in writing the parameter if the user gave you any, that apply to *all* values.
+    - title: The title of the web page or legislative reference.
+      href: The URL of the web page or legislative reference.
+values: # any number of values, each with a start date, in order.
+    2018-04-01:
+        value: 11_850.00 # the value of the parameter on this date. Make sure to use underscores to separate thousands.
+        reference: # Any references which inform about *only* this value.
+        - title: ...
+          href: ...
+    2019-04-01: 12_500 # if there's no reference, you can use this shorthand.
+    2020-04-01: ...
+```
+If you don't have enough information to be confident, return what you have but add a YAML comment explaining where you think you messed up. Return valid YAML only. 
+If the user passes you data describing more than one parameter at a time, write parameter files for each one, with the filenames written above.
+"""
+
+# The same instructions without the annotated templates, sent with examples instead.
+VARIABLE_RULES = """PolicyEngine (derived from OpenFisca) models each variable as a Python class in its own file, like the examples below. Set a reference only if the user gave you one, and defined_for (e.g. StateCode.NY) only if the variable is state-specific. Values are vectors, so use vectorisable operations (min_, max_, where), never if.
+"""
+
+PARAMETER_RULES = """PolicyEngine models policy parameters with standardised YAML files, like the examples below. Use underscores to separate thousands, and give references only if the user gave you any. If you don't have enough information to be confident, return what you have but add a YAML comment explaining where you think you messed up. Return valid YAML only. If the user describes more than one parameter, write a file for each one, with its filename above it.
+"""
+
+EXAMPLES_HEADER = "\nExamples of similar files:\n\n"
+
+
+class Example(NamedTuple):
+    """An example file, rendered as it appears in prompts."""
+
+    path: str
+    kind: str
+    # The first comment line of the file, which says what it shows.
+    description: str
+    text: str
+    tokens: int
+
+
+def load_examples(directory: str = EXAMPLES_DIR) -> List[Example]:
+    """Load the example files in each kind's subdirectory of a directory.
+
+    Args:
+        directory (str, optional): The directory. Defaults to EXAMPLES_DIR.
+
+    Returns:
+        List[Example]: The examples, ordered by kind and filename.
+    """
+    examples = []
+    for kind in sorted(os.listdir(directory)):
+        kind_directory = os.path.join(directory, kind)
+        if not os.path.isdir(kind_directory):
+            continue
+        for name in sorted(os.listdir(kind_directory)):
+            language = LANGUAGES.get(os.path.splitext(name)[1])
+            if language is None:
+                continue
+            with open(os.path.join(kind_directory, name)) as f:
+                first, _, body = f.read().partition("\n")
+            text = f"{name}\n```{language}\n{body.rstrip()}\n```\n"
+            examples.append(
+                Example(
+                    name,
+                    kind,
+                    first.lstrip("# ").strip(),
+                    text,
+                    count_tokens(text),
+                )
+            )
+    return examples
+
+
+class ExampleLibrary:
+    """Example parameter and variable files, indexed by embedding so each prompt can show the
+    few most like the policy being modelled. Examples are embedded on first use.
+
+    Args:
+        directory (str, optional): The examples directory. Defaults to EXAMPLES_DIR.
+        model (SentenceTransformer, optional): The embedding model. Defaults to the shared one.
+    """
+
+    def __init__(self, directory: str = EXAMPLES_DIR, model=None):
+        self.examples = {
+            example.path: example for example in load_examples(directory)
+        }
+        self.knowledge = NumPyKnowledgeBase(model=model)
+        self._indexed = False
+        self._lock = threading.Lock()
+
+    def _index(self):
+        if self._indexed:
+            return
+        with self._lock:
+            if self._indexed:
+                return
+            examples = list(self.examples.values())
+            # Embed the description with the file, so what the example shows counts.
+            embeddings = self.knowledge.embed(
+                [f"{e.description}\n{e.text}" for e in examples]
+            )
+            self.knowledge.add_embedded(
+                [e.path for e in examples],
+                embeddings,
+                [e.path for e in examples],
+                [{"kind": e.kind} for e in examples],
+            )
+            self._indexed = True
+
+    def select(
+        self,
+        query: str,
+        kinds: Iterable[str] = (PARAMETERS, VARIABLES),
+        budget: int = EXAMPLE_TOKENS,
+        max_examples: int = MAX_EXAMPLES,
+    ) -> List[Example]:
+        """Select the examples most similar to a query which fit in a token budget. The best
+        example of each kind is chosen first, then the rest by similarity.
+
+        Args:
+            query (str): The query, e.g. the policy information.
+            kinds (Iterable[str], optional): The kinds of example. Defaults to both.
+            budget (int, optional): The most tokens of examples. Defaults to EXAMPLE_TOKENS.
+            max_examples (int, optional): The most examples. Defaults to MAX_EXAMPLES.
+
+        Returns:
+            List[Example]: The examples, ordered by kind, then best first.
+        """
+        kinds = list(kinds)
+        if not self.examples or budget <= 0 or max_examples <= 0:
+            return []
+        self._index()
+        # The query embedding is cached, so repeated requests only search.
+        results = self.knowledge.search_embeddings(
+            self.knowledge.embed([query]),
+            top_n=len(self.examples),
+            filters={"kind": kinds},
+        )[0]
+        ranked = [self.examples[path] for path, _, _ in results]
+        best = {}
+        for example in ranked:
+            best.setdefault(example.kind, example)
+        selected, tokens = [], 0
+        for example in list(best.values()) + ranked:
+            if len(selected) == max_examples:
+                break
+            if example in selected or tokens + example.tokens > budget:
+                continue
+            selected.append(example)
+            tokens += example.tokens
+        return sorted(
+            selected, key=lambda e: (kinds.index(e.kind), ranked.index(e))
+        )
+
+
+_library = None
+_lock = threading.Lock()
+
+
+def get_example_library() -> ExampleLibrary:
+    """Return the process-wide example library, loading the files in EXAMPLES_DIR on first use."""
+    global _library
+    if _library is None:
+        with _lock:
+            if _library is None:
+                _library = ExampleLibrary()
+    return _library
+
+
+def set_example_library(library: Optional[ExampleLibrary]):
+    """Set the example library prompts are built from.
+
+    Args:
+        library (ExampleLibrary, optional): The library, or None to load EXAMPLES_DIR again.
+    """
+    global _library
+    _library = library
+
+
+class PromptBuilder:
+    """Build a prompt from the format rules, the example files most like the information, and the
+    closing instructions, then the information. The static fragments are joined once, so each
+    build only selects examples.
+
+    If no examples are selected, or selecting them fails (e.g. the embedding model can't be
+    loaded), the annotated templates are sent instead.
+
+    Args:
+        rules (str): The format instructions sent with examples.
+        templates (str): The annotated templates sent without examples.
+        closing (str): The instructions between the examples or templates and the information.
+        kinds (Iterable[str]): The kinds of example to show.
+        library (ExampleLibrary, optional): The examples. Defaults to `get_example_library()`.
+        example_tokens (int, optional): The tokens of examples of each kind. Defaults to
+            POLICYENGINE_AI_EXAMPLE_TOKENS, or EXAMPLE_TOKENS; 0 always sends the templates. The
+            rules and examples are never longer than the templates they replace.
+        max_examples (int, optional): The most examples in each prompt. Defaults to MAX_EXAMPLES.
+    """
+
+    def __init__(
+        self,
+        rules: str,
+        templates: str,
+        closing: str,
+        kinds: Iterable[str],
+        library: Optional[ExampleLibrary] = None,
+        example_tokens: Optional[int] = None,
+        max_examples: int = MAX_EXAMPLES,
+    ):
+        self.rules = rules
+        self.templates = templates
+        self.closing = closing
+        self.kinds = tuple(kinds)
+        self._library = library
+        if example_tokens is None:
+            example_tokens = int(
+                os.environ.get(EXAMPLE_TOKENS_ENV_VAR, EXAMPLE_TOKENS)
+            )
+        self.example_tokens = example_tokens
+        self.max_examples = max_examples
+        self.budget = min(
+            example_tokens * len(self.kinds),
+            count_tokens(templates) - count_tokens(rules + EXAMPLES_HEADER),
+        )
+        # The rules and examples before the closing instructions, by selected paths.
+        self._prefixes: Dict[Tuple[str, ...], str] = {}
+
+    @property
+    def library(self) -> ExampleLibrary:
+        return self._library or get_example_library()
+
+    def build(self, information: str, closing: Optional[str] = None) -> str:
+        """Build the prompt for some information.
+
+        Args:
+            information (str): The information, which examples are selected by.
+            closing (str, optional): Closing instructions to use instead of the builder's.
+
+        Returns:
+            str: The prompt.
+        """
+        if closing is None:
+            closing = self.closing
+        if self.budget <= 0:
+            return self.templates + closing + information
+        try:
+            with span("build_prompt", kinds=",".join(self.kinds)) as s:
+                examples = self.library.select(
+                    information,
+                    self.kinds,
+                    budget=self.budget,
+                    max_examples=self.max_examples,
+                )
+                s.set(
+                    examples=len(examples),
+                    example_tokens=sum(e.tokens for e in examples),
+                )
+        except Exception:
+            logger.warning(
+                "Couldn't select examples, so sending the templates",
+                exc_info=True,
+            )
+            examples = []
+        prefix = self._prefix(examples) if examples else self.templates
+        return prefix + closing + information
+
+    def _prefix(self, examples: List[Example]) -> str:
+        key = tuple(e.path for e in examples)
+        prefix = self._prefixes.get(key)
+        if prefix is None:
+            prefix = self._prefixes[key] = (
+                self.rules
+                + EXAMPLES_HEADER
+                + "\n".join(e.text for e in examples)
+                + "\n"
+            )
+        return prefix
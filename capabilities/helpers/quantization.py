@@ -0,0 +1,257 @@
+from typing import Optional
+
+import numpy as np
+
+from capabilities.helpers.ann import kmeans, nearest_centroids
+
+# Codes are decoded (or looked up) this many rows at a time when scoring, to bound the memory
+# used by the float32 intermediate.
+SCORE_BLOCK_SIZE = 4_096
+
+
+class ScalarQuantizer:
+    """Compress embeddings to one int8 per dimension, with a float32 scale per row, about 4x
+    smaller than float32. Each row is scaled by its own largest magnitude, so no training is
+    needed and rows can be added at any time.
+
+    Codes are uint8 rows of `4 + dim` bytes: the scale, then the int8 values.
+    """
+
+    kind = "scalar"
+    trained = True
+
+    def code_size(self, dim: int) -> int:
+        return 4 + dim
+
+    def train(self, embeddings: np.ndarray):
+        pass
+
+    def encode(self, embeddings: np.ndarray) -> np.ndarray:
+        embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        scales = np.abs(embeddings).max(axis=1) / 127
+        scales[scales == 0] = 1
+        codes = np.empty(
+            (len(embeddings), self.code_size(embeddings.shape[1])), np.uint8
+        )
+        codes[:, :4] = scales.astype(np.float32)[:, None].view(np.uint8)
+        codes[:, 4:] = (
+            np.rint(embeddings / scales[:, None])
+            .astype(np.int8)
+            .view(np.uint8)
+        )
+        return codes
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        scales, values = self._split(codes)
+        return values.astype(np.float32) * scales[:, None]
+
+    def score(
+        self, codes: np.ndarray, query_embeddings: np.ndarray
+    ) -> np.ndarray:
+        """Dot-product scores of queries against coded rows.
+
+        Args:
+            codes (np.ndarray): The coded rows.
+            query_embeddings (np.ndarray): A (queries, dim) matrix.
+
+        Returns:
+            np.ndarray: A (queries, rows) matrix of scores.
+        """
+        query_embeddings = np.asarray(query_embeddings, dtype=np.float32)
+        blocks = []
+        for start in range(0, len(codes), SCORE_BLOCK_SIZE):
+            scales, values = self._split(
+                codes[start : start + SCORE_BLOCK_SIZE]
+            )
+            blocks.append(
+                (query_embeddings @ values.astype(np.float32).T) * scales
+            )
+        return np.concatenate(
+            blocks or [np.zeros((len(query_embeddings), 0), np.float32)],
+            axis=-1,
+        )
+
+    def save(self, path: str):
+        np.savez(path, kind=self.kind)
+
+    def load(self, path: str):
+        pass
+
+    def _split(self, codes: np.ndarray):
+        codes = np.ascontiguousarray(codes)
+        scales = codes[:, :4].copy().view(np.float32)[:, 0]
+        return scales, codes[:, 4:].view(np.int8)
+
+
+class ProductQuantizer:
+    """Compress embeddings to one byte per subvector, e.g. 96 bytes for a 768-dim embedding, 32x
+    smaller than float32. Each subvector is replaced by the nearest of 256 centroids learned for
+    its subspace with k-means, and queries are scored against the codes through a table of each
+    query subvector's dot product with every centroid.
+
+    The quantizer must be trained (on a representative sample) before rows are encoded.
+
+    Args:
+        n_subvectors (int, optional): The bytes per row, which must divide the dimension.
+            Defaults to 96.
+        max_train_sample (int, optional): The number of rows k-means is run on. Defaults to 20,000,
+            about 80 per centroid.
+        min_train_sample (int, optional): The rows a knowledge base collects (at full precision)
+            before training. Defaults to 10,000, about 40 per centroid.
+        seed (int, optional): The random seed. Defaults to 0.
+    """
+
+    kind = "product"
+    N_CENTROIDS = 256
+
+    def __init__(
+        self,
+        n_subvectors: int = 96,
+        max_train_sample: int = 20_000,
+        min_train_sample: int = 10_000,
+        seed: int = 0,
+    ):
+        self.n_subvectors = n_subvectors
+        self.max_train_sample = max_train_sample
+        self.min_train_sample = max(min_train_sample, self.N_CENTROIDS)
+        self.seed = seed
+        # (n_subvectors, 256, subvector dim)
+        self.centroids: Optional[np.ndarray] = None
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    def code_size(self, dim: int) -> int:
+        return self.n_subvectors
+
+    def train(self, embeddings: np.ndarray):
+        """Learn the centroids of each subspace from a sample of at least N_CENTROIDS rows."""
+        n_rows, dim = np.shape(embeddings)
+        if dim % self.n_subvectors:
+            raise ValueError(
+                f"{self.n_subvectors} subvectors don't divide {dim} dimensions"
+            )
+        if n_rows < self.N_CENTROIDS:
+            raise ValueError(
+                f"Training needs at least {self.N_CENTROIDS} rows, got {n_rows}"
+            )
+        rng = np.random.default_rng(self.seed)
+        if len(embeddings) > self.max_train_sample:
+            embeddings = embeddings[
+                np.sort(
+                    rng.choice(
+                        len(embeddings), self.max_train_sample, replace=False
+                    )
+                )
+            ]
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        subvectors = self._subvectors(embeddings)
+        centroids = np.zeros(
+            (self.n_subvectors, self.N_CENTROIDS, subvectors.shape[2]),
+            np.float32,
+        )
+        for i in range(self.n_subvectors):
+            centroids[i] = kmeans(
+                subvectors[:, i], self.N_CENTROIDS, seed=self.seed
+            )
+        self.centroids = centroids
+
+    def encode(self, embeddings: np.ndarray) -> np.ndarray:
+        subvectors = self._subvectors(
+            np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        )
+        codes = np.empty((len(subvectors), self.n_subvectors), np.uint8)
+        for i, centroids in enumerate(self.centroids):
+            codes[:, i] = nearest_centroids(subvectors[:, i], centroids)
+        return codes
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        codes = np.asarray(codes)
+        return self.centroids[np.arange(self.n_subvectors), codes].reshape(
+            len(codes), -1
+        )
+
+    def score(
+        self, codes: np.ndarray, query_embeddings: np.ndarray
+    ) -> np.ndarray:
+        """Dot-product scores of queries against coded rows.
+
+        Args:
+            codes (np.ndarray): The coded rows.
+            query_embeddings (np.ndarray): A (queries, dim) matrix.
+
+        Returns:
+            np.ndarray: A (queries, rows) matrix of scores.
+        """
+        query_embeddings = np.atleast_2d(
+            np.asarray(query_embeddings, dtype=np.float32)
+        )
+        # (queries, subvectors, 256): each query subvector's score against each centroid.
+        tables = np.einsum(
+            "qsd,scd->qsc", self._subvectors(query_embeddings), self.centroids
+        )
+        # Index the flattened tables with each code plus its subvector's offset, in the smallest
+        # integer type which fits, as the lookup is the slowest step.
+        n_entries = self.n_subvectors * self.N_CENTROIDS
+        index_type = np.uint16 if n_entries <= 2**16 else np.uint32
+        offsets = (np.arange(self.n_subvectors) * self.N_CENTROIDS).astype(
+            index_type
+        )
+        tables = tables.reshape(len(tables), -1)
+        scores = np.empty((len(query_embeddings), len(codes)), np.float32)
+        for start in range(0, len(codes), SCORE_BLOCK_SIZE):
+            block = codes[start : start + SCORE_BLOCK_SIZE] + offsets
+            for q, table in enumerate(tables):
+                scores[q, start : start + len(block)] = np.take(
+                    table, block
+                ).sum(axis=1)
+        return scores
+
+    def save(self, path: str):
+        np.savez(
+            path,
+            kind=self.kind,
+            centroids=self.centroids,
+            parameters=np.array([self.n_subvectors, self.seed]),
+        )
+
+    def load(self, path: str):
+        with np.load(path) as saved:
+            self.centroids = saved["centroids"]
+            self.n_subvectors, self.seed = saved["parameters"].tolist()
+
+    def _subvectors(self, embeddings: np.ndarray) -> np.ndarray:
+        return embeddings.reshape(len(embeddings), self.n_subvectors, -1)
+
+
+class DecodedRows:
+    """Coded rows which read like a float32 matrix, decoding only the rows indexed."""
+
+    def __init__(self, quantizer, codes: np.ndarray):
+        self.quantizer = quantizer
+        self.codes = codes
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, index) -> np.ndarray:
+        return self.quantizer.decode(self.codes[index])
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        return self.quantizer.decode(self.codes).astype(dtype or np.float32)
+
+
+QUANTIZERS = {
+    quantizer.kind: quantizer
+    for quantizer in (ScalarQuantizer, ProductQuantizer)
+}
+
+
+def load_quantizer(path: str):
+    """Load a quantizer saved by its `save` method, whichever kind it is."""
+    with np.load(path) as saved:
+        kind = str(saved["kind"])
+    quantizer = QUANTIZERS[kind]()
+    quantizer.load(path)
+    return quantizer
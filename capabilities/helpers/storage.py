@@ -0,0 +1,117 @@
+from typing import Iterable, Union
+
+import json
+import os
+
+import numpy as np
+
+
+class TextStore:
+    """A sequence of strings stored as one UTF-8 blob plus an index of offsets, both of which can be
+    memory-mapped from disk. Strings are only decoded when a row is read, and strings appended
+    after loading are kept in memory until the next save.
+
+    Args:
+        blob (np.ndarray, optional): The UTF-8 bytes of every string, concatenated.
+        offsets (np.ndarray, optional): The start of each string in the blob, plus the end of the last.
+    """
+
+    def __init__(self, blob: np.ndarray = None, offsets: np.ndarray = None):
+        self.blob = blob if blob is not None else np.zeros(0, dtype=np.uint8)
+        self.offsets = (
+            offsets if offsets is not None else np.zeros(1, dtype=np.int64)
+        )
+        self.extra = []
+
+    @property
+    def stored(self) -> int:
+        """The number of strings in the blob, rather than appended since loading."""
+        return len(self.offsets) - 1
+
+    def __len__(self) -> int:
+        return self.stored + len(self.extra)
+
+    def __getitem__(self, index: Union[int, slice]):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("TextStore index out of range")
+        if index >= self.stored:
+            return self.extra[index - self.stored]
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return self.blob[start:end].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def append(self, value: str):
+        self.extra.append(value)
+
+    def extend(self, values: Iterable[str]):
+        self.extra.extend(values)
+
+    def save(self, path: str):
+        """Write the blob to `path + ".bin"` and the offsets to `path + ".offsets.npy"`."""
+        offsets = np.empty(len(self) + 1, dtype=np.int64)
+        offsets[0] = 0
+        with atomic_write(path + ".bin") as f:
+            for i, value in enumerate(self):
+                encoded = value.encode("utf-8")
+                f.write(encoded)
+                offsets[i + 1] = offsets[i] + len(encoded)
+        with atomic_write(path + ".offsets.npy") as f:
+            np.save(f, offsets)
+
+    @classmethod
+    def load(cls, path: str) -> "TextStore":
+        """Memory-map a store written by `save`."""
+        offsets = np.load(path + ".offsets.npy", mmap_mode="r")
+        if offsets[-1] == 0:
+            # Empty files can't be memory-mapped.
+            return cls(offsets=offsets)
+        return cls(np.memmap(path + ".bin", dtype=np.uint8, mode="r"), offsets)
+
+
+class atomic_write:
+    """Open a file for binary writing, replacing `path` only once it has been closed. Readers
+    which have memory-mapped the old file keep seeing its contents."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.temporary_path = path + ".tmp"
+
+    def __enter__(self):
+        self.file = open(self.temporary_path, "wb")
+        return self.file
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.file.close()
+        if exc_type is None:
+            os.replace(self.temporary_path, self.path)
+        else:
+            os.remove(self.temporary_path)
+
+
+def save_matrix(path: str, matrix: np.ndarray):
+    """Write a matrix as raw bytes, with its dtype and shape in `path + ".json"`."""
+    with atomic_write(path) as f:
+        np.ascontiguousarray(matrix).tofile(f)
+    with atomic_write(path + ".json") as f:
+        f.write(
+            json.dumps(
+                dict(dtype=matrix.dtype.str, shape=list(matrix.shape))
+            ).encode()
+        )
+
+
+def load_matrix(path: str) -> np.ndarray:
+    """Memory-map (read-only) a matrix written by `save_matrix`."""
+    with open(path + ".json") as f:
+        header = json.load(f)
+    shape = tuple(header["shape"])
+    if 0 in shape:
+        return np.zeros(shape, dtype=header["dtype"])
+    return np.memmap(path, dtype=header["dtype"], mode="r", shape=shape)
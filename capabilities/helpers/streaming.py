@@ -0,0 +1,112 @@
+from typing import Callable, Iterable, Optional
+import time
+
+
+class ThrottledRenderer:
+    """Collect streamed deltas and pass the combined text to a render function at a bounded rate.
+
+    Re-rendering the whole response on every token is expensive for long outputs, so updates are
+    merged. The first delta is rendered at once; after that, a render is due when either limit is
+    reached: `min_interval` seconds or `every_n_tokens` deltas since the last render. Either limit
+    can be disabled with None, and with both disabled every delta is rendered. `flush` renders
+    whatever is left.
+
+    Args:
+        render (Callable[[str], None]): Called with the full text so far, e.g. `placeholder.write`.
+        min_interval (float, optional): Seconds between renders, or None to only count deltas.
+            Defaults to 0.05.
+        every_n_tokens (int, optional): Deltas between renders, or None to only count time.
+            Defaults to None.
+        transform (Callable[[str], str], optional): Applied to the text before each render.
+    """
+
+    def __init__(
+        self,
+        render: Callable[[str], None],
+        min_interval: Optional[float] = 0.05,
+        every_n_tokens: Optional[int] = None,
+        transform: Optional[Callable[[str], str]] = None,
+    ):
+        self.render = render
+        self.min_interval = min_interval
+        self.every_n_tokens = every_n_tokens
+        self.transform = transform
+        self.chunks = []
+        self.render_count = 0
+        self._pending = 0
+        self._last_render = None
+
+    @property
+    def text(self) -> str:
+        """The full text received so far."""
+        if len(self.chunks) > 1:
+            self.chunks = ["".join(self.chunks)]
+        return self.chunks[0] if self.chunks else ""
+
+    def write(self, delta: str):
+        """Add a delta, rendering if either limit has been reached since the last render."""
+        self.chunks.append(delta)
+        self._pending += 1
+        now = time.monotonic()
+        if self._due(now):
+            self._render(now)
+
+    def _due(self, now: float) -> bool:
+        if self._last_render is None:
+            return True
+        if self.min_interval is None and self.every_n_tokens is None:
+            return True
+        if (
+            self.min_interval is not None
+            and now - self._last_render >= self.min_interval
+        ):
+            return True
+        return (
+            self.every_n_tokens is not None
+            and self._pending >= self.every_n_tokens
+        )
+
+    def flush(self):
+        """Render any deltas which haven't been rendered yet."""
+        if self._pending:
+            self._render(time.monotonic())
+
+    def _render(self, now: float):
+        text = self.text
+        self.render(self.transform(text) if self.transform else text)
+        self.render_count += 1
+        self._pending = 0
+        self._last_render = now
+
+
+def render_stream(
+    deltas: Iterable[str],
+    render: Callable[[str], None],
+    min_interval: Optional[float] = 0.05,
+    every_n_tokens: Optional[int] = None,
+    transform: Optional[Callable[[str], str]] = None,
+) -> str:
+    """Render a stream of deltas at a bounded refresh rate, always finishing with the full text.
+
+    Args:
+        deltas (Iterable[str]): The new text in each update.
+        render (Callable[[str], None]): Called with the full text so far.
+        min_interval (float, optional): Seconds between renders, or None to only count deltas.
+            Defaults to 0.05.
+        every_n_tokens (int, optional): Deltas between renders, or None to only count time.
+            Defaults to None. See `ThrottledRenderer`.
+        transform (Callable[[str], str], optional): Applied to the text before each render.
+
+    Returns:
+        str: The full text.
+    """
+    renderer = ThrottledRenderer(
+        render,
+        min_interval=min_interval,
+        every_n_tokens=every_n_tokens,
+        transform=transform,
+    )
+    for delta in deltas:
+        renderer.write(delta)
+    renderer.flush()
+    return renderer.text
@@ -1,35 +1,132 @@
-from typing import Iterable
-from capabilities.helpers.llm import ask_gpt
+from typing import (
+    AsyncIterator,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Tuple,
+)
+from itertools import accumulate
+from capabilities.helpers.concurrency import (
+    ordered_fan_out,
+    ordered_fan_out_async,
+)
+from capabilities.helpers.llm import (
+    ask_gpt,
+    ask_gpt_stream,
+    ask_gpt_stream_async,
+)
+from capabilities.helpers.tracing import span, traced_astream, traced_stream
+import datetime
 import re
+import yaml
 
 NEXT_PATTERN = [r"\n\n§", r"\n\n\([a-h]\)", r"\n\n\(\d+\)", r"\n\n\([A-Z]\)"]
+COMPILED_PATTERNS = [re.compile(pattern) for pattern in NEXT_PATTERN]
+SECTION_NUMBER = re.compile(r"\s*([\w.-]*\w)")
+# Words and punctuation marks, used to compare texts and to estimate token counts without tiktoken.
+WORD_PATTERN = re.compile(r"\w+|[^\w\s]")
+# The fraction of a block's word sequences found in a block of the previous window at which it
+# is taken to be a repeat from the overlap.
+DUPLICATE_THRESHOLD = 0.8
 
-def section_header_split(text:str, pattern = r"\n\n§", splits = []) -> Iterable[str]:
-    idx = NEXT_PATTERN.index(pattern)
-    if len(text.split(' ')) < 5:
-        return splits
 
-    if len(text.split(' ')) < 500 or idx == len(NEXT_PATTERN) - 1:
-        splits.append(text)
+class Section(NamedTuple):
+    """A chunk of legislation, with the headers of the sections it sits in, e.g. ("§ 32", "(b)", "(1)")."""
 
-    else:
-        for s in re.split(pattern, text):
-            splits = section_header_split(s, pattern = NEXT_PATTERN[idx + 1], splits = splits)
+    text: str
+    path: Tuple[str, ...]
 
-    return splits
+    @property
+    def reference(self) -> str:
+        """The section path as a citation, e.g. "§ 32(b)(1)"."""
+        return "".join(self.path)
 
 
-def llm_split(text:str) -> Iterable[str]:
-    """Sometimes we need to partition the data into smaller chunks to keep results useful. We'll ask GPT-3.5-turbo
-    to do this for us.
+def _subsections(text: str, level: int, path: Tuple[str, ...]):
+    """Lazily split text on the header pattern for a level, labelling each piece with its header."""
+    start, label = 0, None
+    for match in COMPILED_PATTERNS[level].finditer(text):
+        yield text[start : match.start()], level + 1, _with(path, label)
+        start = match.end()
+        label = match.group()[2:]
+        if level == 0:
+            number = SECTION_NUMBER.match(text, start)
+            label += " " + number.group(1) if number else ""
+    yield text[start:], level + 1, _with(path, label)
+
+
+def _with(path: Tuple[str, ...], label: str) -> Tuple[str, ...]:
+    return path + (label,) if label else path
+
+
+def iter_sections(
+    text: str, min_words: int = 5, max_words: int = 500, level: int = 0
+) -> Iterator[Section]:
+    """Split legislation on its § / (a) / (1) / (A) headers, yielding sections lazily.
+
+    Text is only split at the next level down if it is at least `max_words` long, and pieces
+    under `min_words` are dropped. The hierarchy is walked iteratively, each piece's words are
+    counted once, and pieces are only cut from their parent as they are needed.
 
     Args:
-        value (str): The data to partition.
+        text (str): The text to split.
+        min_words (int, optional): Pieces shorter than this are dropped. Defaults to 5.
+        max_words (int, optional): Pieces at least this long are split further. Defaults to 500.
+        level (int, optional): The index in NEXT_PATTERN to start splitting at. Defaults to 0.
 
     Returns:
-        Iterable[str]: The partitioned data.
+        Iterator[Section]: The sections, in document order.
     """
-    PROMPT = """
+    stack = [iter([(text, level, ())])]
+    while stack:
+        piece = next(stack[-1], None)
+        if piece is None:
+            stack.pop()
+            continue
+        piece_text, piece_level, path = piece
+        n_words = piece_text.count(" ") + 1
+        if n_words < min_words:
+            continue
+        if n_words < max_words or piece_level == len(NEXT_PATTERN) - 1:
+            yield Section(piece_text, path)
+        else:
+            stack.append(_subsections(piece_text, piece_level, path))
+
+
+def shingles(text: str, n: int = 3) -> set:
+    """Return the set of n-word sequences in text, ignoring case and spacing."""
+    words = WORD_PATTERN.findall(text.lower())
+    return {tuple(words[i : i + n]) for i in range(max(1, len(words) - n + 1))}
+
+
+def overlap(a: set, b: set) -> float:
+    """The fraction of the smaller of two sets of shingles found in the other."""
+    return len(a & b) / max(1, min(len(a), len(b)))
+
+
+def section_header_split(text: str, pattern=r"\n\n§") -> Iterable[str]:
+    """Split legislation on its section headers. See `iter_sections`.
+
+    Args:
+        text (str): The text to split.
+        pattern (str, optional): The header pattern (from NEXT_PATTERN) to start splitting at.
+
+    Returns:
+        Iterable[str]: The chunks.
+    """
+    for section in iter_sections(text, level=NEXT_PATTERN.index(pattern)):
+        yield section.text
+
+
+LLM_SPLIT_MODEL = "gpt-3.5-turbo"
+# Texts longer than this are cut into windows which are sent concurrently.
+WINDOW_WORDS = 1_000
+WINDOW_OVERLAP_WORDS = 50
+MAX_CONCURRENCY = 4
+
+LLM_SPLIT_PROMPT = """
 The user has a relevant copy-pasted text from a source. You should preprocess it into small chunks (30-50 words) of information
 
 * Start each section with a YAML metadata entry with the title and URL of the source if applicable.
@@ -42,6 +139,10 @@ Example:
 ```yaml
 title: "Income Tax Act 2007 s. 1"
 url: "https://www.legislation.gov.uk/ukpga/2007/3/part/2/section/1"
+jurisdiction: "uk" # A country code, or country and state (e.g. "us-ca"), if known.
+act: "Income Tax Act 2007"
+section: "1"
+effective_date: "2007-04-06" # If stated.
 ```
 1. Income tax is charged for each tax year.
 (a) Income tax is charged on the total income of the tax year.
@@ -49,14 +150,332 @@ url: "https://www.legislation.gov.uk/ukpga/2007/3/part/2/section/1"
 ```yaml
 title: "Income Tax Act 2007 s. 2-3" # Group sections together if they're in a similar context.
 url: "https://www.legislation.gov.uk/ukpga/2007/3/part/2/section/2"
+jurisdiction: "uk"
+act: "Income Tax Act 2007"
+section: "2-3"
 ```
 2. ...
 ```
 
 Content below. Return the standardised version.
 """
-    partitioned_data = ask_gpt(
-        prompt=PROMPT + "\n\n" + text,
-        model="gpt-3.5-turbo",
+
+# The fields read from chunk headers. Knowledge bases can be filtered on any of them.
+METADATA_FIELDS = (
+    "jurisdiction",
+    "act",
+    "section",
+    "effective_date",
+    "title",
+    "url",
+)
+YAML_HEADER = re.compile(r"\A\s*```ya?ml[^\n]*\n(.*?)\n```", re.DOTALL)
+TITLE_PATTERN = re.compile(
+    r"^(?P<act>.+?)\s+(?:ss?\.|§+|sections?)\s*(?P<section>\S.*)$",
+    re.IGNORECASE,
+)
+
+
+def window_split(
+    text: str,
+    max_words: int = WINDOW_WORDS,
+    overlap_words: int = WINDOW_OVERLAP_WORDS,
+) -> List[str]:
+    """Cut text into windows of at most `max_words`, at paragraph boundaries, preferring to end a
+    window before a § header. Consecutive windows share up to `overlap_words` of paragraphs, so
+    nothing loses its context at a cut.
+
+    Args:
+        text (str): The text to cut.
+        max_words (int, optional): The maximum window size. Defaults to WINDOW_WORDS.
+        overlap_words (int, optional): The maximum overlap. Defaults to WINDOW_OVERLAP_WORDS.
+
+    Returns:
+        List[str]: The windows.
+    """
+    paragraphs = []
+    for paragraph in text.split("\n\n"):
+        if not paragraph.strip():
+            continue
+        words = paragraph.split(" ")
+        # Paragraphs longer than a window are cut between words.
+        for start in range(0, len(words), max_words):
+            paragraphs.append(" ".join(words[start : start + max_words]))
+    counts = [paragraph.count(" ") + 1 for paragraph in paragraphs]
+    totals = list(accumulate(counts, initial=0))
+
+    windows = []
+    start = 0
+    while start < len(paragraphs):
+        end = start + 1
+        while (
+            end < len(paragraphs)
+            and totals[end + 1] - totals[start] <= max_words
+        ):
+            end += 1
+        if end < len(paragraphs):
+            for cut in range(end - 1, start, -1):
+                if totals[cut] - totals[start] < max_words // 2:
+                    break
+                if paragraphs[cut].startswith("§"):
+                    end = cut
+                    break
+        windows.append("\n\n".join(paragraphs[start:end]))
+        if end == len(paragraphs):
+            break
+        next_start = end
+        while (
+            next_start - 1 > start
+            and totals[end] - totals[next_start - 1] <= overlap_words
+        ):
+            next_start -= 1
+        start = next_start
+    return windows
+
+
+class BlockSplitter:
+    """Split streamed text into blocks separated by blank lines, without splitting inside a ```
+    fence, and keeping a YAML metadata block together with the block it describes.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self._search_from = 0
+
+    def feed(self, delta: str) -> List[str]:
+        """Add text, returning any blocks which are now complete."""
+        self.buffer += delta
+        blocks = []
+        while True:
+            position = self.buffer.find("\n\n", self._search_from)
+            if position == -1:
+                break
+            block = self.buffer[:position]
+            stripped = block.strip()
+            if block.count("```") % 2 or (
+                stripped.startswith("```yaml") and stripped.endswith("```")
+            ):
+                self._search_from = position + 2
+                continue
+            self.buffer = self.buffer[position + 2 :]
+            self._search_from = 0
+            if stripped:
+                blocks.append(block.strip("\n"))
+        return blocks
+
+    def close(self) -> List[str]:
+        """Return the last block."""
+        block, self.buffer, self._search_from = self.buffer.strip("\n"), "", 0
+        return [block] if block.strip() else []
+
+
+def split_blocks(text: str) -> List[str]:
+    """Split text into blocks. See `BlockSplitter`."""
+    splitter = BlockSplitter()
+    return splitter.feed(text) + splitter.close()
+
+
+def stream_blocks(
+    prompt: str,
+    text: str,
+    model: str = LLM_SPLIT_MODEL,
+    max_words: int = WINDOW_WORDS,
+    overlap_words: int = WINDOW_OVERLAP_WORDS,
+    max_concurrency: int = MAX_CONCURRENCY,
+) -> Iterator[str]:
+    """Send `prompt` followed by each window of `text` concurrently, yielding the output blocks in
+    order as they complete. Blocks repeated from the previous window (because the windows
+    overlap) are dropped.
+
+    Args:
+        prompt (str): The instructions, which the text is appended to.
+        text (str): The text to process.
+        model (str, optional): The model to use. Defaults to LLM_SPLIT_MODEL.
+        max_words (int, optional): The maximum window size. Defaults to WINDOW_WORDS.
+        overlap_words (int, optional): The maximum overlap. Defaults to WINDOW_OVERLAP_WORDS.
+        max_concurrency (int, optional): The number of windows sent at once. Defaults to MAX_CONCURRENCY.
+
+    Returns:
+        Iterator[str]: The output blocks.
+    """
+    windows = window_split(text, max_words, overlap_words)
+    tasks = [
+        lambda window=window: ask_gpt_stream(
+            prompt + "\n\n" + window, model=model, deltas=True
+        )
+        for window in windows
+    ]
+    yield from traced_stream(
+        "stream_blocks",
+        _stream_window_blocks(tasks, max_concurrency),
+        first="first_block",
+        count="blocks",
+        windows=len(windows),
     )
-    return partitioned_data.split("\n\n")
+
+
+def _stream_window_blocks(tasks, max_concurrency: int) -> Iterator[str]:
+    blocks = _WindowBlocks()
+    for i, delta in ordered_fan_out(tasks, max_concurrency=max_concurrency):
+        yield from blocks.feed(i, delta)
+    yield from blocks.close()
+
+
+async def stream_blocks_async(
+    prompt: str,
+    text: str,
+    model: str = LLM_SPLIT_MODEL,
+    max_words: int = WINDOW_WORDS,
+    overlap_words: int = WINDOW_OVERLAP_WORDS,
+    max_concurrency: int = MAX_CONCURRENCY,
+) -> AsyncIterator[str]:
+    """Async version of `stream_blocks`."""
+    windows = window_split(text, max_words, overlap_words)
+    tasks = [
+        lambda window=window: ask_gpt_stream_async(
+            prompt + "\n\n" + window, model=model, deltas=True
+        )
+        for window in windows
+    ]
+    async for block in traced_astream(
+        "stream_blocks",
+        _stream_window_blocks_async(tasks, max_concurrency),
+        first="first_block",
+        count="blocks",
+        windows=len(windows),
+    ):
+        yield block
+
+
+async def _stream_window_blocks_async(
+    tasks, max_concurrency: int
+) -> AsyncIterator[str]:
+    blocks = _WindowBlocks()
+    async for i, delta in ordered_fan_out_async(
+        tasks, max_concurrency=max_concurrency
+    ):
+        for block in blocks.feed(i, delta):
+            yield block
+    for block in blocks.close():
+        yield block
+
+
+class _WindowBlocks:
+    """Split the ordered deltas of each window's output into blocks, dropping blocks repeated
+    from the previous window. The model rarely renders the overlap identically twice, so a block
+    is a repeat if most of its word sequences appear in one block of the previous window.
+    """
+
+    def __init__(self, duplicate_threshold: float = DUPLICATE_THRESHOLD):
+        self.duplicate_threshold = duplicate_threshold
+        self.splitter = BlockSplitter()
+        self.window_index = 0
+        self.previous, self.current = [], []
+
+    def feed(self, i: int, delta: str) -> Iterator[str]:
+        if i != self.window_index:
+            yield from self._emit(self.splitter.close())
+            # Windows skipped over produced nothing, so there is nothing to repeat from them.
+            self.previous = self.current if i == self.window_index + 1 else []
+            self.current = []
+            self.window_index = i
+        yield from self._emit(self.splitter.feed(delta))
+
+    def close(self) -> Iterator[str]:
+        yield from self._emit(self.splitter.close())
+
+    def _emit(self, blocks: Iterable[str]) -> Iterator[str]:
+        for block in blocks:
+            block_shingles = shingles(block)
+            if not any(
+                overlap(block_shingles, other) >= self.duplicate_threshold
+                for other in self.previous
+            ):
+                self.current.append(block_shingles)
+                yield block
+
+
+def llm_split(text: str, max_words: int = WINDOW_WORDS) -> Iterable[str]:
+    """Sometimes we need to partition the data into smaller chunks to keep results useful. We'll ask GPT-3.5-turbo
+    to do this for us. Long texts are cut into overlapping windows which are processed concurrently.
+
+    Args:
+        text (str): The data to partition.
+        max_words (int, optional): Texts longer than this are cut into windows. Defaults to WINDOW_WORDS.
+
+    Returns:
+        Iterable[str]: The partitioned data.
+    """
+    words = text.count(" ") + 1
+    with span("llm_split", words=words) as s:
+        if words > max_words:
+            chunks = list(
+                stream_blocks(LLM_SPLIT_PROMPT, text, max_words=max_words)
+            )
+        else:
+            partitioned_data = ask_gpt(
+                prompt=LLM_SPLIT_PROMPT + "\n\n" + text,
+                model=LLM_SPLIT_MODEL,
+            )
+            chunks = split_blocks(partitioned_data)
+        s.set(chunks=len(chunks))
+    return chunks
+
+
+def parse_metadata(chunk: str) -> Dict[str, str]:
+    """Read the YAML header at the start of a chunk from `llm_split`.
+
+    The act and section are taken from the title (e.g. "Income Tax Act 2007 s. 1") if they
+    aren't given, and jurisdictions are lowercased.
+
+    Args:
+        chunk (str): The chunk.
+
+    Returns:
+        Dict[str, str]: The METADATA_FIELDS found, or an empty dict if there is no valid header.
+    """
+    match = YAML_HEADER.match(chunk)
+    if match is None:
+        return {}
+    try:
+        header = yaml.safe_load(match.group(1))
+    except yaml.YAMLError:
+        return {}
+    if not isinstance(header, dict):
+        return {}
+    metadata = {}
+    for field in METADATA_FIELDS:
+        value = header.get(field)
+        if isinstance(value, (datetime.date, datetime.datetime)):
+            value = value.isoformat()
+        if value is not None and str(value).strip():
+            metadata[field] = str(value).strip()
+    title = TITLE_PATTERN.match(metadata.get("title", ""))
+    if title is not None:
+        metadata.setdefault("act", title.group("act"))
+        metadata.setdefault("section", title.group("section"))
+    if "jurisdiction" in metadata:
+        metadata["jurisdiction"] = metadata["jurisdiction"].lower()
+    return metadata
+
+
+def with_metadata(
+    chunks: Iterable[str], metadata: Dict[str, str] = None
+) -> Iterator[Tuple[str, Dict[str, str]]]:
+    """Pair each chunk of a document with its metadata. A chunk's YAML header applies to it and
+    to the chunks after it without one, on top of the document's own metadata.
+
+    Args:
+        chunks (Iterable[str]): The chunks, in document order.
+        metadata (Dict[str, str], optional): Metadata for the whole document.
+
+    Returns:
+        Iterator[Tuple[str, Dict[str, str]]]: (chunk, metadata) pairs.
+    """
+    document = dict(metadata or {})
+    current = document
+    for chunk in chunks:
+        header = parse_metadata(chunk)
+        if header:
+            current = {**document, **header}
+        yield chunk, current
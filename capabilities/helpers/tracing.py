@@ -0,0 +1,410 @@
+from bisect import bisect_left
+from time import perf_counter
+from typing import (
+    AsyncIterable,
+    AsyncIterator,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+import json
+import logging
+import math
+import os
+import re
+import threading
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+TRACING_ENV_VAR = "POLICYENGINE_AI_TRACING"
+
+# Prometheus-style bucket upper bounds for timings (in seconds) and for counts.
+TIME_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1_000, 2_000, 5_000)
+
+
+class Span:
+    """A timed stage of a request, with attributes such as token or chunk counts. Used as a
+    context manager, it is sent to every sink when it ends.
+
+    Args:
+        name (str): The stage, e.g. "ask_gpt".
+        attributes (dict, optional): Attributes known at the start, e.g. the model.
+    """
+
+    __slots__ = ("name", "attributes", "start", "duration")
+    recording = True
+
+    def __init__(self, name: str, attributes: Optional[dict] = None):
+        self.name = name
+        self.attributes = attributes if attributes is not None else {}
+        self.start = None
+        self.duration = None
+
+    def __enter__(self) -> "Span":
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.duration = perf_counter() - self.start
+        if exc_type is not None:
+            if issubclass(exc_type, Exception):
+                self.attributes["error"] = exc_type.__name__
+            else:
+                # GeneratorExit or CancelledError: a stream that was closed early.
+                self.attributes["abandoned"] = True
+        for sink in _sinks:
+            sink.emit(self)
+
+    def set(self, **attributes):
+        """Set attributes, e.g. `span.set(chunks=12)`."""
+        self.attributes.update(attributes)
+
+    def mark(self, event: str):
+        """Record the time since the span started as the `<event>_seconds` attribute."""
+        self.attributes[f"{event}_seconds"] = perf_counter() - self.start
+
+    def to_dict(self) -> dict:
+        return dict(
+            span=self.name, duration_seconds=self.duration, **self.attributes
+        )
+
+
+class _NullSpan:
+    """The span used while tracing is off, which records nothing."""
+
+    __slots__ = ()
+    recording = False
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        pass
+
+    def set(self, **attributes):
+        pass
+
+    def mark(self, event: str):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+def span(name: str, **attributes):
+    """Time a stage of a request, if tracing is on.
+
+    Attributes which are costly to compute should only be set if `span.recording` is True.
+
+    Args:
+        name (str): The stage, e.g. "embed".
+        **attributes: Attributes known at the start.
+
+    Returns:
+        Span: A context manager yielding the span, or a span which records nothing.
+    """
+    if not _sinks:
+        return NULL_SPAN
+    return Span(name, attributes)
+
+
+def traced_stream(
+    name: str,
+    items: Iterable[T],
+    first: str = "first_item",
+    count: str = "items",
+    **attributes,
+) -> Iterable[T]:
+    """Time a stream from when it is first read until it ends or is abandoned, recording the time
+    to the first item and the number of items. If tracing is off, the stream is returned as is.
+
+    Args:
+        name (str): The stage, e.g. "ask_gpt_stream".
+        items (Iterable[T]): The stream.
+        first (str, optional): The event name for the first item. Defaults to "first_item".
+        count (str, optional): The attribute name for the item count. Defaults to "items".
+        **attributes: Other attributes.
+
+    Returns:
+        Iterable[T]: The same items.
+    """
+    if not _sinks:
+        return items
+    return _traced_stream(Span(name, attributes), items, first, count)
+
+
+def _traced_stream(
+    span: Span, items: Iterable[T], first: str, count: str
+) -> Iterator[T]:
+    with span:
+        n = 0
+        try:
+            for item in items:
+                if not n:
+                    span.mark(first)
+                n += 1
+                yield item
+        finally:
+            span.attributes[count] = n
+
+
+def traced_astream(
+    name: str,
+    items: AsyncIterable[T],
+    first: str = "first_item",
+    count: str = "items",
+    **attributes,
+) -> AsyncIterable[T]:
+    """Async version of `traced_stream`."""
+    if not _sinks:
+        return items
+    return _traced_astream(Span(name, attributes), items, first, count)
+
+
+async def _traced_astream(
+    span: Span, items: AsyncIterable[T], first: str, count: str
+) -> AsyncIterator[T]:
+    with span:
+        n = 0
+        try:
+            async for item in items:
+                if not n:
+                    span.mark(first)
+                n += 1
+                yield item
+        finally:
+            span.attributes[count] = n
+
+
+class JSONLogSink:
+    """Log each span as a line of JSON.
+
+    Args:
+        logger (logging.Logger, optional): The logger. Defaults to "capabilities.tracing".
+        level (int, optional): The level to log at. Defaults to INFO.
+    """
+
+    def __init__(
+        self,
+        logger: Optional[logging.Logger] = None,
+        level: int = logging.INFO,
+    ):
+        self.logger = logger or logging.getLogger(__name__)
+        self.level = level
+
+    def emit(self, span: Span):
+        if self.logger.isEnabledFor(self.level):
+            self.logger.log(
+                self.level, json.dumps(span.to_dict(), default=str)
+            )
+
+
+class Histogram:
+    """Counts of observations in cumulative buckets, as in Prometheus.
+
+    Args:
+        buckets (Tuple[float, ...]): The bucket upper bounds, in increasing order.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        # The last count is for observations above every bound.
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile by interpolating within its bucket, as Prometheus'
+        histogram_quantile does.
+
+        Args:
+            q (float): The quantile, between 0 and 1.
+
+        Returns:
+            float: The estimate, or NaN if nothing has been observed.
+        """
+        if not self.count:
+            return math.nan
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+
+class HistogramRegistry:
+    """Histograms of each span's duration and numeric attributes, by span name, which can be
+    exported in the Prometheus text format. Attributes ending in "_seconds" get TIME_BUCKETS,
+    others COUNT_BUCKETS.
+
+    Args:
+        prefix (str, optional): The metric name prefix. Defaults to "policyengine_ai".
+    """
+
+    def __init__(self, prefix: str = "policyengine_ai"):
+        self.prefix = prefix
+        # (metric, span name) -> histogram
+        self.histograms: Dict[Tuple[str, str], Histogram] = {}
+        self._lock = threading.Lock()
+
+    def emit(self, span: Span):
+        with self._lock:
+            self._observe("duration_seconds", span.name, span.duration)
+            for key, value in span.attributes.items():
+                if isinstance(value, (int, float)) and not isinstance(
+                    value, bool
+                ):
+                    self._observe(key, span.name, value)
+
+    def _observe(self, metric: str, span_name: str, value: float):
+        histogram = self.histograms.get((metric, span_name))
+        if histogram is None:
+            histogram = self.histograms[(metric, span_name)] = Histogram(
+                TIME_BUCKETS if metric.endswith("_seconds") else COUNT_BUCKETS
+            )
+        histogram.observe(value)
+
+    def histogram(
+        self, span_name: str, metric: str = "duration_seconds"
+    ) -> Optional[Histogram]:
+        """Return the histogram of a span's metric, if any have been observed."""
+        return self.histograms.get((metric, span_name))
+
+    def summary(self) -> Dict[str, Dict[str, dict]]:
+        """Return the count, mean, p50 and p95 of every metric, by span name."""
+        with self._lock:
+            summary = {}
+            for (metric, span_name), histogram in sorted(
+                self.histograms.items(), key=lambda item: item[0][::-1]
+            ):
+                summary.setdefault(span_name, {})[metric] = dict(
+                    count=histogram.count,
+                    mean=histogram.sum / histogram.count,
+                    p50=histogram.quantile(0.5),
+                    p95=histogram.quantile(0.95),
+                )
+            return summary
+
+    def prometheus(self) -> str:
+        """Export every histogram in the Prometheus text format.
+
+        Returns:
+            str: One histogram metric family per attribute, labelled by span name.
+        """
+        lines = []
+        with self._lock:
+            metrics = sorted({metric for metric, _ in self.histograms})
+            for metric in metrics:
+                name = f"{self.prefix}_{re.sub(r'[^a-zA-Z0-9_]', '_', metric)}"
+                lines.append(f"# TYPE {name} histogram")
+                for (m, span_name), histogram in sorted(
+                    self.histograms.items()
+                ):
+                    if m != metric:
+                        continue
+                    label = f'span="{span_name}"'
+                    cumulative = 0
+                    for bound, n in zip(
+                        histogram.buckets + (math.inf,), histogram.counts
+                    ):
+                        cumulative += n
+                        le = "+Inf" if bound == math.inf else f"{bound:g}"
+                        lines.append(
+                            f'{name}_bucket{{{label},le="{le}"}} {cumulative}'
+                        )
+                    lines.append(f"{name}_sum{{{label}}} {histogram.sum:g}")
+                    lines.append(f"{name}_count{{{label}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+def _sinks_from_environment() -> List:
+    sinks = []
+    for name in os.environ.get(TRACING_ENV_VAR, "").split(","):
+        name = name.strip()
+        if name == "log":
+            sinks.append(JSONLogSink())
+        elif name == "metrics":
+            sinks.append(HistogramRegistry())
+        elif name:
+            # A typo in the environment shouldn't stop the app from starting.
+            logger.warning(
+                "Ignoring unknown tracing sink %r in %s, expected 'log' or "
+                "'metrics'.",
+                name,
+                TRACING_ENV_VAR,
+            )
+    return sinks
+
+
+# Read at import, so checking whether tracing is on costs one global lookup.
+_sinks = _sinks_from_environment()
+
+
+def tracing_enabled() -> bool:
+    """Return whether spans are recorded, i.e. there are any sinks."""
+    return bool(_sinks)
+
+
+def get_sinks() -> List:
+    """Return the sinks spans are sent to.
+
+    Unless `set_sinks` has been called, these are chosen by the POLICYENGINE_AI_TRACING
+    environment variable, a comma-separated list of "log" (a JSONLogSink) and "metrics" (a
+    HistogramRegistry). Tracing is off if there are none.
+
+    Returns:
+        List: The sinks, each with an `emit(span)` method.
+    """
+    return list(_sinks)
+
+
+def set_sinks(sinks: Iterable):
+    """Set the sinks spans are sent to. An empty list turns tracing off.
+
+    Args:
+        sinks (Iterable): Objects with an `emit(span)` method.
+    """
+    global _sinks
+    _sinks = list(sinks)
+
+
+def get_registry() -> Optional[HistogramRegistry]:
+    """Return the first HistogramRegistry sink, if there is one."""
+    for sink in _sinks:
+        if isinstance(sink, HistogramRegistry):
+            return sink
+    return None
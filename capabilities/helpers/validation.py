@@ -0,0 +1,344 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import (
+    AsyncIterable,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+import ast
+import re
+import yaml
+
+from capabilities.helpers.llm import ask_gpt_stream
+from capabilities.helpers.tracing import span
+
+# Attempts to regenerate each broken file, and the number regenerated at once.
+MAX_RETRIES = 2
+MAX_CONCURRENCY = 4
+
+FENCE_PATTERN = re.compile(r"^\s*```\s*([\w+-]*)\s*$")
+FILE_PATH_PATTERN = re.compile(r"[\w./-]+\.(?:ya?ml|py)\b")
+LANGUAGES = {
+    "yaml": "yaml",
+    "yml": "yaml",
+    "python": "python",
+    "py": "python",
+}
+EXTENSIONS = {"yaml": "yaml", "python": "py"}
+
+REPAIR_PROMPT = """
+
+You wrote {path} as below, but it is invalid: {error}
+
+```{language}
+{content}
+```
+
+Write {path} again, fixing the error. Return just its contents in a single code block, with no filename or commentary.
+"""
+
+
+class FileBlock(NamedTuple):
+    """A fenced code block in generated output, with the file path written before it."""
+
+    path: Optional[str]
+    language: Optional[str]
+    content: str
+    index: int
+
+    @property
+    def name(self) -> str:
+        """The path, or a placeholder name for blocks without one."""
+        if self.path:
+            return self.path
+        return f"file_{self.index}.{EXTENSIONS.get(self.language, 'txt')}"
+
+
+class FileBlockParser:
+    """Split streamed output into fenced code blocks as each one closes. The last file path
+    mentioned outside a block (e.g. "parameters/gov/tax/rate.yaml") names the next block.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._partial = ""
+        self._language = None
+        self._in_block = False
+        self._lines: List[str] = []
+        self._path = None
+        self._next_path = None
+
+    def feed(self, delta: str) -> List[FileBlock]:
+        """Add a delta, returning the blocks it closes."""
+        self._partial += delta
+        if "\n" not in delta:
+            return []
+        *lines, self._partial = self._partial.split("\n")
+        return [block for block in map(self._line, lines) if block is not None]
+
+    def close(self) -> List[FileBlock]:
+        """Return the remaining blocks, including a block still open when the output ended."""
+        blocks = self.feed("\n") if self._partial else []
+        if self._in_block:
+            blocks.append(self._end_block())
+        return blocks
+
+    def _line(self, line: str) -> Optional[FileBlock]:
+        if self._in_block:
+            if line.lstrip().startswith("```"):
+                return self._end_block()
+            self._lines.append(line)
+            return None
+        fence = FENCE_PATTERN.match(line)
+        if fence is None:
+            paths = FILE_PATH_PATTERN.findall(line)
+            if paths:
+                self._next_path = paths[-1]
+            return None
+        self._in_block = True
+        self._path, self._next_path = self._next_path, None
+        self._language = LANGUAGES.get(fence.group(1).lower())
+        if self._language is None and self._path:
+            self._language = LANGUAGES.get(self._path.rsplit(".", 1)[-1])
+        return None
+
+    def _end_block(self) -> FileBlock:
+        block = FileBlock(
+            self._path, self._language, "\n".join(self._lines), self.count
+        )
+        self.count += 1
+        self._in_block = False
+        self._lines = []
+        return block
+
+
+def check_block(block: FileBlock) -> Optional[str]:
+    """Check that a block parses: YAML files must load as a mapping, and Python files must be
+    valid syntax. Other blocks aren't checked.
+
+    Args:
+        block (FileBlock): The block.
+
+    Returns:
+        Optional[str]: A description of the error, or None if the block is valid.
+    """
+    if block.language == "yaml":
+        try:
+            loaded = yaml.safe_load(block.content)
+        except yaml.YAMLError as e:
+            mark = getattr(e, "problem_mark", None)
+            where = f" (line {mark.line + 1})" if mark is not None else ""
+            problem = getattr(e, "problem", None) or str(e)
+            return f"YAML error: {problem}{where}"
+        if not isinstance(loaded, dict):
+            return "YAML error: expected a mapping of keys to values"
+    elif block.language == "python":
+        try:
+            ast.parse(block.content, filename=block.name)
+        except SyntaxError as e:
+            return f"SyntaxError: {e.msg} (line {e.lineno})"
+    return None
+
+
+def until_first_block(deltas: Iterable[str]) -> Iterator[str]:
+    """Pass deltas through until the first code block closes, then stop reading, which cancels
+    the request rather than paying for any commentary after the block.
+
+    Args:
+        deltas (Iterable[str]): The new text in each update.
+
+    Returns:
+        Iterator[str]: The deltas up to the end of the first block.
+    """
+    parser = FileBlockParser()
+    for delta in deltas:
+        yield delta
+        if parser.feed(delta):
+            return
+
+
+async def until_first_block_async(
+    deltas: AsyncIterable[str],
+) -> AsyncIterator[str]:
+    """Async version of `until_first_block`."""
+    parser = FileBlockParser()
+    async for delta in deltas:
+        yield delta
+        if parser.feed(delta):
+            return
+
+
+class ValidatedFiles(NamedTuple):
+    """Generated files, by path, in the order they were written."""
+
+    files: Dict[str, str]
+    # Files still invalid after every retry, and their errors.
+    errors: Dict[str, str]
+    # Files which were regenerated, whether or not they are now valid.
+    regenerated: List[str]
+
+
+class StreamValidator:
+    """Check each file in streamed output as soon as its block closes, and regenerate broken
+    files in the background while the rest of the output streams, so only they are rewritten.
+
+    Args:
+        prompt (str): The prompt the output answers, which repair prompts extend.
+        model (str): The model to regenerate files with.
+        max_retries (int, optional): Attempts to regenerate each broken file. Defaults to
+            MAX_RETRIES.
+        max_concurrency (int, optional): The number of files regenerated at once. Defaults to
+            MAX_CONCURRENCY.
+        regenerate (Callable[[str], Iterable[str]], optional): Streams the deltas of the response
+            to a repair prompt. Defaults to `ask_gpt_stream` with the model.
+    """
+
+    def __init__(
+        self,
+        prompt: str,
+        model: str,
+        max_retries: int = MAX_RETRIES,
+        max_concurrency: int = MAX_CONCURRENCY,
+        regenerate: Optional[Callable[[str], Iterable[str]]] = None,
+    ):
+        self.prompt = prompt
+        self.model = model
+        self.max_retries = max_retries
+        self.max_concurrency = max_concurrency
+        self.regenerate = regenerate or (
+            lambda prompt: ask_gpt_stream(prompt, model=model, deltas=True)
+        )
+        self.parser = FileBlockParser()
+        self.blocks: Dict[str, FileBlock] = {}
+        self._errors: Dict[str, str] = {}
+        self._repairs: Dict[str, Future] = {}
+        self._pool = None
+        # Set by `watch` once the deltas end.
+        self.result: Optional[ValidatedFiles] = None
+
+    def feed(self, delta: str):
+        """Add a delta, checking any blocks it closes."""
+        for block in self.parser.feed(delta):
+            self._check(block)
+
+    def close(self) -> ValidatedFiles:
+        """Check the last block, and wait for any files being regenerated.
+
+        Returns:
+            ValidatedFiles: Every file, with the errors of those still invalid.
+        """
+        for block in self.parser.close():
+            self._check(block)
+        files, errors = {}, {}
+        for name, block in self.blocks.items():
+            if name in self._repairs:
+                content, error = self._repairs[name].result()
+            else:
+                content, error = block.content, self._errors.get(name)
+            files[name] = content
+            if error is not None:
+                errors[name] = error
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        return ValidatedFiles(files, errors, list(self._repairs))
+
+    def watch(self, deltas: Iterable[str]) -> Iterator[str]:
+        """Pass deltas through while checking them. Once they end, the regenerated files are
+        appended, each after its path.
+
+        Args:
+            deltas (Iterable[str]): The new text in each update.
+
+        Returns:
+            Iterator[str]: The deltas, then the regenerated files.
+        """
+        for delta in deltas:
+            self.feed(delta)
+            yield delta
+        self.result = self.close()
+        for name in self.result.regenerated:
+            language = self.blocks[name].language or ""
+            status = (
+                f"still invalid: {self.result.errors[name]}"
+                if name in self.result.errors
+                else "fixed"
+            )
+            yield (
+                f"\n\nRegenerated {name} ({status}):\n{name}\n"
+                f"```{language}\n{self.result.files[name]}\n```\n"
+            )
+
+    def _check(self, block: FileBlock):
+        name = block.name
+        self.blocks[name] = block
+        self._repairs.pop(name, None)
+        self._errors.pop(name, None)
+        error = check_block(block)
+        if error is None:
+            return
+        if self.max_retries <= 0:
+            self._errors[name] = error
+            return
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.max_concurrency)
+        self._repairs[name] = self._pool.submit(self._repair, block, error)
+
+    def _repair(
+        self, block: FileBlock, error: str
+    ) -> Tuple[str, Optional[str]]:
+        content = block.content
+        for attempt in range(self.max_retries):
+            with span("repair_file", language=block.language) as s:
+                prompt = self.prompt + REPAIR_PROMPT.format(
+                    path=block.name,
+                    error=error,
+                    language=block.language or "",
+                    content=content,
+                )
+                parser = FileBlockParser()
+                repaired = []
+                for delta in until_first_block(self.regenerate(prompt)):
+                    repaired.extend(parser.feed(delta))
+                repaired.extend(parser.close())
+                if repaired:
+                    content = repaired[0].content
+                error = check_block(block._replace(content=content))
+                s.set(attempt=attempt + 1, fixed=error is None)
+            if error is None:
+                break
+        return content, error
+
+
+def generate_files(
+    prompt: str,
+    model: str,
+    deltas: Optional[Iterable[str]] = None,
+    max_retries: int = MAX_RETRIES,
+) -> ValidatedFiles:
+    """Generate files from a prompt, checking each as it arrives and regenerating broken ones.
+
+    Args:
+        prompt (str): The prompt.
+        model (str): The model to use.
+        deltas (Iterable[str], optional): The response deltas, if they don't come from sending
+            the prompt as-is (e.g. a pipeline of requests).
+        max_retries (int, optional): Attempts to regenerate each broken file. Defaults to
+            MAX_RETRIES.
+
+    Returns:
+        ValidatedFiles: The files, by path.
+    """
+    validator = StreamValidator(prompt, model, max_retries=max_retries)
+    if deltas is None:
+        deltas = ask_gpt_stream(prompt, model=model, deltas=True)
+    for delta in deltas:
+        validator.feed(delta)
+    return validator.close()
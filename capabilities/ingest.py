@@ -0,0 +1,422 @@
+"""Build a knowledge base offline from a directory of text files or a JSONL file of documents.
+
+Documents are split with `section_header_split`, encoded in large batches by a pool of worker
+processes (each with its own copy of the embedding model), and written to the knowledge base in
+bulk. Progress is checkpointed, so an interrupted run picks up where it left off.
+
+Usage:
+    python -m capabilities.ingest legislation/ --output knowledge
+    python -m capabilities.ingest documents.jsonl --backend chroma --collection laws --chroma-path chroma
+    python -m capabilities.ingest documents.jsonl --backend chroma --shard jurisdiction --chroma-path chroma
+    python -m capabilities.ingest documents.jsonl --output knowledge --shard jurisdiction
+"""
+
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from collections import deque
+from itertools import islice
+import argparse
+import json
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+from capabilities.helpers.knowledge_bases import (
+    CHROMA_PATH_ENV_VAR,
+    KNOWLEDGE_COLLECTION,
+    MODEL_NAME,
+    ChromaKnowledgeBase,
+    KnowledgeBase,
+    NumPyKnowledgeBase,
+    ShardedKnowledgeBase,
+    chroma_shard_factory,
+    chroma_shard_keys,
+    get_embedding_model,
+)
+from capabilities.helpers.quantization import ProductQuantizer, ScalarQuantizer
+from capabilities.helpers.storage import atomic_write
+from capabilities.helpers.text_splitters import (
+    METADATA_FIELDS,
+    section_header_split,
+)
+
+# Chunks sent to a worker at a time.
+TASK_SIZE = 2_048
+# Chunks passed to each call of the model, within a task.
+ENCODE_BATCH_SIZE = 64
+
+_worker_model = None
+_worker_batch_size = ENCODE_BATCH_SIZE
+
+
+def iter_documents(source: str) -> Iterator[Tuple[str, str, Dict[str, str]]]:
+    """Yield (name, text, metadata) for each document in a source, in a stable order.
+
+    Args:
+        source (str): A directory (every non-hidden file beneath it is a document), a JSONL file
+            (one document per line, either a string or an object with a "text" field and
+            optionally "id" and metadata fields such as "jurisdiction"), or a single text file.
+
+    Returns:
+        Iterator[Tuple[str, str, Dict[str, str]]]: The documents.
+    """
+    if os.path.isdir(source):
+        for directory, directories, files in os.walk(source):
+            directories[:] = sorted(
+                d for d in directories if not d.startswith(".")
+            )
+            for name in sorted(files):
+                if name.startswith("."):
+                    continue
+                path = os.path.join(directory, name)
+                with open(path, encoding="utf-8", errors="replace") as f:
+                    yield os.path.relpath(path, source), f.read(), {}
+    elif source.endswith(".jsonl"):
+        with open(source, encoding="utf-8") as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                document = json.loads(line)
+                if isinstance(document, str):
+                    yield f"{source}:{line_number}", document, {}
+                else:
+                    name = document.get("id", f"{source}:{line_number}")
+                    metadata = {
+                        field: str(document[field])
+                        for field in METADATA_FIELDS
+                        if document.get(field) is not None
+                    }
+                    yield str(name), document["text"], metadata
+    else:
+        with open(source, encoding="utf-8", errors="replace") as f:
+            yield source, f.read(), {}
+
+
+def chunk_batches(
+    documents: Iterable[Tuple[str, str, Dict[str, str]]],
+    knowledge: KnowledgeBase,
+    split_fn: Callable[[str], Iterable[str]] = section_header_split,
+    task_size: int = TASK_SIZE,
+) -> Iterator[Tuple[List[str], List[str], List[Dict[str, str]], int]]:
+    """Split documents into batches of new chunks.
+
+    Args:
+        documents (Iterable[Tuple[str, str, Dict[str, str]]]): (name, text, metadata) triples.
+        knowledge (KnowledgeBase): The knowledge base, whose chunks are skipped.
+        split_fn (Callable[[str], Iterable[str]], optional): The splitter. Defaults to
+            section_header_split.
+        task_size (int, optional): The number of chunks per batch. Defaults to TASK_SIZE.
+
+    Returns:
+        Iterator[Tuple[List[str], List[str], List[Dict[str, str]], int]]: (chunks, ids, metadata,
+            documents) for each batch, where `documents` is the number of documents whose chunks
+            are all in this or an earlier batch.
+    """
+    seen = set()
+    values, ids, metadatas = [], [], []
+    completed = 0
+
+    def batch():
+        new_ids = set(knowledge.new_ids(ids))
+        new = [i for i, id in enumerate(ids) if id in new_ids]
+        return (
+            [values[i] for i in new],
+            [ids[i] for i in new],
+            [metadatas[i] for i in new],
+        )
+
+    for _, text, metadata in documents:
+        chunks = knowledge.partition_with_metadata(text, split_fn, metadata)
+        for id, (value, chunk_metadata) in chunks.items():
+            if id in seen:
+                continue
+            seen.add(id)
+            values.append(value)
+            ids.append(id)
+            metadatas.append(chunk_metadata)
+            if len(ids) == task_size:
+                yield (*batch(), completed)
+                values, ids, metadatas = [], [], []
+        completed += 1
+    yield (*batch(), completed)
+
+
+def _init_worker(model_name: str, batch_size: int, threads: int):
+    global _worker_model, _worker_batch_size
+    import torch
+
+    torch.set_num_threads(threads)
+    _worker_model = get_embedding_model(model_name)
+    _worker_batch_size = batch_size
+
+
+def _encode(values: List[str]) -> np.ndarray:
+    return _worker_model.encode(
+        values, batch_size=_worker_batch_size, convert_to_numpy=True
+    )
+
+
+def encode_batches(
+    batches: Iterable[Tuple[List[str], List[str], List[dict], int]],
+    model_name: str = MODEL_NAME,
+    workers: int = 1,
+    batch_size: int = ENCODE_BATCH_SIZE,
+) -> Iterator[Tuple[List[str], List[str], List[dict], int, np.ndarray]]:
+    """Embed batches of chunks in worker processes, yielding them with their embeddings in order.
+
+    Args:
+        batches (Iterable[Tuple[List[str], List[str], List[dict], int]]): Batches from
+            `chunk_batches`.
+        model_name (str, optional): The embedding model. Defaults to MODEL_NAME.
+        workers (int, optional): The number of processes. With 0, chunks are encoded in this
+            process. Defaults to 1.
+        batch_size (int, optional): The model's batch size. Defaults to ENCODE_BATCH_SIZE.
+
+    Returns:
+        Iterator[Tuple[List[str], List[str], List[dict], int, np.ndarray]]: Each batch, with its
+            embeddings.
+    """
+    if not workers:
+        model = get_embedding_model(model_name)
+        for values, *rest in batches:
+            embeddings = model.encode(
+                values, batch_size=batch_size, convert_to_numpy=True
+            )
+            yield values, *rest, embeddings
+        return
+    # Workers are spawned rather than forked, as torch is not fork-safe once initialised.
+    context = multiprocessing.get_context("spawn")
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    with context.Pool(
+        workers,
+        initializer=_init_worker,
+        initargs=(model_name, batch_size, threads),
+    ) as pool:
+        # Keep every worker busy, while bounding the chunks held in memory.
+        pending = deque()
+        for batch in batches:
+            pending.append((batch, pool.apply_async(_encode, (batch[0],))))
+            if len(pending) >= 2 * workers:
+                batch, result = pending.popleft()
+                yield *batch, result.get()
+        while pending:
+            batch, result = pending.popleft()
+            yield *batch, result.get()
+
+
+def read_checkpoint(path: str, source: str) -> dict:
+    """Return the progress saved for a source, or zero progress if there is no checkpoint for it."""
+    checkpoint = dict(source=os.path.abspath(source), documents=0, chunks=0)
+    if path and os.path.exists(path):
+        with open(path) as f:
+            saved = json.load(f)
+        if saved.get("source") == checkpoint["source"]:
+            checkpoint.update(saved)
+    return checkpoint
+
+
+def write_checkpoint(path: str, checkpoint: dict):
+    with atomic_write(path) as f:
+        f.write(json.dumps(checkpoint).encode())
+
+
+def ingest(
+    source: str,
+    knowledge: KnowledgeBase,
+    split_fn: Callable[[str], Iterable[str]] = section_header_split,
+    workers: int = 1,
+    task_size: int = TASK_SIZE,
+    batch_size: int = ENCODE_BATCH_SIZE,
+    checkpoint_path: Optional[str] = None,
+    checkpoint_interval: float = 60.0,
+    save: Optional[Callable[[], None]] = None,
+    report: Optional[Callable[[dict], None]] = None,
+    report_interval: float = 5.0,
+) -> dict:
+    """Add every document in a source to a knowledge base.
+
+    Args:
+        source (str): The documents. See `iter_documents`.
+        knowledge (KnowledgeBase): The knowledge base to add to.
+        split_fn (Callable[[str], Iterable[str]], optional): The splitter. Defaults to
+            section_header_split.
+        workers (int, optional): The number of encoding processes. Defaults to 1.
+        task_size (int, optional): Chunks sent to a worker at a time. Defaults to TASK_SIZE.
+        batch_size (int, optional): The model's batch size. Defaults to ENCODE_BATCH_SIZE.
+        checkpoint_path (str, optional): A JSON file recording progress. If it exists, documents
+            it records as done are skipped.
+        checkpoint_interval (float, optional): Seconds between checkpoints. Defaults to 60.
+        save (Callable[[], None], optional): Called to persist the knowledge base before each
+            checkpoint.
+        report (Callable[[dict], None], optional): Called with the progress every
+            `report_interval` seconds and at the end.
+        report_interval (float, optional): Defaults to 5.
+
+    Returns:
+        dict: The number of documents and chunks ingested in total, and the chunks per second
+            in this run.
+    """
+    checkpoint = read_checkpoint(checkpoint_path, source)
+    documents = islice(iter_documents(source), checkpoint["documents"], None)
+    batches = chunk_batches(documents, knowledge, split_fn, task_size)
+    start = last_checkpoint = last_report = time.perf_counter()
+    added = 0
+
+    def progress() -> dict:
+        elapsed = time.perf_counter() - start
+        return dict(
+            checkpoint,
+            elapsed=elapsed,
+            chunks_per_second=added / elapsed if elapsed else 0.0,
+        )
+
+    def save_checkpoint():
+        if save is not None:
+            save()
+        if checkpoint_path:
+            write_checkpoint(checkpoint_path, checkpoint)
+
+    first_document = checkpoint["documents"]
+    for values, ids, metadatas, completed, embeddings in encode_batches(
+        batches, knowledge.model_name, workers, batch_size
+    ):
+        knowledge.add_embedded(values, embeddings, ids, metadatas)
+        added += len(values)
+        checkpoint["documents"] = first_document + completed
+        checkpoint["chunks"] += len(values)
+        now = time.perf_counter()
+        if now - last_checkpoint >= checkpoint_interval:
+            save_checkpoint()
+            last_checkpoint = now
+        if report is not None and now - last_report >= report_interval:
+            report(progress())
+            last_report = now
+    save_checkpoint()
+    result = progress()
+    if report is not None:
+        report(result)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("source", help="A directory, JSONL file or text file.")
+    parser.add_argument(
+        "--backend", choices=("numpy", "chroma"), default="numpy"
+    )
+    parser.add_argument("--output", help="The NumPy knowledge base directory.")
+    parser.add_argument(
+        "--collection",
+        default=KNOWLEDGE_COLLECTION,
+        help="The Chroma collection, or with --shard the prefix of each shard's collection. The "
+        "app searches the default with --shard jurisdiction.",
+    )
+    parser.add_argument(
+        "--chroma-path", help="The directory Chroma persists to."
+    )
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--dtype", choices=("float32", "float16"))
+    parser.add_argument(
+        "--quantize",
+        choices=("int8", "pq"),
+        help="Store compressed embeddings (numpy backend only). pq is trained once there are "
+        "10,000 chunks, which are stored at full precision until then.",
+    )
+    parser.add_argument(
+        "--rerank",
+        type=int,
+        default=0,
+        help="Also keep full-precision embeddings, to rescore this many times the results.",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=min(4, os.cpu_count() or 1)
+    )
+    parser.add_argument("--task-size", type=int, default=TASK_SIZE)
+    parser.add_argument("--batch-size", type=int, default=ENCODE_BATCH_SIZE)
+    parser.add_argument("--checkpoint", help="Defaults to beside the output.")
+    parser.add_argument("--checkpoint-interval", type=float, default=60.0)
+    parser.add_argument(
+        "--shard",
+        metavar="FIELD",
+        help="Store chunks in a separate knowledge base per value of this metadata field.",
+    )
+    args = parser.parse_args()
+
+    save = None
+    if args.backend == "numpy":
+        if not args.output:
+            parser.error("--output is required with the numpy backend")
+
+        def create(key: str = None) -> NumPyKnowledgeBase:
+            quantizer = None
+            if args.quantize == "int8":
+                quantizer = ScalarQuantizer()
+            elif args.quantize == "pq":
+                quantizer = ProductQuantizer()
+            knowledge = NumPyKnowledgeBase(
+                model_name=args.model,
+                dtype=args.dtype or np.float32,
+                quantizer=quantizer,
+                rerank=args.rerank,
+            )
+            # Build the keyword index as chunks are added, so it is saved with them.
+            knowledge.lexical_index
+            return knowledge
+
+        if args.shard:
+            knowledge = ShardedKnowledgeBase(
+                create, shard_by=args.shard, model_name=args.model
+            )
+            if os.path.exists(os.path.join(args.output, "shards.json")):
+                knowledge.load(args.output)
+            for shard in knowledge.shards.values():
+                shard.lexical_index
+        else:
+            knowledge = create()
+            if os.path.isdir(args.output):
+                knowledge.load(args.output)
+                knowledge.lexical_index
+        save = lambda: knowledge.save(args.output)
+        checkpoint = args.checkpoint or args.output + ".checkpoint.json"
+    else:
+        if not args.chroma_path:
+            parser.error("--chroma-path is required with the chroma backend")
+        os.environ[CHROMA_PATH_ENV_VAR] = args.chroma_path
+        if args.shard:
+            knowledge = ShardedKnowledgeBase(
+                chroma_shard_factory(args.collection, model_name=args.model),
+                shard_by=args.shard,
+                discover=lambda: chroma_shard_keys(args.collection),
+                model_name=args.model,
+            )
+        else:
+            knowledge = ChromaKnowledgeBase(
+                model_name=args.model, name=args.collection
+            )
+        checkpoint = args.checkpoint or os.path.join(
+            args.chroma_path, args.collection + ".checkpoint.json"
+        )
+
+    def report(progress: dict):
+        print(
+            f"{progress['documents']} documents, {progress['chunks']} chunks, "
+            f"{progress['chunks_per_second']:.0f} chunks/s",
+            flush=True,
+        )
+
+    ingest(
+        args.source,
+        knowledge,
+        workers=args.workers,
+        task_size=args.task_size,
+        batch_size=args.batch_size,
+        checkpoint_path=checkpoint,
+        checkpoint_interval=args.checkpoint_interval,
+        save=save,
+        report=report,
+    )
+
+
+if __name__ == "__main__":
+    main()
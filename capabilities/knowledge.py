@@ -1,24 +1,156 @@
-from capabilities.helpers.knowledge_bases import ChromaKnowledgeBase 
-from capabilities.helpers.llm import ask_gpt_stream
-from capabilities.helpers.text_splitters import section_header_split 
+from typing import AsyncIterator, Iterable, List, NamedTuple, Optional
+from capabilities.helpers.cache import SemanticCache
+from capabilities.helpers.context import count_tokens, retrieve_context
+from capabilities.helpers.knowledge_bases import (
+    HYBRID,
+    KNOWLEDGE_COLLECTION,
+    Filters,
+    ShardedKnowledgeBase,
+    chroma_shard_factory,
+    chroma_shard_keys,
+)
+from capabilities.helpers.llm import (
+    accumulate,
+    ask_gpt_stream,
+    ask_gpt_stream_async,
+    split_tokens,
+)
+from capabilities.helpers.text_splitters import section_header_split
+from capabilities.helpers.tracing import span
+import asyncio
+import logging
+import numpy as np
+import os
+import threading
+import time
 
-knowledge = ChromaKnowledgeBase()
+logger = logging.getLogger(__name__)
 
-def add_to_knowledge(text: str):
-    knowledge.add(text, split_fn=section_header_split)
+ANSWER_MODEL = "gpt-3.5-turbo"
+# The tokens of knowledge put in each prompt.
+CONTEXT_TOKENS = 1_500
+# Questions often cite section numbers or defined terms, which keyword search finds better. For
+# questions citing a section, hybrid search ranks the keyword matches first.
+SEARCH_MODE = HYBRID
+ANSWER_CACHE_THRESHOLD_ENV_VAR = "POLICYENGINE_AI_ANSWER_CACHE_THRESHOLD"
+ANSWER_CACHE_ENTRIES_ENV_VAR = "POLICYENGINE_AI_ANSWER_CACHE_ENTRIES"
 
+_knowledge = None
+_answer_cache = None
+_lock = threading.Lock()
 
-def get_relevant_knowledge(question: str) -> str:
-    """Return the most relevant piece of knowledge to a question.
+
+def get_knowledge_base() -> ShardedKnowledgeBase:
+    """Return the process-wide knowledge base, shared by every Streamlit session and rerun. It
+    has a Chroma collection per jurisdiction (including those persisted earlier, or built with
+    the ingest CLI), and the model and collections are loaded on first use."""
+    global _knowledge
+    if _knowledge is None:
+        with _lock:
+            if _knowledge is None:
+                _knowledge = ShardedKnowledgeBase(
+                    chroma_shard_factory(KNOWLEDGE_COLLECTION),
+                    discover=lambda: chroma_shard_keys(KNOWLEDGE_COLLECTION),
+                )
+    return _knowledge
+
+
+def get_answer_cache() -> SemanticCache:
+    """Return the cache of answers from `get_relevant_knowledge`.
+
+    Unless `set_answer_cache` has been called, this keeps POLICYENGINE_AI_ANSWER_CACHE_ENTRIES
+    answers (default 256, 0 to disable), matching questions with a cosine similarity of at least
+    POLICYENGINE_AI_ANSWER_CACHE_THRESHOLD (default 0.95).
+
+    Returns:
+        SemanticCache: The current cache.
+    """
+    global _answer_cache
+    if _answer_cache is None:
+        _answer_cache = SemanticCache(
+            threshold=float(
+                os.environ.get(ANSWER_CACHE_THRESHOLD_ENV_VAR, 0.95)
+            ),
+            max_entries=int(os.environ.get(ANSWER_CACHE_ENTRIES_ENV_VAR, 256)),
+        )
+    return _answer_cache
+
+
+def set_answer_cache(cache: Optional[SemanticCache]):
+    """Set the cache of answers from `get_relevant_knowledge`.
 
     Args:
-        question (str): The question to answer.
+        cache (SemanticCache, optional): The cache, or None to configure from the environment again.
+    """
+    global _answer_cache
+    _answer_cache = cache
+
+
+def add_to_knowledge(text: str, metadata: Optional[dict] = None) -> int:
+    """Add text to the knowledge base.
+
+    Args:
+        text (str): The text. Chunks starting with a YAML header (as `llm_split` writes) take
+            their jurisdiction, act, section and effective date from it.
+        metadata (dict, optional): Metadata for every chunk, e.g. {"jurisdiction": "uk"}.
 
     Returns:
-        str: The most relevant piece of knowledge.
+        int: The number of chunks added.
     """
-    relevant_info = "\n".join(list(knowledge.search(question, top_n=3)))
-    prompt=f"""
+    ids, embeddings = get_knowledge_base().add(
+        text, split_fn=section_header_split, metadata=metadata
+    )
+    if ids:
+        get_answer_cache().invalidate(embeddings)
+    return len(ids)
+
+
+class _AnswerPlan(NamedTuple):
+    """The retrieval done before answering a question: either a cached answer, or the prompt."""
+
+    question_embedding: np.ndarray
+    ids: List[str]
+    scores: List[float]
+    version: int
+    answer: Optional[str]
+    prompt: Optional[str]
+
+
+def _plan_answer(
+    question: str,
+    context_tokens: int,
+    filters: Optional[Filters],
+    start: float,
+) -> _AnswerPlan:
+    knowledge = get_knowledge_base()
+    cache = get_answer_cache()
+    version = cache.version
+    with span("encode", texts=1):
+        question_embedding = knowledge.model.encode([question])[0]
+    with span("retrieve", context_tokens=context_tokens) as s:
+        context = retrieve_context(
+            knowledge,
+            question_embedding,
+            context_tokens,
+            count=lambda text: count_tokens(text, ANSWER_MODEL),
+            query=question,
+            mode=SEARCH_MODE,
+            filters=filters,
+        )
+        s.set(chunks=len(context.chunks), tokens=context.tokens)
+    ids = [id for id, _, _ in context.chunks]
+    scores = [score for _, _, score in context.chunks]
+    answer = cache.get(question_embedding, ids)
+    if answer is not None:
+        logger.info(
+            "Answered from the cache in %.3f s", time.perf_counter() - start
+        )
+        return _AnswerPlan(
+            question_embedding, ids, scores, version, answer, None
+        )
+
+    relevant_info = context.text
+    prompt = f"""
 The user has a question: 
 
 {question}
@@ -30,7 +162,122 @@ Relevant laws, regulations, or general background information:
 You must answer the question using the information in relevant laws, regulations, or background information above. Always cite where you got the information from.
 """
 
-    return ask_gpt_stream(
-        prompt=prompt,
-        model="gpt-3.5-turbo",
+    logger.info(
+        "Prompt of %d tokens, with %d chunks in %d of %d context tokens",
+        count_tokens(prompt, ANSWER_MODEL),
+        len(context.chunks),
+        context.tokens,
+        context_tokens,
+    )
+    if context.exhausted:
+        # Every chunk was used or considered, so any new chunk could change the answer.
+        scores.append(-1.0)
+    return _AnswerPlan(question_embedding, ids, scores, version, None, prompt)
+
+
+def get_relevant_knowledge(
+    question: str,
+    deltas: bool = False,
+    context_tokens: int = CONTEXT_TOKENS,
+    filters: Optional[Filters] = None,
+) -> str:
+    """Return the most relevant piece of knowledge to a question. Answers are cached, and reused
+    for questions with nearly the same meaning which retrieve the same chunks.
+
+    Args:
+        question (str): The question to answer.
+        deltas (bool, optional): If True, yield only the new text in each update. Defaults to False.
+        context_tokens (int, optional): The token budget for knowledge in the prompt, which is
+            filled with as many of the most relevant chunks as fit. Defaults to CONTEXT_TOKENS.
+        filters (Filters, optional): Only use knowledge whose metadata matches, e.g.
+            {"jurisdiction": "uk"}.
+
+    Returns:
+        str: The most relevant piece of knowledge.
+    """
+    start = time.perf_counter()
+    plan = _plan_answer(question, context_tokens, filters, start)
+    if plan.answer is not None:
+        delta_stream = iter(split_tokens(plan.answer))
+        return delta_stream if deltas else accumulate(delta_stream)
+    delta_stream = _cache_answer(
+        _log_latency(
+            ask_gpt_stream(
+                prompt=plan.prompt, model=ANSWER_MODEL, deltas=True
+            ),
+            start,
+        ),
+        get_answer_cache(),
+        plan,
+    )
+    return delta_stream if deltas else accumulate(delta_stream)
+
+
+async def get_relevant_knowledge_async(
+    question: str,
+    deltas: bool = False,
+    context_tokens: int = CONTEXT_TOKENS,
+    filters: Optional[Filters] = None,
+) -> AsyncIterator[str]:
+    """Async version of `get_relevant_knowledge`. Retrieval runs in a worker thread, so it
+    doesn't block the event loop."""
+    start = time.perf_counter()
+    plan = await asyncio.to_thread(
+        _plan_answer, question, context_tokens, filters, start
+    )
+    chunks = []
+    if plan.answer is not None:
+        for delta in split_tokens(plan.answer):
+            chunks.append(delta)
+            yield delta if deltas else "".join(chunks)
+        return
+    first_token = None
+    async for delta in ask_gpt_stream_async(
+        plan.prompt, model=ANSWER_MODEL, deltas=True
+    ):
+        if first_token is None:
+            first_token = time.perf_counter() - start
+        chunks.append(delta)
+        yield delta if deltas else "".join(chunks)
+    logger.info(
+        "Answered in %.3f s (first token after %.3f s)",
+        time.perf_counter() - start,
+        first_token or 0.0,
+    )
+    get_answer_cache().set(
+        plan.question_embedding,
+        plan.ids,
+        plan.scores,
+        "".join(chunks),
+        version=plan.version,
+    )
+
+
+def _log_latency(deltas: Iterable[str], start: float) -> Iterable[str]:
+    first_token = None
+    for delta in deltas:
+        if first_token is None:
+            first_token = time.perf_counter() - start
+        yield delta
+    logger.info(
+        "Answered in %.3f s (first token after %.3f s)",
+        time.perf_counter() - start,
+        first_token or 0.0,
+    )
+
+
+def _cache_answer(
+    deltas: Iterable[str], cache: SemanticCache, plan: _AnswerPlan
+) -> Iterable[str]:
+    # As with responses, only complete answers are cached.
+    chunks = []
+    for delta in deltas:
+        chunks.append(delta)
+        yield delta
+    cache.set(
+        plan.question_embedding,
+        plan.ids,
+        plan.scores,
+        "".join(chunks),
+        version=plan.version,
     )
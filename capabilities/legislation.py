@@ -1,4 +1,16 @@
-from capabilities.helpers.llm import ask_gpt_stream
+from typing import AsyncIterator
+
+from capabilities.helpers.llm import (
+    accumulate,
+    accumulate_async,
+    ask_gpt_stream,
+    ask_gpt_stream_async,
+)
+from capabilities.helpers.text_splitters import (
+    WINDOW_WORDS,
+    stream_blocks,
+    stream_blocks_async,
+)
 
 PROMPT = """
 
@@ -28,16 +40,50 @@ Content below. Return the standardised version.
 """
 
 
-def parse_legislation(text: str) -> str:
-    """Take a copy-pasted extract from legislation and return a standardised Markdown version.
+def parse_legislation(text: str, deltas: bool = False) -> str:
+    """Take a copy-pasted extract from legislation and return a standardised Markdown version. Long
+    extracts are processed in concurrent windows and streamed back a section at a time.
 
     Args:
         text (str): Legislation text.
+        deltas (bool, optional): If True, yield only the new text in each update. Defaults to False.
 
     Returns:
         str: Policy text.
     """
-    yield from ask_gpt_stream(
-        prompt=PROMPT + text,
-        model="gpt-3.5-turbo",
+    if text.count(" ") + 1 <= WINDOW_WORDS:
+        yield from ask_gpt_stream(
+            prompt=PROMPT + text,
+            model="gpt-3.5-turbo",
+            deltas=deltas,
+        )
+        return
+    # Long documents are standardised a window at a time, concurrently, and streamed back in
+    # order a section at a time.
+    blocks = stream_blocks(PROMPT, text, model="gpt-3.5-turbo")
+    updates = (("\n\n" if i else "") + block for i, block in enumerate(blocks))
+    yield from updates if deltas else accumulate(updates)
+
+
+async def parse_legislation_async(
+    text: str, deltas: bool = False
+) -> AsyncIterator[str]:
+    """Async version of `parse_legislation`."""
+    if text.count(" ") + 1 <= WINDOW_WORDS:
+        async for update in ask_gpt_stream_async(
+            PROMPT + text, model="gpt-3.5-turbo", deltas=deltas
+        ):
+            yield update
+        return
+    updates = _separate_blocks(
+        stream_blocks_async(PROMPT, text, model="gpt-3.5-turbo")
     )
+    async for update in updates if deltas else accumulate_async(updates):
+        yield update
+
+
+async def _separate_blocks(blocks: AsyncIterator[str]) -> AsyncIterator[str]:
+    i = 0
+    async for block in blocks:
+        yield ("\n\n" if i else "") + block
+        i += 1
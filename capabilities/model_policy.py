@@ -1,77 +1,276 @@
-from capabilities.helpers.llm import ask_gpt_stream
+from typing import AsyncIterator, List
+
+from capabilities.helpers.concurrency import (
+    ordered_fan_out,
+    ordered_fan_out_async,
+)
+from capabilities.helpers.llm import (
+    accumulate,
+    accumulate_async,
+    ask_gpt,
+    ask_gpt_async,
+    ask_gpt_stream,
+    ask_gpt_stream_async,
+)
+from capabilities.helpers.prompts import (
+    PARAMETERS,
+    PARAMETER_RULES,
+    PARAMETER_TEMPLATE,
+    VARIABLES,
+    VARIABLE_RULES,
+    VARIABLE_TEMPLATE,
+    PromptBuilder,
+)
+from capabilities.helpers.tracing import traced_astream, traced_stream
+from capabilities.helpers.validation import (
+    StreamValidator,
+    ValidatedFiles,
+    generate_files,
+    until_first_block,
+    until_first_block_async,
+)
+import asyncio
+import re
+import threading
 
 MODEL = "gpt-4"
 
-PROMPT = f"""
-
-PolicyEngine (derived from OpenFisca) uses Python to model the logic of a policy, in the form below (an example):
-
-income_tax.py
-```python
-from policyengine_uk.model_api import * # for uk-specific functions, we also model in policyengine_us.
-
-
-class income_tax(Variable):
-    label = "income tax"
-    definition_period = YEAR # or MONTH
-    entity = Household # or Person or TaxUnit (US) or BenUnit (UK)
-    value_type = float # or int or bool or str
-    reference = "https://www.gov.uk/income-tax-rates" # a reference for the parameter, if the user gave you one.
-    defined_for = None # e.g. StateCode.NY if in the US and state-specific, otherwise None.
-    documentation = "Federal income tax liabilities."
-
-    def formula(person, period, parameters): # person might be household if entity is Household, etc.
-        employment_income = person("employment_income", period) # You can retrieve other variables like this. You can also use `add(household, period, [list, of, variables])` to add up variables from a higher entity.
-        parameter_subtree = parameters(period).gov.income_tax.income_tax_allowance # You can retrieve parameters like this, they're in a folder tree
-        tax_rate = parameter_subtree.rate # You can retrieve values from the parameter tree like this if they exist.
-        # variable values are all vectors, so use vectorisable operations.
-        # min_(x, y) is a vectorisable function that returns the minimum of x and y for each element of the vector. We also have max_, and you can use other NumPy default functions too.
-        return tax_rate * max_(employment_income - parameter_subtree.allowance, 0)
-```
-
-Add comments explaining the logic. The user will provide information after these prompts- write up all the variable files needed to accurately model the policy.
-
-PolicyEngine uses standardised YAML files to model policy parameters, in the form below:
-personal_allowance.yaml
-```yaml
-description: A full-sentence description of the parameter.
-metadata:
-    unit: either currency-GBP, currency-USD, hour, or something new like 'person' if it's a population size.
-    period: the time period over which the parameter applies, one of 'year', 'month' or 'day'.
-    label: a short phrase that describes the parameter, e.g. 'personal tax allowance'. You should be able to drop this into a sentence as-is.
-    reference: # a list of any references used in writing the parameter if the user gave you any, that apply to *all* values.
-    - title: The title of the web page or legislative reference.
-      href: The URL of the web page or legislative reference.
-values: # any number of values, each with a start date, in order.
-    2018-04-01:
-        value: 11_850.00 # the value of the parameter on this date. Make sure to use underscores to separate thousands.
-        reference: # Any references which inform about *only* this value.
-        - title: ...
-          href: ...
-    2019-04-01: 12_500 # if there's no reference, you can use this shorthand.
-    2020-04-01: ...
-```
-If you don't have enough information to be confident, return what you have but add a YAML comment explaining where you think you messed up. Return valid YAML only. 
-If the user passes you data describing more than one parameter at a time, write parameter files for each one, with the filenames written above.
-
-
-Below is the user's information. Write up all parameter and variable files needed to accurately model the policy. Before each Python or YAML snippet, write the filename (and folder location).
+# The number of files generated at once in pipeline mode. The semaphore is shared by every call,
+# so concurrent sessions don't multiply the number of requests in flight.
+MAX_CONCURRENCY = 4
+FILE_SEMAPHORE = threading.BoundedSemaphore(MAX_CONCURRENCY)
+
+TEMPLATES = (
+    "\n\n"
+    + VARIABLE_TEMPLATE
+    + "\n\nAdd comments explaining the logic. The user will provide information after these prompts- write up all the variable files needed to accurately model the policy.\n\n"
+    + PARAMETER_TEMPLATE
+    + "\n\n"
+)
+RULES = (
+    VARIABLE_RULES + "Add comments explaining the logic.\n\n" + PARAMETER_RULES
+)
+
+CLOSING = """Below is the user's information. Write up all parameter and variable files needed to accurately model the policy. Before each Python or YAML snippet, write the filename (and folder location).
 e.g. parameters/gov/income_tax/personal_allowance.yaml or variables/income_tax/income_tax.py
 Do not give commentary between files. Do not deviate from the instructions given in the YAML and Python information above. Don't give references if the user didn't give you any.
 """
+# The prompt without examples.
+PROMPT = TEMPLATES + CLOSING
+PROMPT_BUILDER = PromptBuilder(
+    RULES, TEMPLATES, CLOSING, [PARAMETERS, VARIABLES]
+)
+
+PLAN_PROMPT = """
+PolicyEngine models policies with YAML parameter files (e.g. parameters/gov/income_tax/personal_allowance.yaml) and Python variable files (e.g. variables/income_tax/income_tax.py).
+List every parameter and variable file needed to accurately model the policy below, one path per line, parameters first. Do not write the files, and do not write anything else.
+
+"""
+
+FILE_PROMPT = """Below is the user's information. The policy is modelled by these files:
+{files}
+Write only {path}. Return just its contents in a single code block, with no filename or commentary. Do not deviate from the instructions given in the YAML and Python information above. Don't give references if the user didn't give you any.
+"""
+
+# Each file in pipeline mode is shown examples of its own kind only.
+FILE_PROMPT_BUILDERS = {
+    PARAMETERS: PromptBuilder(PARAMETER_RULES, TEMPLATES, "", [PARAMETERS]),
+    VARIABLES: PromptBuilder(
+        VARIABLE_RULES + "Add comments explaining the logic.\n",
+        TEMPLATES,
+        "",
+        [VARIABLES],
+    ),
+}
+
+FILE_PATH_PATTERN = re.compile(
+    r"(?:parameters|variables)/[\w./-]+\.(?:yaml|py)"
+)
+
+
+def plan_files(information: str) -> List[str]:
+    """Ask for the list of parameter and variable files needed to model a policy.
+
+    Args:
+        information (str): The policy information.
+
+    Returns:
+        List[str]: The file paths, in order.
+    """
+    plan = ask_gpt(PLAN_PROMPT + information, model=MODEL)
+    return _plan_paths(plan)
+
+
+def _plan_paths(plan: str) -> List[str]:
+    return list(dict.fromkeys(FILE_PATH_PATTERN.findall(plan)))
 
 
-def model_policy(information: str) -> str:
+def _file_prompt(path: str, files: List[str], information: str) -> str:
+    kind = PARAMETERS if path.startswith("parameters/") else VARIABLES
+    return FILE_PROMPT_BUILDERS[kind].build(
+        information,
+        closing=FILE_PROMPT.format(path=path, files="\n".join(files)),
+    )
+
+
+def _generate_file(path: str, files: List[str], information: str):
+    yield path + "\n"
+    # Each file is one code block, so stop reading at its end.
+    yield from until_first_block(
+        ask_gpt_stream(
+            _file_prompt(path, files, information), model=MODEL, deltas=True
+        )
+    )
+    yield "\n\n"
+
+
+async def _generate_file_async(
+    path: str, files: List[str], information: str
+) -> AsyncIterator[str]:
+    yield path + "\n"
+    # Selecting examples embeds the information, which blocks.
+    prompt = await asyncio.to_thread(_file_prompt, path, files, information)
+    async for delta in until_first_block_async(
+        ask_gpt_stream_async(prompt, model=MODEL, deltas=True)
+    ):
+        yield delta
+    yield "\n\n"
+
+
+def _model_policy_pipeline(information: str, max_concurrency: int):
+    files = plan_files(information)
+    if not files:
+        yield from ask_gpt_stream(
+            PROMPT_BUILDER.build(information), model=MODEL, deltas=True
+        )
+        return
+    tasks = [
+        lambda path=path: _generate_file(path, files, information)
+        for path in files
+    ]
+    for _, delta in ordered_fan_out(
+        tasks, max_concurrency=max_concurrency, semaphore=FILE_SEMAPHORE
+    ):
+        yield delta
+
+
+def model_policy(
+    information: str,
+    deltas: bool = False,
+    pipeline: bool = False,
+    max_concurrency: int = MAX_CONCURRENCY,
+    validate: bool = False,
+) -> str:
     """Write a PolicyEngine parameter YAML file based on the information provided.
 
     Args:
         information (str): The information to use to create the parameter.
+        deltas (bool, optional): If True, yield only the new text in each update. Defaults to False.
+        pipeline (bool, optional): If True, plan the files needed first, then generate each one in a
+            separate concurrent request. Defaults to False.
+        max_concurrency (int, optional): The number of files generated at once in pipeline mode.
+            FILE_SEMAPHORE also caps the total across all calls.
+        validate (bool, optional): If True, check each file as it arrives, and append
+            regenerated versions of any which don't parse. Defaults to False.
 
     Returns:
         str: The parameter YAML file.
     """
 
-    prompt = PROMPT + information
+    # The pipeline prompts per file, so it only needs this to repair them.
+    prompt = (
+        PROMPT_BUILDER.build(information) if validate or not pipeline else None
+    )
+    if pipeline:
+        delta_stream = _model_policy_pipeline(information, max_concurrency)
+    else:
+        # Use the chat endpoint to generate the parameter.
+        delta_stream = ask_gpt_stream(prompt, model=MODEL, deltas=True)
+    if validate:
+        delta_stream = StreamValidator(prompt, MODEL).watch(delta_stream)
+    delta_stream = traced_stream(
+        "model_policy",
+        delta_stream,
+        first="first_token",
+        count="deltas",
+        pipeline=pipeline,
+    )
+    yield from delta_stream if deltas else accumulate(delta_stream)
+
+
+def model_policy_files(
+    information: str,
+    pipeline: bool = False,
+    max_concurrency: int = MAX_CONCURRENCY,
+) -> ValidatedFiles:
+    """Write the parameter and variable files modelling a policy, returned by path once each
+    has been checked, with any which don't parse regenerated.
 
-    # Use the chat endpoint to generate the parameter.
-    yield from ask_gpt_stream(prompt, model=MODEL)
+    Args:
+        information (str): The policy information.
+        pipeline (bool, optional): If True, generate each file in a separate concurrent request.
+            Defaults to False.
+        max_concurrency (int, optional): The number of files generated at once in pipeline mode.
+
+    Returns:
+        ValidatedFiles: The files, and the errors of any still invalid.
+    """
+    deltas = None
+    if pipeline:
+        deltas = _model_policy_pipeline(information, max_concurrency)
+    return generate_files(
+        PROMPT_BUILDER.build(information), MODEL, deltas=deltas
+    )
+
+
+async def _model_policy_pipeline_async(
+    information: str, max_concurrency: int
+) -> AsyncIterator[str]:
+    files = _plan_paths(
+        await ask_gpt_async(PLAN_PROMPT + information, model=MODEL)
+    )
+    if not files:
+        prompt = await asyncio.to_thread(PROMPT_BUILDER.build, information)
+        async for delta in ask_gpt_stream_async(
+            prompt, model=MODEL, deltas=True
+        ):
+            yield delta
+        return
+    tasks = [
+        lambda path=path: _generate_file_async(path, files, information)
+        for path in files
+    ]
+    async for _, delta in ordered_fan_out_async(
+        tasks, max_concurrency=max_concurrency
+    ):
+        yield delta
+
+
+async def model_policy_async(
+    information: str,
+    deltas: bool = False,
+    pipeline: bool = False,
+    max_concurrency: int = MAX_CONCURRENCY,
+) -> AsyncIterator[str]:
+    """Async version of `model_policy`. In pipeline mode, the total number of requests in flight
+    is capped by the backend's connection pool rather than FILE_SEMAPHORE.
+    """
+    if pipeline:
+        delta_stream = _model_policy_pipeline_async(
+            information, max_concurrency
+        )
+    else:
+        # Selecting examples embeds the information, which blocks.
+        prompt = await asyncio.to_thread(PROMPT_BUILDER.build, information)
+        delta_stream = ask_gpt_stream_async(prompt, model=MODEL, deltas=True)
+    delta_stream = traced_astream(
+        "model_policy",
+        delta_stream,
+        first="first_token",
+        count="deltas",
+        pipeline=pipeline,
+    )
+    async for update in (
+        delta_stream if deltas else accumulate_async(delta_stream)
+    ):
+        yield update
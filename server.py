@@ -0,0 +1,275 @@
+"""An async HTTP API for the capabilities, an alternative to the Streamlit app which serves many
+concurrent clients from one event loop. Identical requests in flight at once share one upstream
+LLM call.
+
+Streaming endpoints take a JSON body and reply with server-sent events: one JSON-encoded text
+delta per event, then a `done` event, or an `error` event if the request fails part way.
+
+    POST /create_parameters  {"information": ...}
+    POST /create_variables   {"information": ...}
+    POST /model_policy       {"information": ..., "pipeline": false}
+    POST /parse_legislation  {"text": ...}
+    POST /knowledge/ask      {"question": ..., "filters": {...}, "context_tokens": 1500}
+
+The other endpoints reply with JSON.
+
+    POST /knowledge          {"text": ..., "metadata": {...}} -> {"added": <chunks>}
+    GET  /health             -> {"status": "ok", "upstream_requests": ..., "coalesced_requests": ...}
+
+GET /metrics returns per-stage latency and token histograms in the Prometheus text format, if
+POLICYENGINE_AI_TRACING includes "metrics".
+
+Usage:
+    python server.py --host 0.0.0.0 --port 8000
+"""
+
+from contextlib import aclosing
+from typing import AsyncIterator, Optional
+
+import argparse
+import asyncio
+import json
+import logging
+
+from aiohttp import web
+
+from capabilities.create_parameters import create_parameters_async
+from capabilities.create_variables import create_variables_async
+from capabilities.knowledge import (
+    CONTEXT_TOKENS,
+    add_to_knowledge,
+    get_relevant_knowledge_async,
+)
+from capabilities.legislation import parse_legislation_async
+from capabilities.model_policy import model_policy_async
+from capabilities.helpers.llm import get_backend, get_coalescer
+from capabilities.helpers.tracing import get_registry
+
+logger = logging.getLogger(__name__)
+
+
+def event(data: str, name: Optional[str] = None) -> bytes:
+    """Encode a server-sent event.
+
+    Args:
+        data (str): The data, which must be a single line (e.g. JSON).
+        name (str, optional): The event type. Defaults to a plain message.
+
+    Returns:
+        bytes: The encoded event.
+    """
+    return (
+        (f"event: {name}\n" if name else "") + f"data: {data}\n\n"
+    ).encode()
+
+
+async def stream_events(
+    request: web.Request, deltas: AsyncIterator[str]
+) -> web.StreamResponse:
+    """Send a stream of text deltas as server-sent events. If the client disconnects, the stream
+    is closed, which cancels its upstream request unless another client is sharing it.
+
+    Args:
+        request (web.Request): The request.
+        deltas (AsyncIterator[str]): The text deltas.
+
+    Returns:
+        web.StreamResponse: The response.
+    """
+    response = web.StreamResponse(
+        headers={
+            "Content-Type": "text/event-stream",
+            "Cache-Control": "no-cache",
+        }
+    )
+    await response.prepare(request)
+    try:
+        async with aclosing(deltas):
+            try:
+                async for delta in deltas:
+                    await response.write(event(json.dumps(delta)))
+            except ConnectionResetError:
+                raise
+            except Exception as e:
+                logger.exception("Failed streaming %s", request.path)
+                await response.write(event(json.dumps(str(e)), "error"))
+            else:
+                await response.write(event("{}", "done"))
+        await response.write_eof()
+    except ConnectionResetError:
+        logger.info("Client left %s before the end", request.path)
+    return response
+
+
+async def read_body(request: web.Request) -> dict:
+    try:
+        body = await request.json()
+    except json.JSONDecodeError:
+        body = None
+    if not isinstance(body, dict):
+        raise web.HTTPBadRequest(text="The body must be a JSON object.")
+    return body
+
+
+def required(body: dict, field: str) -> str:
+    value = body.get(field)
+    if not isinstance(value, str) or not value.strip():
+        raise web.HTTPBadRequest(text=f"Missing the {field!r} field.")
+    return value
+
+
+def positive_int(body: dict, field: str, default: int) -> int:
+    value = body.get(field)
+    if value is None:
+        return default
+    if isinstance(value, bool) or not isinstance(value, int) or value <= 0:
+        raise web.HTTPBadRequest(
+            text=f"The {field!r} field must be a positive integer."
+        )
+    return value
+
+
+def string_fields(
+    body: dict, field: str, lists: bool = False
+) -> Optional[dict]:
+    """Read an optional object of metadata fields, whose values are strings (or, with `lists`,
+    lists of strings any of which may match)."""
+    value = body.get(field)
+    if value is None:
+        return None
+
+    def valid(v) -> bool:
+        if lists and isinstance(v, list):
+            return all(isinstance(item, str) for item in v)
+        return isinstance(v, str)
+
+    if not isinstance(value, dict) or not all(map(valid, value.values())):
+        expected = "strings or lists of strings" if lists else "strings"
+        raise web.HTTPBadRequest(
+            text=f"The {field!r} field must be an object whose values are {expected}."
+        )
+    return value or None
+
+
+async def create_parameters(request: web.Request) -> web.StreamResponse:
+    body = await read_body(request)
+    return await stream_events(
+        request,
+        create_parameters_async(required(body, "information"), deltas=True),
+    )
+
+
+async def create_variables(request: web.Request) -> web.StreamResponse:
+    body = await read_body(request)
+    return await stream_events(
+        request,
+        create_variables_async(required(body, "information"), deltas=True),
+    )
+
+
+async def model_policy(request: web.Request) -> web.StreamResponse:
+    body = await read_body(request)
+    return await stream_events(
+        request,
+        model_policy_async(
+            required(body, "information"),
+            deltas=True,
+            pipeline=bool(body.get("pipeline", False)),
+        ),
+    )
+
+
+async def parse_legislation(request: web.Request) -> web.StreamResponse:
+    body = await read_body(request)
+    return await stream_events(
+        request, parse_legislation_async(required(body, "text"), deltas=True)
+    )
+
+
+async def ask_knowledge(request: web.Request) -> web.StreamResponse:
+    body = await read_body(request)
+    return await stream_events(
+        request,
+        get_relevant_knowledge_async(
+            required(body, "question"),
+            deltas=True,
+            context_tokens=positive_int(
+                body, "context_tokens", CONTEXT_TOKENS
+            ),
+            filters=string_fields(body, "filters", lists=True),
+        ),
+    )
+
+
+async def add_knowledge(request: web.Request) -> web.Response:
+    body = await read_body(request)
+    # Embedding and writing to the knowledge base block, so run in a worker thread.
+    added = await asyncio.to_thread(
+        add_to_knowledge,
+        required(body, "text"),
+        string_fields(body, "metadata"),
+    )
+    return web.json_response(dict(added=added))
+
+
+async def health(request: web.Request) -> web.Response:
+    coalescer = get_coalescer()
+    return web.json_response(
+        dict(
+            status="ok",
+            upstream_requests=coalescer.started,
+            coalesced_requests=coalescer.joined,
+        )
+    )
+
+
+async def metrics(request: web.Request) -> web.Response:
+    registry = get_registry()
+    if registry is None:
+        raise web.HTTPNotFound(
+            text="Set POLICYENGINE_AI_TRACING=metrics to record metrics."
+        )
+    return web.Response(
+        text=registry.prometheus(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+
+async def close_backend(app: web.Application):
+    await get_backend().aclose()
+
+
+def create_app() -> web.Application:
+    """Create the application, with its routes.
+
+    Returns:
+        web.Application: The application.
+    """
+    app = web.Application()
+    app.add_routes(
+        [
+            web.post("/create_parameters", create_parameters),
+            web.post("/create_variables", create_variables),
+            web.post("/model_policy", model_policy),
+            web.post("/parse_legislation", parse_legislation),
+            web.post("/knowledge", add_knowledge),
+            web.post("/knowledge/ask", ask_knowledge),
+            web.get("/health", health),
+            web.get("/metrics", metrics),
+        ]
+    )
+    app.on_cleanup.append(close_backend)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    web.run_app(create_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
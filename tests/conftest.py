@@ -0,0 +1,15 @@
+import pytest
+
+from capabilities.helpers import llm
+from capabilities.helpers.cache import ResponseCache
+
+
+@pytest.fixture
+def fake_llm():
+    """Answer prompts with an offline FakeBackend and no response cache, restoring both after."""
+    backend = llm.FakeBackend()
+    llm.set_backend(backend)
+    llm.set_cache(ResponseCache(max_entries=0))
+    yield backend
+    llm.set_backend(None)
+    llm.set_cache(None)
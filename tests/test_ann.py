@@ -0,0 +1,100 @@
+import os
+
+import numpy as np
+
+from benchmarks.ann import clustered_embeddings
+from capabilities.helpers.ann import IVFIndex
+from capabilities.helpers.knowledge_bases import NumPyKnowledgeBase, top_k
+
+DIM = 32
+N_LISTS = 16
+
+
+def indexed(embeddings: np.ndarray, **kwargs) -> NumPyKnowledgeBase:
+    knowledge = NumPyKnowledgeBase(
+        index=IVFIndex(n_lists=N_LISTS, min_train_size=500, **kwargs)
+    )
+    for start in range(0, len(embeddings), 250):
+        batch = embeddings[start : start + 250]
+        knowledge.add_embedded(
+            [f"chunk {i}" for i in range(start, start + len(batch))], batch
+        )
+    return knowledge
+
+
+def search(knowledge: NumPyKnowledgeBase, queries: np.ndarray, top_n=10):
+    return [
+        [id for id, _, _ in results]
+        for results in knowledge.search_embeddings(queries, top_n)
+    ]
+
+
+def exact(knowledge: NumPyKnowledgeBase, queries: np.ndarray, top_n=10):
+    rows, _ = top_k(queries @ knowledge.embeddings_array.T, top_n)
+    return [[knowledge.ids[i] for i in row] for row in rows]
+
+
+def recall(found, expected) -> float:
+    return np.mean(
+        [len(set(f) & set(e)) / len(e) for f, e in zip(found, expected)]
+    )
+
+
+def test_recall_rises_with_n_probe_to_exact():
+    embeddings = clustered_embeddings(2_000, dim=DIM, n_topics=40)
+    queries = clustered_embeddings(50, dim=DIM, n_topics=40, seed=1)
+    knowledge = indexed(embeddings)
+    assert knowledge.index.trained
+    expected = exact(knowledge, queries)
+    recalls = []
+    for n_probe in (1, 4, N_LISTS):
+        knowledge.index.n_probe = n_probe
+        recalls.append(recall(search(knowledge, queries), expected))
+    assert recalls == sorted(recalls)
+    assert recalls[1] >= 0.8
+    # Probing every list scores every row, so it is exact.
+    assert recalls[-1] == 1
+    assert search(knowledge, queries) == expected
+
+
+def test_index_trains_then_retrains_as_rows_grow():
+    rows = clustered_embeddings(400, dim=DIM)
+    index = IVFIndex(n_lists=4, min_train_size=100, retrain_factor=2)
+    index.add(rows[:50], rows[:50])
+    assert not index.trained
+    index.add(rows[50:100], rows[:100])
+    assert index.trained and index.trained_size == 100
+    centroids = index.centroids
+    # Below the retrain factor, new rows join the existing clusters.
+    index.add(rows[100:150], rows[:150])
+    assert index.centroids is centroids
+    assert index.trained_size == 100 and index.size == 150
+    index.add(rows[150:200], rows[:200])
+    assert index.centroids is not centroids
+    assert index.trained_size == 200 and index.size == 200
+    # Every row is in exactly one list.
+    listed = np.concatenate([index._list(i) for i in range(4)])
+    assert sorted(listed.tolist()) == list(range(200))
+
+
+def test_index_is_saved_next_to_the_embeddings(tmp_path):
+    embeddings = clustered_embeddings(1_000, dim=DIM)
+    queries = clustered_embeddings(10, dim=DIM, seed=1)
+    knowledge = indexed(embeddings, n_probe=2)
+    knowledge.save(str(tmp_path))
+    assert os.path.exists(tmp_path / "index.npz")
+    assert not os.path.exists(tmp_path / "index.npz.tmp")
+    loaded = NumPyKnowledgeBase(index=IVFIndex(n_probe=2))
+    loaded.load(str(tmp_path))
+    np.testing.assert_array_equal(
+        loaded.index.centroids, knowledge.index.centroids
+    )
+    assert (loaded.index.size, loaded.index.trained_size) == (
+        knowledge.index.size,
+        knowledge.index.trained_size,
+    )
+    for i in range(N_LISTS):
+        np.testing.assert_array_equal(
+            loaded.index._list(i), knowledge.index._list(i)
+        )
+    assert search(loaded, queries) == search(knowledge, queries)
@@ -0,0 +1,186 @@
+import importlib
+
+import numpy as np
+import pytest
+
+from benchmarks.common import HashingEmbedder, synthetic_legislation
+from capabilities.helpers import cache as cache_module
+from capabilities.helpers.cache import (
+    EmbeddingCache,
+    ResponseCache,
+    SemanticCache,
+)
+from capabilities.helpers.knowledge_bases import NumPyKnowledgeBase
+
+knowledge_module = importlib.import_module("capabilities.knowledge")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A controllable replacement for `time.time` in the cache module."""
+    now = [1_000.0]
+    monkeypatch.setattr(cache_module.time, "time", lambda: now[0])
+    return now
+
+
+def test_key_is_stable_and_depends_on_every_field():
+    key = ResponseCache.key("gpt-4", "prompt", temperature=0)
+    assert key == ResponseCache.key("gpt-4", "prompt", temperature=0)
+    assert key != ResponseCache.key("gpt-3.5-turbo", "prompt", temperature=0)
+    assert key != ResponseCache.key("gpt-4", "prompt!", temperature=0)
+    assert key != ResponseCache.key("gpt-4", "prompt", temperature=1)
+
+
+def test_memory_tier_evicts_least_recently_used():
+    cache = ResponseCache(max_entries=2)
+    cache.set("a", "A")
+    cache.set("b", "B")
+    assert cache.get("a") == "A"
+    cache.set("c", "C")
+    assert cache.get("b") is None
+    assert cache.get("a") == "A"
+    assert cache.get("c") == "C"
+    assert cache.stats()["memory_entries"] == 2
+
+
+def test_disabled_cache_stores_nothing():
+    cache = ResponseCache(max_entries=0)
+    assert not cache.enabled
+    cache.set("a", "A")
+    assert cache.get("a") is None
+
+
+def test_entries_expire_after_the_ttl(clock):
+    cache = ResponseCache(ttl=10)
+    cache.set("a", "A")
+    clock[0] += 9
+    assert cache.get("a") == "A"
+    clock[0] += 2
+    assert cache.get("a") is None
+    assert cache.stats()["memory_entries"] == 0
+
+
+def test_disk_tier_survives_a_new_cache(tmp_path):
+    path = str(tmp_path / "responses.db")
+    ResponseCache(max_entries=1, path=path).set("a", "A")
+    cache = ResponseCache(max_entries=1, path=path)
+    assert cache.get("a") == "A"
+    stats = cache.stats()
+    assert stats["disk_hits"] == 1
+    assert stats["disk_entries"] == 1
+    # The disk hit is promoted to memory.
+    assert stats["memory_entries"] == 1
+
+
+def test_disk_tier_expires_entries(tmp_path, clock):
+    path = str(tmp_path / "responses.db")
+    ResponseCache(path=path, ttl=10).set("a", "A")
+    clock[0] += 11
+    assert ResponseCache(path=path, ttl=10).get("a") is None
+    assert ResponseCache(path=path, ttl=10).stats()["disk_entries"] == 0
+
+
+def test_disk_tier_is_trimmed_least_recently_used_first(tmp_path, clock):
+    cache = ResponseCache(
+        max_entries=0, path=str(tmp_path / "responses.db"), max_bytes=10
+    )
+    cache.set("a", "x" * 4)
+    clock[0] += 1
+    cache.set("b", "y" * 4)
+    clock[0] += 1
+    # Reading "a" makes "b" the least recently used.
+    assert cache.get("a") == "xxxx"
+    clock[0] += 1
+    cache.set("c", "z" * 4)
+    assert cache.get("b") is None
+    assert cache.get("a") == "xxxx"
+    assert cache.get("c") == "zzzz"
+    assert cache.stats()["disk_bytes"] <= 10
+
+
+def unit(*values) -> np.ndarray:
+    vector = np.array(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+IDS = ("a", "b")
+
+
+def test_similar_questions_with_the_same_chunks_hit():
+    cache = SemanticCache(threshold=0.95)
+    cache.set(unit(1, 0, 0), IDS, [0.9, 0.8], "Answer.")
+    assert cache.get(unit(1, 0.1, 0), IDS) == "Answer."
+    # Retrieval found other chunks, so the answer may differ.
+    assert cache.get(unit(1, 0.1, 0), ("a", "c")) is None
+    assert cache.get(unit(1, 0.1, 0), IDS[::-1]) is None
+    assert cache.get(unit(1, 1, 0), IDS) is None
+    assert cache.stats() == dict(hits=1, misses=3, invalidations=0, entries=1)
+
+
+def test_least_recently_used_answers_are_evicted():
+    cache = SemanticCache(max_entries=2)
+    for i, answer in enumerate("ABC"):
+        if answer == "C":
+            # Using A makes B the least recently used.
+            assert cache.get(unit(1, 0, 0), IDS) == "A"
+        vector = np.zeros(3, dtype=np.float32)
+        vector[i] = 1
+        cache.set(vector, IDS, [0.5], answer)
+    assert cache.get(unit(0, 1, 0), IDS) is None
+    assert cache.get(unit(1, 0, 0), IDS) == "A"
+    assert cache.get(unit(0, 0, 1), IDS) == "C"
+
+
+def test_answers_retrieved_before_an_addition_are_not_stored():
+    cache = SemanticCache()
+    version = cache.version
+    cache.invalidate(np.zeros((1, 3), dtype=np.float32))
+    cache.set(unit(1, 0, 0), IDS, [0.5], "Stale.", version=version)
+    assert cache.stats()["entries"] == 0
+    cache.set(unit(1, 0, 0), IDS, [0.5], "Fresh.", version=cache.version)
+    assert cache.get(unit(1, 0, 0), IDS) == "Fresh."
+
+
+def test_only_answers_a_new_chunk_would_change_are_invalidated():
+    cache = SemanticCache()
+    # Scores are dot products with the question's embedding, which needn't be normalised.
+    question = 3 * unit(1, 0, 0)
+    cache.set(question, IDS, [3 * 0.9, 3 * 0.6], "First.")
+    cache.set(unit(0, 0, 1), IDS, [0.6], "Second.")
+    # Less similar to the first question than its chunks, and unrelated to the second.
+    cache.invalidate(unit(0.5, np.sqrt(0.75), 0)[None])
+    assert cache.stats()["entries"] == 2
+    cache.invalidate(unit(0.7, np.sqrt(0.51), 0)[None])
+    assert cache.get(question, IDS) is None
+    assert cache.get(unit(0, 0, 1), IDS) == "Second."
+    assert cache.stats()["invalidations"] == 1
+
+
+@pytest.fixture
+def answers(fake_llm, monkeypatch):
+    """Answer from an in-memory knowledge base with a fresh answer cache."""
+    knowledge = NumPyKnowledgeBase(
+        model=HashingEmbedder(dim=64), embedding_cache=EmbeddingCache()
+    )
+    monkeypatch.setattr(knowledge_module, "_knowledge", knowledge)
+    cache = SemanticCache()
+    monkeypatch.setattr(knowledge_module, "_answer_cache", cache)
+    fake_llm.default = "First answer."
+    return cache
+
+
+def answer(question: str) -> str:
+    return list(knowledge_module.get_relevant_knowledge(question))[-1]
+
+
+def test_answers_are_reused_until_knowledge_is_added(answers, fake_llm):
+    question = "What is the credit percentage in section 2?"
+    knowledge_module.add_to_knowledge(synthetic_legislation(3))
+    assert answer(question) == "First answer."
+    fake_llm.default = "Second answer."
+    assert answer(question) == "First answer."
+    assert answers.stats()["hits"] == 1
+    # Retrieval used every chunk, so any new chunk could change the answer.
+    knowledge_module.add_to_knowledge(synthetic_legislation(3, seed=1))
+    assert answers.stats()["invalidations"] == 1
+    assert answer(question) == "Second answer."
@@ -0,0 +1,118 @@
+import asyncio
+
+from capabilities.helpers.concurrency import StreamCoalescer
+
+
+class Upstream:
+    """A stream whose items are released one at a time by the test."""
+
+    def __init__(self, items, error=None):
+        self.items = items
+        self.error = error
+        self.calls = 0
+        self.cancelled = False
+        self.release = asyncio.Semaphore(0)
+
+    async def stream(self):
+        self.calls += 1
+        try:
+            for item in self.items:
+                await self.release.acquire()
+                yield item
+            if self.error is not None:
+                raise self.error
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+
+async def collect(stream, into):
+    async for item in stream:
+        into.append(item)
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_followers_share_one_upstream_stream():
+    async def main():
+        coalescer = StreamCoalescer()
+        upstream = Upstream(["a", "b", "c"])
+        completed = []
+        first, second = [], []
+        leader = asyncio.create_task(
+            collect(
+                coalescer.stream("key", upstream.stream, completed.append),
+                first,
+            )
+        )
+        upstream.release.release()
+        await settle()
+        assert first == ["a"]
+        # A follower joining late replays the items it missed.
+        follower = asyncio.create_task(
+            collect(coalescer.stream("key", upstream.stream), second)
+        )
+        upstream.release.release()
+        upstream.release.release()
+        await asyncio.gather(leader, follower)
+        assert first == second == ["a", "b", "c"]
+        assert upstream.calls == 1
+        assert (coalescer.started, coalescer.joined) == (1, 1)
+        assert completed == [["a", "b", "c"]]
+        assert coalescer.in_flight == {}
+
+    asyncio.run(main())
+
+
+def test_distinct_keys_and_finished_streams_start_afresh():
+    async def main():
+        coalescer = StreamCoalescer()
+        upstream = Upstream(["a"])
+        for key in ("one", "two", "one"):
+            upstream.release.release()
+            items = []
+            await collect(coalescer.stream(key, upstream.stream), items)
+            assert items == ["a"]
+        assert upstream.calls == 3
+        assert (coalescer.started, coalescer.joined) == (3, 0)
+
+    asyncio.run(main())
+
+
+def test_errors_reach_every_follower():
+    async def main():
+        coalescer = StreamCoalescer()
+        upstream = Upstream(["a"], error=RuntimeError("upstream failed"))
+        completed = []
+        streams = [
+            coalescer.stream("key", upstream.stream, completed.append)
+            for _ in range(2)
+        ]
+        upstream.release.release()
+        results = await asyncio.gather(
+            *(collect(stream, []) for stream in streams),
+            return_exceptions=True,
+        )
+        assert [str(r) for r in results] == ["upstream failed"] * 2
+        assert completed == []
+
+    asyncio.run(main())
+
+
+def test_upstream_is_cancelled_when_every_follower_stops():
+    async def main():
+        coalescer = StreamCoalescer()
+        upstream = Upstream(["a", "b"])
+        streams = [coalescer.stream("key", upstream.stream) for _ in range(2)]
+        upstream.release.release()
+        for stream in streams:
+            assert await stream.__anext__() == "a"
+            await stream.aclose()
+        await settle()
+        assert upstream.cancelled
+        assert coalescer.in_flight == {}
+
+    asyncio.run(main())
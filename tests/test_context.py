@@ -0,0 +1,135 @@
+import importlib
+
+import numpy as np
+import pytest
+
+from benchmarks.common import HashingEmbedder
+from capabilities.helpers.cache import EmbeddingCache
+from capabilities.helpers.context import (
+    MIN_CHUNK_TOKENS,
+    count_tokens,
+    pack_context,
+    retrieve_context,
+    trim_to_budget,
+)
+from capabilities.helpers.knowledge_bases import NumPyKnowledgeBase
+
+context_module = importlib.import_module("capabilities.helpers.context")
+
+
+@pytest.fixture(autouse=True)
+def without_tiktoken(monkeypatch):
+    """Count tokens with the regex estimate, whether or not tiktoken is installed."""
+    monkeypatch.setattr(context_module, "_get_encoding", lambda model: None)
+
+
+def chunk(i: int, tokens: int = 50) -> str:
+    """A chunk of exactly `tokens` estimated tokens, sharing no words with other chunks."""
+    return f"Chunk {i}: " + " ".join(f"w{i}x{j}" for j in range(tokens - 3))
+
+
+def results(texts):
+    return [(f"id{i}", text, 1.0 - i / 100) for i, text in enumerate(texts)]
+
+
+def test_tokens_are_estimated_as_words_and_punctuation():
+    assert count_tokens("Section 32(b)(1): the credit.") == 12
+    assert count_tokens(chunk(7)) == 50
+    assert count_tokens("\n") == 0
+
+
+def test_trimming_cuts_at_blank_lines():
+    text = "One two.\n\nThree four five.\n  \nSix."
+    assert trim_to_budget(text, 9) == (text, 9)
+    assert trim_to_budget(text, 8) == ("One two.\n\nThree four five.", 7)
+    assert trim_to_budget(text, 7) == ("One two.\n\nThree four five.", 7)
+    assert trim_to_budget(text, 6) == ("One two.", 3)
+    # Even the first section doesn't fit.
+    assert trim_to_budget(text, 2) == ("", 0)
+
+
+def test_packing_stays_within_the_budget_in_score_order():
+    context = pack_context(results(chunk(i) for i in range(10)), 175)
+    assert [id for id, _, _ in context.chunks] == ["id0", "id1", "id2"]
+    assert context.tokens == 150 == count_tokens(context.text)
+
+
+def test_packing_drops_near_duplicates():
+    original = chunk(0)
+    reworded = original.replace("Chunk 0:", "Chunk zero -") + " extra"
+    context = pack_context(results([original, reworded, chunk(2)]), 1_000)
+    assert [id for id, _, _ in context.chunks] == ["id0", "id2"]
+
+
+def test_packing_trims_the_last_chunk_at_a_section_boundary():
+    sections = "\n\n".join(chunk(10 + i, 40) for i in range(3))
+    context = pack_context(results([chunk(0), sections]), 150)
+    assert context.chunks[1][1] == "\n\n".join(
+        chunk(10 + i, 40) for i in range(2)
+    )
+    assert context.tokens == 130
+
+
+def test_packing_stops_when_too_little_budget_is_left():
+    budget = 100 + MIN_CHUNK_TOKENS - 1
+    short = "A short chunk."
+    context = pack_context(results([chunk(0), chunk(1), short]), budget)
+    assert [id for id, _, _ in context.chunks] == ["id0", "id1"]
+
+
+@pytest.fixture
+def knowledge():
+    """A knowledge base which records how many results each search asks for."""
+    knowledge = NumPyKnowledgeBase(
+        model=HashingEmbedder(dim=64), embedding_cache=EmbeddingCache()
+    )
+    knowledge.depths = []
+    search_embeddings = knowledge.search_embeddings
+
+    def recording_search(query_embeddings, top_n=1, **kwargs):
+        knowledge.depths.append(top_n)
+        return search_embeddings(query_embeddings, top_n, **kwargs)
+
+    knowledge.search_embeddings = recording_search
+    return knowledge
+
+
+def fill(knowledge: NumPyKnowledgeBase, n: int):
+    texts = [chunk(i) for i in range(n)]
+    knowledge.add_embedded(texts, knowledge.model.encode(texts))
+
+
+QUERY = HashingEmbedder(dim=64).encode("w0x1 w1x1 w2x1")
+
+
+def test_depth_grows_until_the_budget_is_filled(knowledge):
+    fill(knowledge, 100)
+    context = retrieve_context(knowledge, QUERY, 1_000)
+    assert knowledge.depths == [4, 8, 16, 32]
+    assert len(context.chunks) == 20 and context.tokens == 1_000
+    assert not context.exhausted
+
+
+def test_depth_stops_growing_at_the_maximum(knowledge):
+    fill(knowledge, 100)
+    context = retrieve_context(knowledge, QUERY, 100_000)
+    assert knowledge.depths == [4, 8, 16, 32, 64]
+    assert len(context.chunks) == 64 and not context.exhausted
+
+
+def test_depth_stops_once_every_chunk_is_considered(knowledge):
+    fill(knowledge, 10)
+    context = retrieve_context(knowledge, QUERY, 100_000)
+    assert knowledge.depths == [4, 8, 16]
+    assert len(context.chunks) == 10 and context.exhausted
+
+
+def test_budget_filled_by_the_first_search_stops_there(knowledge):
+    fill(knowledge, 10)
+    context = retrieve_context(knowledge, QUERY, 120)
+    assert knowledge.depths == [4]
+    assert context.tokens <= 120 and len(context.chunks) == 2
+    np.testing.assert_array_equal(
+        [score for _, _, score in context.chunks],
+        sorted((score for _, _, score in context.chunks), reverse=True),
+    )
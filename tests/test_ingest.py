@@ -0,0 +1,97 @@
+import importlib
+import json
+
+import pytest
+
+from benchmarks.common import HashingEmbedder, synthetic_legislation
+from capabilities.helpers.knowledge_bases import NumPyKnowledgeBase
+
+ingest_module = importlib.import_module("capabilities.ingest")
+
+TASK_SIZE = 16
+
+
+class Interrupted(Exception):
+    pass
+
+
+class InterruptedEmbedder(HashingEmbedder):
+    """Fails on the call after `batches` calls, like a run killed part-way through."""
+
+    def __init__(self, batches: int):
+        super().__init__(dim=32)
+        self.batches = batches
+
+    def encode(self, sentences, **kwargs):
+        if self.batches == 0:
+            raise Interrupted()
+        self.batches -= 1
+        return super().encode(sentences, **kwargs)
+
+
+@pytest.fixture
+def source(tmp_path):
+    documents = tmp_path / "documents"
+    documents.mkdir()
+    for i in range(4):
+        (documents / f"{i}.txt").write_text(synthetic_legislation(5, seed=i))
+    return str(documents)
+
+
+def run(monkeypatch, source, output, checkpoint, model):
+    monkeypatch.setattr(ingest_module, "get_embedding_model", lambda _: model)
+    knowledge = NumPyKnowledgeBase()
+    if (output / "ids.offsets.npy").exists():
+        knowledge.load(str(output))
+    return ingest_module.ingest(
+        source,
+        knowledge,
+        workers=0,
+        task_size=TASK_SIZE,
+        checkpoint_path=str(checkpoint),
+        checkpoint_interval=0,
+        save=lambda: knowledge.save(str(output)),
+    )
+
+
+def saved_ids(output):
+    knowledge = NumPyKnowledgeBase()
+    knowledge.load(str(output))
+    return list(knowledge.ids)
+
+
+def test_resuming_an_interrupted_run_adds_every_chunk_once(
+    source, tmp_path, monkeypatch
+):
+    complete = tmp_path / "complete"
+    result = run(
+        monkeypatch,
+        source,
+        complete,
+        tmp_path / "complete.json",
+        HashingEmbedder(dim=32),
+    )
+    expected = saved_ids(complete)
+    assert len(expected) == result["chunks"] > 2 * TASK_SIZE
+    assert len(set(expected)) == len(expected)
+
+    output, checkpoint = tmp_path / "output", tmp_path / "checkpoint.json"
+    with pytest.raises(Interrupted):
+        run(
+            monkeypatch,
+            source,
+            output,
+            checkpoint,
+            InterruptedEmbedder(batches=1),
+        )
+    progress = json.loads(checkpoint.read_text())
+    assert progress["chunks"] == len(saved_ids(output)) == TASK_SIZE
+    # The first batch ends part-way through a document, which is read again on resuming.
+    assert progress["documents"] == 0
+
+    result = run(
+        monkeypatch, source, output, checkpoint, HashingEmbedder(dim=32)
+    )
+    assert saved_ids(output) == expected
+    assert result["chunks"] == len(expected)
+    assert result["documents"] == 4
@@ -0,0 +1,91 @@
+from benchmarks.common import HashingEmbedder
+import json
+import os
+
+from capabilities.helpers.knowledge_bases import (
+    ChromaKnowledgeBase,
+    NumPyKnowledgeBase,
+    ShardedKnowledgeBase,
+    chroma_shard_factory,
+    chroma_shard_keys,
+    get_chroma_client,
+    shard_name,
+)
+
+CHUNKS = [
+    "Income tax is charged for each tax year on total income.",
+    "The personal allowance is reduced by one pound for every two pounds.",
+]
+
+
+def test_saving_a_chroma_collection_renames_it():
+    knowledge = ChromaKnowledgeBase(model=HashingEmbedder(), name="unsaved")
+    knowledge.add_embedded(CHUNKS, knowledge.embed(CHUNKS))
+    knowledge.save("unsaved")
+    knowledge.save("saved-laws")
+    names = {c.name for c in get_chroma_client().list_collections()}
+    assert "saved-laws" in names and "unsaved" not in names
+    loaded = ChromaKnowledgeBase(model=HashingEmbedder())
+    loaded.load("saved-laws")
+    assert loaded.collection.count() == len(CHUNKS)
+
+
+def sharded(factory, **kwargs) -> ShardedKnowledgeBase:
+    return ShardedKnowledgeBase(factory, model=HashingEmbedder(), **kwargs)
+
+
+def add_jurisdictions(knowledge: ShardedKnowledgeBase):
+    metadatas = [{"jurisdiction": "uk"}, {"jurisdiction": "us-ny"}]
+    knowledge.add_embedded(
+        CHUNKS, knowledge.embed(CHUNKS), metadatas=metadatas
+    )
+
+
+def test_persisted_chroma_shards_are_found_again():
+    add_jurisdictions(sharded(chroma_shard_factory("discovered")))
+    assert chroma_shard_keys("discovered") == ["uk", "us-ny"]
+    # Another process, or the app after a restart, starts with no shards open.
+    knowledge = sharded(
+        chroma_shard_factory("discovered"),
+        discover=lambda: chroma_shard_keys("discovered"),
+    )
+    assert knowledge.shards == {}
+    (results,) = knowledge.search_embeddings(
+        knowledge.embed([CHUNKS[1]]), top_n=2
+    )
+    assert [text for _, text, _ in results][0] == CHUNKS[1]
+    assert sorted(knowledge.shards) == ["uk", "us-ny"]
+    (results,) = knowledge.search_embeddings(
+        knowledge.embed([CHUNKS[1]]),
+        top_n=2,
+        filters={"jurisdiction": "uk"},
+    )
+    assert [text for _, text, _ in results] == [CHUNKS[0]]
+
+
+def test_collections_created_without_the_shard_key_gain_it():
+    ChromaKnowledgeBase(name=f"legacy-{shard_name('uk')}").collection
+    assert chroma_shard_keys("legacy") == []
+    chroma_shard_factory("legacy")("uk").collection
+    assert chroma_shard_keys("legacy") == ["uk"]
+
+
+def test_saving_keeps_chroma_shards_in_place(tmp_path):
+    knowledge = sharded(chroma_shard_factory("kept"))
+    add_jurisdictions(knowledge)
+    knowledge.save(str(tmp_path))
+    assert chroma_shard_keys("kept") == ["uk", "us-ny"]
+    with open(tmp_path / "shards.json") as f:
+        assert json.load(f)["shards"] == {}
+
+
+def test_numpy_shards_are_saved_to_directories(tmp_path):
+    knowledge = sharded(
+        lambda key: NumPyKnowledgeBase(model=HashingEmbedder())
+    )
+    add_jurisdictions(knowledge)
+    knowledge.save(str(tmp_path))
+    loaded = sharded(lambda key: NumPyKnowledgeBase(model=HashingEmbedder()))
+    loaded.load(str(tmp_path))
+    assert sorted(loaded.shards) == ["uk", "us-ny"]
+    assert len(os.listdir(tmp_path)) == 3
@@ -0,0 +1,156 @@
+import numpy as np
+import pytest
+
+from benchmarks.common import HashingEmbedder, synthetic_legislation
+from capabilities.helpers.cache import EmbeddingCache
+from capabilities.helpers.knowledge_bases import (
+    HYBRID,
+    LEXICAL,
+    PREFILTER,
+    NumPyKnowledgeBase,
+)
+from capabilities.helpers.lexical import (
+    LexicalIndex,
+    cites_section,
+    reciprocal_rank_fusion,
+    tokenize,
+)
+from capabilities.helpers.text_splitters import section_header_split
+
+TEXTS = [
+    "The personal allowance is reduced for income above the threshold.",
+    "The earned income credit is a percentage of earned income.",
+    "Income tax is charged on the total income of the tax year.",
+    "Child benefit is paid for each child.",
+    "The credit percentage is 34 percent for 1 qualifying child.",
+]
+
+
+def test_section_references_are_kept_whole():
+    assert tokenize("Under § 32(b)(1) the credit") == [
+        "under",
+        "§32",
+        "§32(b)",
+        "§32(b)(1)",
+        "32",
+        "b",
+        "1",
+        "credit",
+    ]
+    assert tokenize("§32A and §1.401(k)-1") == [
+        "§32a",
+        "32a",
+        "§1.401",
+        "§1.401(k)",
+        "1",
+        "401",
+        "k",
+        "1",
+    ]
+    assert cites_section("What does § 32(b) say?")
+    assert not cites_section("What does section 32 say?")
+
+
+def test_bm25_ranks_rare_frequent_terms_in_short_rows_first():
+    index = LexicalIndex()
+    index.add(TEXTS)
+    rows, scores = index.search("earned income credit", top_n=5)
+    # Every row mentions income, but only two mention the rarer "credit".
+    assert rows.tolist()[:2] == [1, 4]
+    assert np.all(np.diff(scores) <= 0)
+    assert set(rows.tolist()) == {0, 1, 2, 4}
+    rows, _ = index.search("child", top_n=5)
+    # "child" appears twice in the shorter row.
+    assert rows.tolist() == [3, 4]
+    assert len(index.search("pension", top_n=5)[0]) == 0
+
+
+def test_mask_limits_the_rows_returned():
+    index = LexicalIndex()
+    index.add(TEXTS)
+    mask = np.array([True, False, True, True, True])
+    rows, _ = index.search("earned income credit", top_n=5, mask=mask)
+    assert 1 not in rows.tolist() and rows.tolist()[0] == 4
+
+
+def search(index: LexicalIndex, query: str):
+    rows, scores = index.search(query, top_n=10)
+    return rows.tolist(), scores.round(5).tolist()
+
+
+@pytest.mark.parametrize("batch", [1, 2, 5])
+def test_adding_in_batches_matches_adding_at_once(batch):
+    whole, incremental = LexicalIndex(), LexicalIndex()
+    whole.add(TEXTS)
+    for start in range(0, len(TEXTS), batch):
+        incremental.add(TEXTS[start : start + batch])
+        # Searching in between caches term weights, which later rows must reset.
+        incremental.search("income credit")
+    assert len(incremental) == len(whole) == len(TEXTS)
+    for query in ("income credit", "child", "tax year"):
+        assert search(incremental, query) == search(whole, query)
+
+
+def test_save_and_load_keep_results(tmp_path):
+    index = LexicalIndex(k1=1.5, b=0.5)
+    index.add(TEXTS)
+    index.save(str(tmp_path / "lexical.npz"))
+    loaded = LexicalIndex()
+    loaded.load(str(tmp_path / "lexical.npz"))
+    assert (loaded.k1, loaded.b) == (1.5, 0.5)
+    for query in ("income credit", "child", "tax year"):
+        assert search(loaded, query) == search(index, query)
+    # Rows can still be added after loading.
+    loaded.add(["A new child credit."])
+    assert 5 in search(loaded, "child")[0]
+
+
+def test_weighted_fusion_favours_the_heavier_ranking():
+    rankings = [["a", "b"], ["c", "b"]]
+    assert reciprocal_rank_fusion(rankings) == ["b", "a", "c"]
+    assert reciprocal_rank_fusion(rankings, weights=[64, 1]) == [
+        "a",
+        "b",
+        "c",
+    ]
+
+
+@pytest.fixture(scope="module")
+def statute():
+    knowledge = NumPyKnowledgeBase(
+        model=HashingEmbedder(dim=64), embedding_cache=EmbeddingCache()
+    )
+    knowledge.add(synthetic_legislation(200), section_header_split)
+    return knowledge
+
+
+def test_prefilter_only_scores_keyword_matches(statute, monkeypatch):
+    query = "income threshold for the credit"
+    scored = []
+    chunks = statute._chunks
+
+    def recording_chunks(ids, rows, query_embedding=None):
+        scored.append(len(rows))
+        return chunks(ids, rows, query_embedding)
+
+    monkeypatch.setattr(statute, "_chunks", recording_chunks)
+    monkeypatch.setattr(statute, "LEXICAL_CANDIDATES", 20)
+    [results] = statute.search_embeddings(
+        statute.model.encode([query]), 5, queries=[query], mode=PREFILTER
+    )
+    assert scored == [20] and statute.size > 20
+    candidates, _ = statute.lexical_index.search(query, 20)
+    matches = {statute.ids[row] for row in candidates}
+    assert len(results) == 5 and {id for id, _, _ in results} <= matches
+
+
+@pytest.mark.parametrize("mode", [LEXICAL, HYBRID, PREFILTER])
+def test_section_queries_find_the_section(statute, mode):
+    for section in (7, 42, 150):
+        query = f"What is the income threshold in § {section}(a)?"
+        [results] = statute.search_embeddings(
+            statute.model.encode([query]), 5, queries=[query], mode=mode
+        )
+        assert any(
+            text.startswith(f" {section}.") for _, text, _ in results
+        ), (mode, section)
@@ -0,0 +1,168 @@
+import importlib
+import threading
+import time
+
+import pytest
+
+from capabilities.helpers.concurrency import ordered_fan_out
+
+model_policy_module = importlib.import_module("capabilities.model_policy")
+
+INFORMATION = "Raise the personal allowance to £15,000."
+PLAN = """Files needed:
+1. parameters/gov/hmrc/income_tax/allowances/personal_allowance.yaml
+2. variables/gov/hmrc/income_tax/personal_allowance.py
+Then parameters/gov/hmrc/income_tax/allowances/personal_allowance.yaml again,
+and variables/notes.txt, which isn't a parameter or variable file.
+"""
+PATHS = [
+    "parameters/gov/hmrc/income_tax/allowances/personal_allowance.yaml",
+    "variables/gov/hmrc/income_tax/personal_allowance.py",
+]
+
+
+class CountingBuilder:
+    """A prompt builder that records what it is asked to build."""
+
+    def __init__(self):
+        self.calls = []
+
+    def build(self, information, **kwargs):
+        self.calls.append(information)
+        return "Full prompt.\n\n" + information
+
+
+def test_plan_paths_keeps_file_paths_once_in_order():
+    assert model_policy_module._plan_paths(PLAN) == PATHS
+    assert model_policy_module._plan_paths("No files needed.") == []
+
+
+def test_plan_files_parses_the_planning_response(fake_llm):
+    prompt = model_policy_module.PLAN_PROMPT + INFORMATION
+    fake_llm.responses[fake_llm.key(prompt, model_policy_module.MODEL)] = PLAN
+    assert model_policy_module.plan_files(INFORMATION) == PATHS
+
+
+@pytest.fixture
+def pipeline(fake_llm, monkeypatch):
+    """Plan two files and answer each file prompt with one code block and trailing commentary."""
+    fake_llm.responses[
+        fake_llm.key(
+            model_policy_module.PLAN_PROMPT + INFORMATION,
+            model_policy_module.MODEL,
+        )
+    ] = PLAN
+    for path in PATHS:
+        fake_llm.responses[
+            fake_llm.key("File prompt: " + path, model_policy_module.MODEL)
+        ] = f"```\n# {path}\n```\nCommentary that isn't read."
+    monkeypatch.setattr(
+        model_policy_module,
+        "_file_prompt",
+        lambda path, files, information: "File prompt: " + path,
+    )
+    builder = CountingBuilder()
+    monkeypatch.setattr(model_policy_module, "PROMPT_BUILDER", builder)
+    return builder
+
+
+def test_pipeline_does_not_build_the_full_prompt(pipeline):
+    output = list(
+        model_policy_module.model_policy(INFORMATION, pipeline=True)
+    )[-1]
+    assert pipeline.calls == []
+    assert output.index(PATHS[0]) < output.index(PATHS[1])
+    assert "# " + PATHS[1] in output
+    assert "Commentary" not in output
+
+
+def test_pipeline_builds_the_full_prompt_to_validate(pipeline):
+    list(
+        model_policy_module.model_policy(
+            INFORMATION, pipeline=True, validate=True
+        )
+    )
+    assert pipeline.calls == [INFORMATION]
+
+
+def test_single_prompt_mode_builds_the_full_prompt(pipeline):
+    list(model_policy_module.model_policy(INFORMATION))
+    assert pipeline.calls == [INFORMATION]
+
+
+def test_ordered_fan_out_yields_in_task_order():
+    def task(i, delay):
+        def run():
+            for j in range(3):
+                time.sleep(delay)
+                yield (i, j)
+
+        return run
+
+    # Later tasks finish first, but their items wait for the earlier ones.
+    tasks = [task(0, 0.02), task(1, 0.01), task(2, 0)]
+    items = list(ordered_fan_out(tasks, max_concurrency=3))
+    assert items == [(i, (i, j)) for i in range(3) for j in range(3)]
+
+
+def test_ordered_fan_out_raises_task_errors_in_order():
+    def fail():
+        yield "partial"
+        raise RuntimeError("boom")
+
+    stream = ordered_fan_out([lambda: iter(["first"]), fail])
+    assert next(stream) == (0, "first")
+    assert next(stream) == (1, "partial")
+    with pytest.raises(RuntimeError, match="boom"):
+        next(stream)
+
+
+def test_ordered_fan_out_stops_tasks_when_closed():
+    produced = []
+    started = threading.Event()
+
+    def endless(i):
+        def run():
+            n = 0
+            while True:
+                started.set()
+                produced.append(i)
+                yield n
+                n += 1
+                time.sleep(0.001)
+
+        return run
+
+    stream = ordered_fan_out([endless(0), endless(1)], max_concurrency=2)
+    assert next(stream) == (0, 0)
+    started.wait()
+    stream.close()
+    time.sleep(0.05)
+    count = len(produced)
+    time.sleep(0.05)
+    assert len(produced) == count
+
+
+def test_ordered_fan_out_holds_the_shared_semaphore():
+    semaphore = threading.BoundedSemaphore(2)
+    lock = threading.Lock()
+    running = [0]
+    peak = [0]
+
+    def task():
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+        yield "done"
+
+    # More workers than the semaphore allows, so only it can keep the count down.
+    items = list(
+        ordered_fan_out([task] * 6, max_concurrency=6, semaphore=semaphore)
+    )
+    assert [item for _, item in items] == ["done"] * 6
+    assert peak[0] <= 2
+    # Every task released it.
+    assert all(semaphore.acquire(blocking=False) for _ in range(2))
@@ -0,0 +1,151 @@
+import numpy as np
+import pytest
+
+from capabilities.helpers.knowledge_bases import NumPyKnowledgeBase
+
+DIM = 16
+
+
+def unit_rows(n: int, seed: int = 0) -> np.ndarray:
+    rows = np.random.default_rng(seed).standard_normal((n, DIM))
+    return (rows / np.linalg.norm(rows, axis=1, keepdims=True)).astype(
+        np.float32
+    )
+
+
+def numpy_knowledge(**kwargs) -> NumPyKnowledgeBase:
+    knowledge = NumPyKnowledgeBase(**kwargs)
+    # Small buffers and score blocks, so a few rows exercise growth and blocking.
+    knowledge.INITIAL_CAPACITY = 4
+    knowledge.SCORE_BLOCK_SIZE = 3
+    return knowledge
+
+
+def add_rows(knowledge: NumPyKnowledgeBase, rows: np.ndarray, batch: int):
+    for start in range(0, len(rows), batch):
+        end = start + batch
+        knowledge.add_embedded(
+            [f"chunk {i}" for i in range(start, min(end, len(rows)))],
+            rows[start:end],
+        )
+
+
+def search(knowledge: NumPyKnowledgeBase, queries: np.ndarray, top_n=5):
+    return [
+        [value for _, value, _ in results]
+        for results in knowledge.search_embeddings(queries, top_n)
+    ]
+
+
+def test_buffer_doubles_when_full():
+    knowledge = numpy_knowledge()
+    capacities = []
+    for i in range(20):
+        add_rows(knowledge, unit_rows(1, seed=i), batch=1)
+        capacities.append(len(knowledge._embeddings))
+    assert capacities == [4] * 4 + [8] * 4 + [16] * 8 + [32] * 4
+    assert knowledge.size == 20
+    # A batch bigger than double the buffer grows it to fit at once.
+    add_rows(knowledge, unit_rows(100, seed=99), batch=100)
+    assert len(knowledge._embeddings) == 120
+
+
+def test_growth_keeps_every_row():
+    rows = unit_rows(50)
+    knowledge = numpy_knowledge()
+    add_rows(knowledge, rows, batch=7)
+    np.testing.assert_array_equal(knowledge.embeddings_array, rows)
+    assert knowledge.data == [f"chunk {i}" for i in range(50)]
+
+
+def test_results_do_not_depend_on_batch_size():
+    rows, queries = unit_rows(50), unit_rows(4, seed=1)
+    results = []
+    for batch in (1, 7, 50):
+        knowledge = numpy_knowledge()
+        add_rows(knowledge, rows, batch)
+        results.append(search(knowledge, queries))
+    assert results[0] == results[1] == results[2]
+    expected = np.argsort(-(queries @ rows.T), axis=1)[:, :5]
+    assert results[0] == [[f"chunk {i}" for i in row] for row in expected]
+
+
+@pytest.mark.parametrize("n_queries", [1, 4])
+def test_float16_scores_match_float32(n_queries):
+    rows, queries = unit_rows(50), unit_rows(n_queries, seed=1)
+    query = queries if n_queries > 1 else queries[0]
+    knowledge = {}
+    for dtype in (np.float32, np.float16):
+        knowledge[dtype] = numpy_knowledge(dtype=dtype)
+        add_rows(knowledge[dtype], rows, batch=7)
+    assert knowledge[np.float16].embeddings_array.dtype == np.float16
+    scores = knowledge[np.float16]._scores(query)
+    assert scores.dtype == np.float32
+    np.testing.assert_allclose(
+        scores, knowledge[np.float32]._scores(query), atol=2e-3
+    )
+    assert search(knowledge[np.float16], queries) == search(
+        knowledge[np.float32], queries
+    )
+
+
+def reopen(path) -> NumPyKnowledgeBase:
+    knowledge = NumPyKnowledgeBase()
+    knowledge.load(str(path))
+    return knowledge
+
+
+def test_empty_round_trip_then_add(tmp_path):
+    NumPyKnowledgeBase().save(str(tmp_path))
+    knowledge = reopen(tmp_path)
+    assert knowledge.size == 0 and len(knowledge.data) == 0
+    assert search(knowledge, unit_rows(1)) == [[]]
+    rows = unit_rows(3)
+    add_rows(knowledge, rows, batch=3)
+    np.testing.assert_array_equal(knowledge.embeddings_array, rows)
+    assert search(knowledge, rows[:1], top_n=1) == [["chunk 0"]]
+
+
+def test_round_trip_keeps_chunks_and_results(tmp_path):
+    rows, queries = unit_rows(20), unit_rows(3, seed=1)
+    knowledge = numpy_knowledge()
+    knowledge.add_embedded(
+        [f"chunk {i}" for i in range(20)],
+        rows,
+        metadatas=[{"jurisdiction": "uk"}] * 20,
+    )
+    knowledge.save(str(tmp_path))
+    loaded = reopen(tmp_path)
+    np.testing.assert_array_equal(loaded.embeddings_array, rows)
+    assert list(loaded.data) == list(knowledge.data)
+    assert list(loaded.ids) == list(knowledge.ids)
+    assert loaded.get_metadata(3) == {"jurisdiction": "uk"}
+    assert search(loaded, queries) == search(knowledge, queries)
+
+
+def test_append_after_load_then_save_again(tmp_path):
+    rows = unit_rows(30)
+    knowledge = numpy_knowledge()
+    add_rows(knowledge, rows[:20], batch=20)
+    knowledge.save(str(tmp_path))
+    loaded = reopen(tmp_path)
+    assert loaded.new_ids(["x", loaded.ids[0]]) == ["x"]
+    loaded.add_embedded([f"chunk {i}" for i in range(20, 30)], rows[20:])
+    loaded.save(str(tmp_path))
+    final = reopen(tmp_path)
+    np.testing.assert_array_equal(final.embeddings_array, rows)
+    assert list(final.data) == [f"chunk {i}" for i in range(30)]
+
+
+def test_loaded_embeddings_are_read_only_maps(tmp_path):
+    rows = unit_rows(10)
+    knowledge = numpy_knowledge()
+    add_rows(knowledge, rows, batch=10)
+    knowledge.save(str(tmp_path))
+    loaded = reopen(tmp_path)
+    assert isinstance(loaded._embeddings, np.memmap)
+    assert not loaded.embeddings_array.flags.writeable
+    # Adding copies the rows into a writable buffer, leaving the file alone.
+    loaded.add_embedded(["extra"], unit_rows(1, seed=5))
+    assert not isinstance(loaded._embeddings, np.memmap)
+    np.testing.assert_array_equal(reopen(tmp_path).embeddings_array, rows)
@@ -0,0 +1,79 @@
+import importlib
+
+import pytest
+
+from benchmarks.common import HashingEmbedder
+from capabilities.helpers import knowledge_bases
+from capabilities.helpers.cache import EmbeddingCache
+from capabilities.helpers.context import count_tokens
+from capabilities.helpers.prompts import (
+    PARAMETERS,
+    VARIABLES,
+    ExampleLibrary,
+    set_example_library,
+)
+
+POLICY = "Raise the UK personal allowance to £15,000 from April 2025."
+CAPABILITIES = ("create_parameters", "create_variables", "model_policy")
+
+
+@pytest.fixture
+def library():
+    library = ExampleLibrary(model=HashingEmbedder())
+    # Keep these embeddings apart from any made with the real model's name.
+    library.knowledge.embedding_cache = EmbeddingCache()
+    set_example_library(library)
+    yield library
+    set_example_library(None)
+
+
+@pytest.fixture
+def broken_library(monkeypatch):
+    def get_embedding_model(name):
+        raise ModuleNotFoundError("No module named 'sentence_transformers'")
+
+    monkeypatch.setattr(
+        knowledge_bases, "get_embedding_model", get_embedding_model
+    )
+    library = ExampleLibrary()
+    library.knowledge.embedding_cache = EmbeddingCache()
+    set_example_library(library)
+    yield library
+    set_example_library(None)
+
+
+@pytest.mark.parametrize("name", CAPABILITIES)
+def test_prompts_fall_back_to_the_templates(broken_library, name):
+    module = importlib.import_module(f"capabilities.{name}")
+    assert module.PROMPT_BUILDER.build(POLICY) == module.PROMPT + POLICY
+
+
+@pytest.mark.parametrize("name", CAPABILITIES)
+def test_prompts_with_examples_are_no_longer_than_the_templates(library, name):
+    module = importlib.import_module(f"capabilities.{name}")
+    prompt = module.PROMPT_BUILDER.build(POLICY)
+    assert prompt != module.PROMPT + POLICY
+    assert prompt.endswith(module.CLOSING + POLICY)
+    assert count_tokens(prompt) <= count_tokens(module.PROMPT + POLICY)
+
+
+def test_select_keeps_to_the_budget(library):
+    examples = library.select(POLICY, budget=10_000, max_examples=3)
+    assert len(examples) == 3
+    # The best example of each kind is always included, and kinds stay in order.
+    kinds = [e.kind for e in examples]
+    assert set(kinds) == {PARAMETERS, VARIABLES}
+    assert kinds == sorted(kinds, key=[PARAMETERS, VARIABLES].index)
+
+    smallest = min(e.tokens for e in library.examples.values())
+    assert library.select(POLICY, budget=smallest - 1) == []
+    for budget in (smallest, 150, 300, 600):
+        examples = library.select(POLICY, budget=budget)
+        assert examples and sum(e.tokens for e in examples) <= budget
+
+
+def test_select_only_shows_the_kinds_asked_for(library):
+    examples = library.select(POLICY, kinds=[VARIABLES], budget=10_000)
+    assert examples and {e.kind for e in examples} == {VARIABLES}
+    assert library.select(POLICY, budget=0) == []
+    assert library.select(POLICY, max_examples=0) == []
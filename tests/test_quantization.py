@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from capabilities.helpers.knowledge_bases import NumPyKnowledgeBase
+from capabilities.helpers.quantization import (
+    ProductQuantizer,
+    ScalarQuantizer,
+    load_quantizer,
+)
+
+DIM = 32
+
+
+def unit_rows(n: int, seed: int = 0) -> np.ndarray:
+    rows = np.random.default_rng(seed).standard_normal((n, DIM))
+    return (rows / np.linalg.norm(rows, axis=1, keepdims=True)).astype(
+        np.float32
+    )
+
+
+def pq(**kwargs) -> ProductQuantizer:
+    return ProductQuantizer(n_subvectors=8, **kwargs)
+
+
+def test_scalar_round_trip():
+    rows = unit_rows(100)
+    quantizer = ScalarQuantizer()
+    codes = quantizer.encode(rows)
+    assert codes.shape == (100, quantizer.code_size(DIM))
+    # Each value is within half a step of 1/127 of the row's largest magnitude.
+    assert np.abs(quantizer.decode(codes) - rows).max() < 0.01
+    queries = unit_rows(3, seed=1)
+    np.testing.assert_allclose(
+        quantizer.score(codes, queries), queries @ rows.T, atol=0.02
+    )
+
+
+def test_product_round_trip():
+    rows = unit_rows(2_000)
+    quantizer = pq()
+    quantizer.train(rows)
+    codes = quantizer.encode(rows)
+    assert codes.shape == (2_000, 8) and codes.dtype == np.uint8
+    decoded = quantizer.decode(codes)
+    assert np.mean(np.sum((decoded - rows) ** 2, axis=1)) < 0.5
+    queries = unit_rows(3, seed=1)
+    np.testing.assert_allclose(
+        quantizer.score(codes, queries), queries @ decoded.T, atol=1e-5
+    )
+
+
+def test_product_training_needs_a_row_per_centroid():
+    with pytest.raises(ValueError, match="at least 256 rows"):
+        pq().train(unit_rows(100))
+
+
+@pytest.mark.parametrize("kind", ["scalar", "product"])
+def test_load_quantizer_restores_either_kind(tmp_path, kind):
+    rows = unit_rows(500)
+    quantizer = ScalarQuantizer() if kind == "scalar" else pq(seed=3)
+    quantizer.train(rows)
+    path = str(tmp_path / "quantizer.npz")
+    quantizer.save(path)
+    loaded = load_quantizer(path)
+    assert type(loaded) is type(quantizer) and loaded.trained
+    np.testing.assert_array_equal(loaded.encode(rows), quantizer.encode(rows))
+
+
+def test_knowledge_base_trains_once_it_has_enough_rows():
+    rows = unit_rows(600)
+    knowledge = NumPyKnowledgeBase(quantizer=pq(min_train_sample=300))
+    for start in range(0, 600, 100):
+        batch = rows[start : start + 100]
+        knowledge.add_embedded([str(start + i) for i in range(100)], batch)
+        # Until the quantizer is trained, chunks are kept and searched at full precision.
+        assert knowledge.quantized == (start + 100 >= 300)
+    assert knowledge.embeddings_array is None
+    assert knowledge.codes_array.shape == (600, 8)
+    (results,) = knowledge.search_embeddings(rows[[450]], top_n=1)
+    assert results[0][1] == "450"
@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+import server
+
+
+def post(path: str, body) -> tuple:
+    """POST a JSON body to a fresh app, returning the status and response text."""
+
+    async def main():
+        async with TestClient(TestServer(server.create_app())) as client:
+            async with client.post(path, json=body) as response:
+                return response.status, await response.text()
+
+    return asyncio.run(main())
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """Record the arguments the knowledge endpoints are called with, instead of answering."""
+    calls = []
+
+    def add_to_knowledge(text, metadata):
+        calls.append((text, metadata))
+        return 1
+
+    async def get_relevant_knowledge_async(question, **kwargs):
+        calls.append((question, kwargs))
+        yield "Answer."
+
+    monkeypatch.setattr(server, "add_to_knowledge", add_to_knowledge)
+    monkeypatch.setattr(
+        server, "get_relevant_knowledge_async", get_relevant_knowledge_async
+    )
+    # Closing the app closes the LLM backend, which needn't exist for these tests.
+    monkeypatch.setattr(server, "close_backend", lambda app: asyncio.sleep(0))
+    return calls
+
+
+@pytest.mark.parametrize(
+    "context_tokens", ["1500", "many", 0, -5, 1.5, True, [1500]]
+)
+def test_bad_context_tokens_are_rejected(calls, context_tokens):
+    status, text = post(
+        "/knowledge/ask",
+        dict(question="What is § 32?", context_tokens=context_tokens),
+    )
+    assert status == 400
+    assert "'context_tokens' field must be a positive integer" in text
+    assert calls == []
+
+
+@pytest.mark.parametrize(
+    "filters", ["uk", ["uk"], {"jurisdiction": 1}, {"jurisdiction": ["uk", 2]}]
+)
+def test_bad_filters_are_rejected(calls, filters):
+    status, text = post(
+        "/knowledge/ask", dict(question="What is § 32?", filters=filters)
+    )
+    assert status == 400 and "'filters' field" in text
+    assert calls == []
+
+
+def test_valid_questions_are_answered(calls):
+    status, text = post(
+        "/knowledge/ask",
+        dict(
+            question="What is § 32?",
+            context_tokens=500,
+            filters={"jurisdiction": ["us", "us-ca"], "act": "IRC"},
+        ),
+    )
+    assert status == 200 and "Answer." in text and "event: done" in text
+    assert calls == [
+        (
+            "What is § 32?",
+            dict(
+                deltas=True,
+                context_tokens=500,
+                filters={"jurisdiction": ["us", "us-ca"], "act": "IRC"},
+            ),
+        )
+    ]
+    post("/knowledge/ask", dict(question="Why?", filters={}))
+    assert calls[-1][1]["context_tokens"] == server.CONTEXT_TOKENS
+    assert calls[-1][1]["filters"] is None
+
+
+@pytest.mark.parametrize(
+    "metadata", ["uk", {"jurisdiction": ["uk"]}, {"effective_date": 2024}]
+)
+def test_bad_metadata_is_rejected(calls, metadata):
+    status, text = post("/knowledge", dict(text="§ 1.", metadata=metadata))
+    assert status == 400 and "'metadata' field" in text
+    assert calls == []
+
+
+def test_valid_knowledge_is_added(calls):
+    status, text = post(
+        "/knowledge", dict(text="§ 1.", metadata={"jurisdiction": "uk"})
+    )
+    assert status == 200 and text == '{"added": 1}'
+    assert calls == [("§ 1.", {"jurisdiction": "uk"})]
+    post("/knowledge", dict(text="§ 2.", metadata=None))
+    assert calls[-1] == ("§ 2.", None)
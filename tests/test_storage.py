@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+from capabilities.helpers.storage import (
+    TextStore,
+    atomic_write,
+    load_matrix,
+    save_matrix,
+)
+
+
+def saved_store(tmp_path, values) -> TextStore:
+    store = TextStore()
+    store.extend(values)
+    store.save(str(tmp_path / "texts"))
+    return TextStore.load(str(tmp_path / "texts"))
+
+
+def test_text_store_round_trip(tmp_path):
+    values = ["first", "", "§ 32(b)(1) – “quoted”", "last"]
+    store = saved_store(tmp_path, values)
+    assert isinstance(store.blob, np.memmap)
+    assert store.stored == 4 and len(store) == 4
+    assert list(store) == values
+    assert store[-2] == values[-2]
+    assert store[1:3] == values[1:3]
+    with pytest.raises(IndexError):
+        store[4]
+
+
+def test_text_store_appends_after_loading(tmp_path):
+    store = saved_store(tmp_path, ["a", "b"])
+    store.extend(["c", "d"])
+    store.append("e")
+    assert store.stored == 2
+    assert list(store) == ["a", "b", "c", "d", "e"]
+    store.save(str(tmp_path / "texts"))
+    assert list(TextStore.load(str(tmp_path / "texts"))) == list("abcde")
+
+
+def test_empty_text_store_round_trip(tmp_path):
+    store = saved_store(tmp_path, [])
+    assert len(store) == 0 and list(store) == []
+    store.append("new")
+    assert list(store) == ["new"]
+
+
+def test_atomic_write_replaces_only_on_success(tmp_path):
+    path = tmp_path / "file"
+    path.write_bytes(b"old")
+    with pytest.raises(RuntimeError):
+        with atomic_write(str(path)) as f:
+            f.write(b"partial")
+            raise RuntimeError("interrupted")
+    assert path.read_bytes() == b"old"
+    assert not (tmp_path / "file.tmp").exists()
+    with atomic_write(str(path)) as f:
+        f.write(b"new")
+    assert path.read_bytes() == b"new"
+    assert not (tmp_path / "file.tmp").exists()
+
+
+def test_atomic_write_leaves_existing_maps_intact(tmp_path):
+    path = str(tmp_path / "matrix.bin")
+    old = np.arange(12, dtype=np.float32).reshape(3, 4)
+    save_matrix(path, old)
+    mapped = load_matrix(path)
+    save_matrix(path, -old)
+    np.testing.assert_array_equal(mapped, old)
+    np.testing.assert_array_equal(load_matrix(path), -old)
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float16, np.uint8])
+def test_matrix_round_trip(tmp_path, dtype):
+    path = str(tmp_path / "matrix.bin")
+    # Non-contiguous, so it has to be copied to be written.
+    matrix = np.arange(40).reshape(5, 8)[:, ::2].astype(dtype)
+    save_matrix(path, matrix)
+    loaded = load_matrix(path)
+    assert isinstance(loaded, np.memmap) and not loaded.flags.writeable
+    assert loaded.dtype == dtype and loaded.shape == (5, 4)
+    np.testing.assert_array_equal(loaded, matrix)
+
+
+@pytest.mark.parametrize("shape", [(0, 0), (0, 16)])
+def test_empty_matrix_round_trip(tmp_path, shape):
+    path = str(tmp_path / "matrix.bin")
+    save_matrix(path, np.zeros(shape, dtype=np.float32))
+    loaded = load_matrix(path)
+    assert loaded.shape == shape and loaded.dtype == np.float32
@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+
+from capabilities.helpers import streaming
+from capabilities.helpers.llm import accumulate, accumulate_async
+from capabilities.helpers.streaming import ThrottledRenderer, render_stream
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A monotonic clock which only moves when the test advances it."""
+
+    class Clock:
+        now = 0.0
+
+    monkeypatch.setattr(streaming.time, "monotonic", lambda: Clock.now)
+    return Clock
+
+
+def test_accumulate_ends_with_the_whole_text():
+    deltas = [f"token{i} " for i in range(1_000)]
+    updates = list(accumulate(deltas))
+    assert updates[0] == deltas[0]
+    assert updates[-1] == "".join(deltas)
+    assert all(b.startswith(a) for a, b in zip(updates, updates[1:]))
+    # Updates grow geometrically, so there are far fewer than deltas.
+    assert len(updates) < 40
+
+
+def test_accumulate_can_update_after_every_delta():
+    assert list(accumulate(["a", "", "b"], growth=0)) == ["a", "ab"]
+    assert list(accumulate([])) == []
+
+
+def test_accumulate_async_matches():
+    async def deltas():
+        for i in range(100):
+            yield f"{i} "
+
+    async def main():
+        return [text async for text in accumulate_async(deltas())]
+
+    expected = list(accumulate(f"{i} " for i in range(100)))
+    assert asyncio.run(main()) == expected
+
+
+def test_renders_the_first_delta_then_at_most_once_per_interval(clock):
+    renders = []
+    renderer = ThrottledRenderer(renders.append, min_interval=0.05)
+    for i in range(10):
+        renderer.write(str(i))
+        clock.now += 0.01
+    assert renders == ["0", "012345"]
+    renderer.flush()
+    assert renders[-1] == "0123456789"
+    assert renderer.render_count == 3
+    renderer.flush()
+    assert renderer.render_count == 3
+
+
+def test_either_limit_triggers_a_render(clock):
+    renders = []
+    renderer = ThrottledRenderer(
+        renders.append, min_interval=0.05, every_n_tokens=3
+    )
+    for delta in "abcd":
+        renderer.write(delta)
+    clock.now += 0.05
+    renderer.write("e")
+    assert renders == ["a", "abcd", "abcde"]
+
+
+def test_the_token_limit_throttles_on_its_own(clock):
+    renders = []
+    renderer = ThrottledRenderer(
+        renders.append, min_interval=None, every_n_tokens=4
+    )
+    for delta in "abcdefghij":
+        renderer.write(delta)
+        clock.now += 1
+    assert renders == ["a", "abcde", "abcdefghi"]
+
+
+def test_render_stream_always_finishes_with_the_whole_text(clock):
+    renders = []
+    text = render_stream(list("streamed"), renders.append, transform=str.upper)
+    assert text == "streamed"
+    assert renders == ["S", "STREAMED"]
+    renders.clear()
+    render_stream(list("abc"), renders.append, min_interval=None)
+    assert renders == ["a", "ab", "abc"]
@@ -0,0 +1,117 @@
+import pytest
+
+from benchmarks.common import synthetic_legislation
+from benchmarks.splitter import recursive_split
+from capabilities.helpers.text_splitters import (
+    LLM_SPLIT_MODEL,
+    NEXT_PATTERN,
+    BlockSplitter,
+    iter_sections,
+    section_header_split,
+    split_blocks,
+    stream_blocks,
+    window_split,
+)
+
+
+@pytest.mark.parametrize("n_sections", [1, 20, 300])
+@pytest.mark.parametrize("pattern", NEXT_PATTERN)
+def test_section_header_split_matches_the_recursive_split(n_sections, pattern):
+    text = synthetic_legislation(n_sections)
+    assert list(section_header_split(text, pattern)) == recursive_split(
+        text, pattern
+    )
+
+
+def test_short_text_is_dropped():
+    assert list(section_header_split("Too short.")) == []
+    assert recursive_split("Too short.") == []
+
+
+def test_sections_are_labelled_with_their_headers():
+    text = "Preamble " + "word " * 600
+    text += "\n\n§ 32. Earned income " + "credit " * 600
+    text += "\n\n(b) Percentages " + "rate " * 10
+    sections = list(iter_sections(text))
+    assert [s.reference for s in sections] == ["", "§ 32", "§ 32(b)"]
+
+
+YAML_BLOCK = '```yaml\ntitle: "Act s. 1"\n```\n1. Income tax is charged.'
+FENCED_BLOCK = "```python\nx = 1\n\ny = 2\n```"
+
+
+def test_blocks_keep_fences_and_headers_together():
+    text = f"{YAML_BLOCK}\n\n{FENCED_BLOCK}\n\n\n\nLast block.\n"
+    assert split_blocks(text) == [YAML_BLOCK, FENCED_BLOCK, "Last block."]
+
+
+def test_streamed_blocks_match_the_whole_text():
+    text = f"First.\n\n{YAML_BLOCK}\n\n{FENCED_BLOCK}\n\nLast."
+    splitter = BlockSplitter()
+    blocks = []
+    for character in text:
+        blocks += splitter.feed(character)
+    assert blocks + splitter.close() == split_blocks(text)
+
+
+PROMPT = "Split this."
+
+
+def window_text(n_windows: int) -> str:
+    paragraphs = [f"Paragraph {i} " + "word " * 8 for i in range(n_windows)]
+    return "\n\n".join(p.strip() for p in paragraphs)
+
+
+def stream(fake_llm, outputs, **kwargs):
+    text = window_text(len(outputs))
+    windows = window_split(text, max_words=10, overlap_words=0)
+    assert len(windows) == len(outputs)
+    for window, output in zip(windows, outputs):
+        key = fake_llm.key(PROMPT + "\n\n" + window, LLM_SPLIT_MODEL)
+        fake_llm.responses[key] = output
+    return list(
+        stream_blocks(PROMPT, text, max_words=10, overlap_words=0, **kwargs)
+    )
+
+
+def test_blocks_repeated_from_the_previous_window_are_dropped(fake_llm):
+    outputs = ["A\n\nB", "B\n\nC", "C\n\nD"]
+    assert stream(fake_llm, outputs) == ["A", "B", "C", "D"]
+
+
+def test_repeats_are_only_dropped_from_the_window_before(fake_llm):
+    outputs = ["A\n\nB", "", "B\n\nC"]
+    assert stream(fake_llm, outputs) == ["A", "B", "B", "C"]
+    outputs = ["A\n\nB", "C", "B\n\nD"]
+    assert stream(fake_llm, outputs, max_concurrency=1) == [
+        "A",
+        "B",
+        "C",
+        "B",
+        "D",
+    ]
+
+
+OVERLAP = (
+    "(b) Percentages. The credit percentage is 34 percent for an eligible "
+    "individual with 1 qualifying child."
+)
+
+
+def test_reworded_repeats_from_the_overlap_are_dropped(fake_llm):
+    # The second window renders the overlap with different spacing, case and punctuation.
+    rerendered = (
+        "(b)  Percentages - the credit percentage is 34 percent\n"
+        "for an eligible individual with 1 qualifying child"
+    )
+    outputs = [f"A\n\n{OVERLAP}", f"{rerendered}\n\nC"]
+    assert stream(fake_llm, outputs) == ["A", OVERLAP, "C"]
+
+
+def test_similar_but_distinct_blocks_are_kept(fake_llm):
+    different = (
+        "(c) Phaseout. The phaseout percentage is 15.98 percent for an "
+        "eligible individual with 1 qualifying child."
+    )
+    outputs = [f"A\n\n{OVERLAP}", f"{different}\n\nC"]
+    assert stream(fake_llm, outputs) == ["A", OVERLAP, different, "C"]
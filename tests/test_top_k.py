@@ -0,0 +1,45 @@
+import numpy as np
+
+from capabilities.helpers.knowledge_bases import top_k
+
+
+def test_selects_the_highest_scores_best_first():
+    rng = np.random.default_rng(0)
+    scores = rng.standard_normal(1_000).astype(np.float32)
+    indices, selected = top_k(scores, 10)
+    expected = np.argsort(-scores, kind="stable")[:10]
+    np.testing.assert_array_equal(indices, expected)
+    np.testing.assert_array_equal(selected, scores[expected])
+
+
+def test_ties_are_in_index_order():
+    scores = np.array([0.5, 0.9, 0.5, 0.9, 0.1, 0.5])
+    indices, selected = top_k(scores, 5)
+    np.testing.assert_array_equal(indices, [1, 3, 0, 2, 5])
+    np.testing.assert_array_equal(selected, [0.9, 0.9, 0.5, 0.5, 0.5])
+
+
+def test_ties_at_the_cut_keep_the_right_scores():
+    scores = np.array([0.5] * 10 + [1.0])
+    indices, selected = top_k(scores, 3)
+    assert indices[0] == 10
+    np.testing.assert_array_equal(selected, [1.0, 0.5, 0.5])
+    assert len(set(indices.tolist())) == 3
+
+
+def test_one_row_per_query():
+    scores = np.array([[0.1, 0.3, 0.2], [0.3, 0.2, 0.1]])
+    indices, selected = top_k(scores, 2)
+    np.testing.assert_array_equal(indices, [[1, 2], [0, 1]])
+    np.testing.assert_array_equal(selected, [[0.3, 0.2], [0.3, 0.2]])
+
+
+def test_k_larger_than_the_scores_returns_them_all():
+    indices, _ = top_k(np.array([0.2, 0.1, 0.3]), 10)
+    np.testing.assert_array_equal(indices, [2, 0, 1])
+
+
+def test_k_of_zero_is_empty():
+    indices, selected = top_k(np.array([0.2, 0.1]), 0)
+    assert indices.shape == (0,) and selected.shape == (0,)
+    assert indices.dtype == np.int64
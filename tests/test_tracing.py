@@ -0,0 +1,168 @@
+import asyncio
+import logging
+
+import pytest
+
+from capabilities.helpers import tracing
+from capabilities.helpers.tracing import (
+    NULL_SPAN,
+    HistogramRegistry,
+    JSONLogSink,
+    Span,
+    get_registry,
+    set_sinks,
+    span,
+    traced_astream,
+    traced_stream,
+)
+
+
+class RecordingSink:
+    def __init__(self):
+        self.spans = []
+
+    def emit(self, span: Span):
+        self.spans.append(span)
+
+
+@pytest.fixture
+def sink():
+    """Record spans, restoring the configured sinks after."""
+    sinks = tracing.get_sinks()
+    sink = RecordingSink()
+    set_sinks([sink])
+    yield sink
+    set_sinks(sinks)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A controllable replacement for `perf_counter` in the tracing module."""
+    now = [100.0]
+    monkeypatch.setattr(tracing, "perf_counter", lambda: now[0])
+    return now
+
+
+def test_unknown_sinks_are_ignored_with_a_warning(monkeypatch, caplog):
+    monkeypatch.setenv(tracing.TRACING_ENV_VAR, "log, metrcs ,metrics")
+    with caplog.at_level(logging.WARNING, logger=tracing.__name__):
+        sinks = tracing._sinks_from_environment()
+    assert [type(s) for s in sinks] == [JSONLogSink, HistogramRegistry]
+    assert "'metrcs'" in caplog.text
+    monkeypatch.setenv(tracing.TRACING_ENV_VAR, "nothing")
+    assert tracing._sinks_from_environment() == []
+
+
+def test_nothing_is_recorded_without_sinks():
+    sinks = tracing.get_sinks()
+    set_sinks([])
+    try:
+        assert span("stage", n=1) is NULL_SPAN
+        items = iter([1, 2])
+        assert traced_stream("stream", items) is items
+        assert not tracing.tracing_enabled() and get_registry() is None
+    finally:
+        set_sinks(sinks)
+
+
+def test_nested_spans_end_inner_first(sink, clock):
+    with span("outer", model="gpt-4") as outer:
+        clock[0] += 1
+        with span("inner") as inner:
+            clock[0] += 2
+            inner.set(chunks=3)
+        outer.mark("retrieved")
+        clock[0] += 1
+    assert [s.name for s in sink.spans] == ["inner", "outer"]
+    assert inner.duration == 2 and outer.duration == 4
+    assert outer.to_dict() == dict(
+        span="outer",
+        duration_seconds=4,
+        model="gpt-4",
+        retrieved_seconds=3,
+    )
+    assert inner.attributes == dict(chunks=3)
+
+
+def test_failed_spans_record_the_error(sink):
+    with pytest.raises(KeyError):
+        with span("stage"):
+            raise KeyError("missing")
+    assert sink.spans[0].attributes == dict(error="KeyError")
+
+
+def slow(clock, items):
+    for item in items:
+        clock[0] += 0.5
+        yield item
+
+
+def test_traced_stream_records_first_item_and_count(sink, clock):
+    stream = traced_stream(
+        "ask_gpt_stream",
+        slow(clock, "abc"),
+        first="first_token",
+        count="tokens",
+        model="gpt-4",
+    )
+    clock[0] += 10
+    # Timing starts when the stream is first read, not when it is created.
+    assert list(stream) == ["a", "b", "c"]
+    [recorded] = sink.spans
+    assert recorded.duration == 1.5
+    assert recorded.attributes == dict(
+        model="gpt-4", first_token_seconds=0.5, tokens=3
+    )
+
+
+def test_abandoned_streams_record_the_items_read(sink, clock):
+    stream = traced_stream("stream", slow(clock, "abcdef"))
+    assert next(stream) == "a" and next(stream) == "b"
+    stream.close()
+    assert sink.spans[0].attributes == dict(
+        first_item_seconds=0.5, items=2, abandoned=True
+    )
+
+
+def test_traced_astream_records_first_item_and_count(sink, clock):
+    async def items():
+        for item in "ab":
+            clock[0] += 0.25
+            yield item
+
+    async def main():
+        return [item async for item in traced_astream("astream", items())]
+
+    assert asyncio.run(main()) == ["a", "b"]
+    assert sink.spans[0].duration == 0.5
+    assert sink.spans[0].attributes == dict(first_item_seconds=0.25, items=2)
+
+
+def test_prometheus_text_has_cumulative_buckets():
+    registry = HistogramRegistry()
+    for duration, tokens in ((0.003, 7), (0.2, 40), (100.0, 40)):
+        recorded = Span("ask gpt", dict(tokens=tokens, cached=False))
+        recorded.duration = duration
+        registry.emit(recorded)
+    text = registry.prometheus()
+    lines = text.splitlines()
+    label = 'span="ask gpt"'
+    assert lines[0] == "# TYPE policyengine_ai_duration_seconds histogram"
+    for metric, le, count in (
+        ("duration_seconds", "0.001", 0),
+        ("duration_seconds", "0.005", 1),
+        ("duration_seconds", "0.25", 2),
+        ("duration_seconds", "60", 2),
+        ("duration_seconds", "+Inf", 3),
+        # Counts get count buckets.
+        ("tokens", "10", 1),
+        ("tokens", "50", 3),
+    ):
+        line = f'policyengine_ai_{metric}_bucket{{{label},le="{le}"}} {count}'
+        assert line in lines
+    assert f"policyengine_ai_duration_seconds_sum{{{label}}} 100.203" in lines
+    assert f"policyengine_ai_duration_seconds_count{{{label}}} 3" in lines
+    assert "# TYPE policyengine_ai_tokens histogram" in lines
+    # Booleans aren't observed.
+    assert "cached" not in text
+    assert text.endswith("\n")
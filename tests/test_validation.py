@@ -0,0 +1,93 @@
+from capabilities.helpers.validation import (
+    FileBlock,
+    FileBlockParser,
+    StreamValidator,
+    check_block,
+)
+
+VALID_YAML = "description: A rate.\nvalues:\n  2024-01-01: 0.2"
+BROKEN_YAML = "description: A rate.\nvalues:\n  - 2024-01-01: [0.2"
+VALID_PYTHON = "class rate(Variable):\n    value_type = float"
+OUTPUT = (
+    "Here are the files.\n\nparameters/gov/rate.yaml\n"
+    f"```yaml\n{BROKEN_YAML}\n```\n\nvariables/rate.py\n"
+    f"```python\n{VALID_PYTHON}\n```\nDone."
+)
+
+
+def deltas(text: str, size: int = 3):
+    return [text[i : i + size] for i in range(0, len(text), size)]
+
+
+def test_parser_names_blocks_by_the_path_before_them():
+    parser = FileBlockParser()
+    blocks = []
+    for delta in deltas(OUTPUT):
+        blocks += parser.feed(delta)
+    blocks += parser.close()
+    assert blocks == [
+        FileBlock("parameters/gov/rate.yaml", "yaml", BROKEN_YAML, 0),
+        FileBlock("variables/rate.py", "python", VALID_PYTHON, 1),
+    ]
+
+
+def test_parser_closes_a_block_left_open():
+    parser = FileBlockParser()
+    assert parser.feed("```\nvalue: 1\n") == []
+    (block,) = parser.close()
+    assert (block.content, block.name) == ("value: 1", "file_0.txt")
+
+
+def test_check_block():
+    def check(language, content):
+        return check_block(FileBlock(None, language, content, 0))
+
+    assert check("yaml", VALID_YAML) is None
+    assert check("yaml", BROKEN_YAML).startswith("YAML error")
+    assert check("yaml", "- a list") == (
+        "YAML error: expected a mapping of keys to values"
+    )
+    assert check("python", VALID_PYTHON) is None
+    assert check("python", "def f(:\n").startswith("SyntaxError")
+    assert check(None, "anything [") is None
+
+
+def test_only_broken_files_are_regenerated():
+    prompts = []
+
+    def regenerate(prompt):
+        prompts.append(prompt)
+        # Commentary after the block isn't read.
+        return deltas(f"```yaml\n{VALID_YAML}\n```\nNot read.")
+
+    validator = StreamValidator("Write files.", "model", regenerate=regenerate)
+    streamed = "".join(validator.watch(deltas(OUTPUT)))
+    result = validator.result
+    assert result.files == {
+        "parameters/gov/rate.yaml": VALID_YAML,
+        "variables/rate.py": VALID_PYTHON,
+    }
+    assert result.errors == {}
+    assert result.regenerated == ["parameters/gov/rate.yaml"]
+    (prompt,) = prompts
+    assert prompt.startswith("Write files.") and BROKEN_YAML in prompt
+    assert streamed.startswith(OUTPUT)
+    assert "Regenerated parameters/gov/rate.yaml (fixed)" in streamed
+
+
+def test_files_still_broken_after_every_retry_keep_their_error():
+    attempts = []
+
+    def regenerate(prompt):
+        attempts.append(prompt)
+        return [f"```yaml\n{BROKEN_YAML}\n```"]
+
+    validator = StreamValidator(
+        "Write files.", "model", max_retries=2, regenerate=regenerate
+    )
+    for delta in deltas(OUTPUT):
+        validator.feed(delta)
+    result = validator.close()
+    assert len(attempts) == 2
+    assert list(result.errors) == ["parameters/gov/rate.yaml"]
+    assert result.files["parameters/gov/rate.yaml"] == BROKEN_YAML